@@ -1,12 +1,17 @@
 from fastapi import FastAPI
 from config.setting import env
+from config.clickhouseDb import clickhouse_db
 from contextlib import asynccontextmanager
 from app.services.MedicalSearchService import medical_search_service
 from app.services.SalesService import sales_service
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 Starting Medical Search API...")
+    await clickhouse_db.initialize()
+    # Before the services compile any query: modes fall back to what the schema supports
+    await clickhouse_schema_service.detect()
     await medical_search_service.initialize()
     await sales_service.initialize()
     print("✅ Medical Search API started successfully with ClickHouse")
@@ -16,6 +21,7 @@ async def lifespan(app: FastAPI):
     print("🔄 Shutting down Medical Search API...")
     await medical_search_service.shutdown()
     await sales_service.shutdown()
+    await clickhouse_db.shutdown()
     print("✅ Medical Search API shutdown complete")
 
 app = FastAPI(
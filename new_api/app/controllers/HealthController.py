@@ -1,6 +1,12 @@
 from app.services.ClickHouseMedicalSearchService import clickhouse_medical_search_service
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
+from app.services.HotReplicaService import hot_replica_service
+from app.services.BillingCacheService import billing_cache_service
 from app.services.SalesService import sales_service
+from app.services.SearchCacheService import search_cache_service
+from app.services.StepStatsService import step_stats_service
 from app.utils.HttpResponseUtils import response_success, response_error
+from app.utils.SingleFlight import single_flight_metrics
 from datetime import datetime
 from typing import Dict, Any
 import logging
@@ -26,6 +32,12 @@ class HealthController:
                 'clickhouse_status': clickhouse_status['status'],
                 'clickhouse_details': clickhouse_status.get('details', {}),
                 'sales_service_status': sales_status['status'],
+                'clickhouse_schema': clickhouse_schema_service.snapshot(),
+                'search_cache': search_cache_service.metrics(),
+                'hot_replica': hot_replica_service.metrics(),
+                'step_stats': step_stats_service.metrics(),
+                'billing_cache': billing_cache_service.metrics(),
+                'single_flight': single_flight_metrics(),
                 'version': '2.0.0-clickhouse'
             }
             
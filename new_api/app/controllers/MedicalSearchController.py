@@ -1,13 +1,43 @@
 from app.services.MedicalSearchService import medical_search_service
 from app.schemas.searchSchema import UnifiedSearchRequest
-from app.utils.HttpResponseUtils import response_success, response_error
+from app.utils.HttpResponseUtils import response_success, response_success_json, response_error
 from datetime import datetime
 from typing import Dict, Any, List
 from app.services.BillingService import billing_service
+from config.setting import env
 import logging
+import pyarrow as pa
+import pyarrow.compute as pc
 
 logger = logging.getLogger(__name__)
 
+# Unified result field -> search document column
+UNIFIED_RESULT_FIELDS = [
+    ('patient_id', 'PatientId'),
+    ('admission_id', 'AdmissionId'),
+    ('doctor', 'PrimaryDoctor'),
+    ('specialty', 'Specialty'),
+    ('organization', 'OrganizationCode'),
+    ('disease', 'DiseaseClassification'),
+    ('procedure', 'ProcedureClassification'),
+    ('birth_date', 'BirthDate'),
+    ('sex', 'Sex'),
+    ('payer_name', 'PayerName'),
+    ('payer_type', 'PayerType'),
+    ('archetype', 'Archetype'),
+    ('region', 'Region'),
+    ('age', 'Age'),
+    ('length_of_stay', 'LengthOfStay'),
+    ('admission_date', 'AdmissionDate'),
+    ('admission_type', 'AdmissionTypeName'),
+    ('anesthesia_doctor', 'AnesthesiaDoctor'),
+    ('anesthesia_type', 'AnesthesiaType')
+]
+
+# search_meta.search_method per search engine that answered
+SEARCH_METHODS = {'scored': 'clickhouse_scored_similarity'}
+DEFAULT_SEARCH_METHOD = 'clickhouse_progressive_17_step'
+
 class MedicalSearchController:
     async def unified_search_with_billing(self, request: UnifiedSearchRequest):
         """
@@ -29,75 +59,76 @@ class MedicalSearchController:
             logger.info(f"🔍 UNIFIED ENDPOINT: Structured search with {len(structured_data)} fields")
             logger.debug(f"Structured data: {structured_data}")
             
-            # Use ClickHouse structured search (17-step progressive matching)
-            search_result = await medical_search_service.search_structured(
-                structured_data,
-                request.max_results
-            )
+            if env.unified_search_billing_mode == "columnar":
+                return await self._unified_search_columnar(structured_data, request.max_results)
+            
+            fused_billing = env.unified_search_billing_mode == "fused"
+            
+            if fused_billing:
+                # Search and billing aggregation in a single ClickHouse query
+                search_result = await medical_search_service.search_structured_with_billing(
+                    structured_data,
+                    request.max_results
+                )
+            else:
+                # Use ClickHouse structured search (17-step progressive matching)
+                search_result = await medical_search_service.search_structured(
+                    structured_data,
+                    request.max_results
+                )
+            
+            results = search_result.get('results', [])
+            billing_by_admission = {}
+            if fused_billing:
+                for admission in results:
+                    billing_data = admission.get('billing_data')
+                    if billing_data:
+                        billing_by_admission[admission.get('document', {}).get('AdmissionId')] = {
+                            "total_items": billing_data["total_items"],
+                            "total_amount": billing_data["total_amount"],
+                            "items": billing_data["items"]
+                        }
+            else:
+                # Fetch billing for every matched admission in one query
+                admission_ids = [
+                    admission.get('document', {}).get('AdmissionId')
+                    for admission in results
+                ]
+                # Only discharged admissions have final billing that can be cached
+                discharged_ids = [
+                    admission.get('document', {}).get('AdmissionId')
+                    for admission in results
+                    if admission.get('document', {}).get('DischargeDate')
+                ]
+                try:
+                    from app.services.SalesService import sales_service
+                    billing_summaries = await sales_service.get_sales_for_admissions(admission_ids, discharged_ids)
+                    billing_by_admission = {
+                        admission_id: self._billing_data_from_summary(billing_summary)
+                        for admission_id, billing_summary in billing_summaries.items()
+                    }
+                except Exception as e:
+                    logger.warning(f"Billing fetch failed for admissions {admission_ids}: {e}")
+                    pass  # Continue without billing data
             
             # Enhance with billing data
             enhanced_results = []
-            for admission in search_result.get('results', []):
+            for admission in results:
                 # Extract data from document field (ClickHouse format)
                 doc = admission.get('document', {})
                 admission_id = doc.get('AdmissionId')
                 
                 # Get billing data
-                billing_data = None
-                has_billing = False
-                
-                if admission_id:
-                    try:
-                        # Use SalesService directly for billing data
-                        from app.services.SalesService import sales_service
-                        billing_summary = await sales_service.get_sales_for_admission(admission_id)
-                        
-                        if billing_summary:
-                            # Convert AdmissionSalesSummary to billing_data format
-                            billing_data = {
-                                "total_items": billing_summary.total_items,
-                                "total_amount": billing_summary.total_amount,
-                                "items": [
-                                    {
-                                        "sales_item_id": item.sales_item_id,
-                                        "item_type": item.item_type,
-                                        "item_name": item.item_name,
-                                        "quantity": item.quantity,
-                                        "item_net_amount": item.item_net_amount
-                                    }
-                                    for item in billing_summary.items
-                                ]
-                            }
-                            has_billing = True
-                    except Exception as e:
-                        logger.warning(f"Billing fetch failed for admission {admission_id}: {e}")
-                        pass  # Continue without billing data
+                billing_data = billing_by_admission.get(admission_id) if admission_id else None
+                has_billing = billing_data is not None
                 
                 # Create clean unified result
-                clean_admission = {
-                    'patient_id': doc.get('PatientId'),
-                    'admission_id': doc.get('AdmissionId'),
-                    'doctor': doc.get('PrimaryDoctor'),
-                    'specialty': doc.get('Specialty'),
-                    'organization': doc.get('OrganizationCode'),
-                    'disease': doc.get('DiseaseClassification'),
-                    'procedure': doc.get('ProcedureClassification'),
-                    'birth_date': doc.get('BirthDate'),
-                    'sex': doc.get('Sex'),
-                    'payer_name': doc.get('PayerName'),
-                    'payer_type': doc.get('PayerType'),
-                    'archetype': doc.get('Archetype'),
-                    'region': doc.get('Region'),
-                    'age': doc.get('Age'),
-                    'length_of_stay': doc.get('LengthOfStay'),
-                    'admission_date': doc.get('AdmissionDate'),
-                    'admission_type': doc.get('AdmissionTypeName'),
-                    'anesthesia_doctor': doc.get('AnesthesiaDoctor'),
-                    'anesthesia_type': doc.get('AnesthesiaType'),
-                    'billing_data': billing_data,
-                    'has_billing': has_billing,
-                    'found_in_step': doc.get('result_step', 'UNKNOWN')  # ClickHouse search step
-                }
+                clean_admission = {field: doc.get(column) for field, column in UNIFIED_RESULT_FIELDS}
+                clean_admission['billing_data'] = billing_data
+                clean_admission['has_billing'] = has_billing
+                clean_admission['found_in_step'] = doc.get('result_step', 'UNKNOWN')  # ClickHouse search step
+                if 'similarity_score' in doc:
+                    clean_admission['similarity_score'] = doc['similarity_score']
                 enhanced_results.append(clean_admission)
             
             # Prepare clean response data
@@ -107,7 +138,12 @@ class MedicalSearchController:
                 'search_meta': {
                     'max_results': request.max_results,
                     'includes_billing': True,
-                    'search_method': 'clickhouse_progressive_17_step'
+                    'billing_mode': 'fused' if fused_billing else 'batched',
+                    'search_method': SEARCH_METHODS.get(search_result.get('engine'), DEFAULT_SEARCH_METHOD),
+                    'engine': search_result.get('engine'),
+                    'pruned_steps': medical_search_service.pruned_steps(structured_data, request.max_results),
+                    'partial': search_result.get('partial', False),
+                    'last_completed_step': search_result.get('last_completed_step')
                 }
             }
             
@@ -209,7 +245,10 @@ class MedicalSearchController:
             if top_admission_id:
                 try:
                     from app.services.SalesService import sales_service
-                    billing_summary = await sales_service.get_sales_for_admission(top_admission_id)
+                    billing_summary = await sales_service.get_sales_for_admission(
+                        top_admission_id,
+                        discharged=bool(top_admission.get('DischargeDate'))
+                    )
                     
                     if billing_summary and billing_summary.items:
                         # Get real-time pricing from pricing engine API
@@ -304,7 +343,11 @@ class MedicalSearchController:
                     "search_meta": {
                         "total_admissions_found": len(billing_references),
                         "top_admission_id": top_admission_id,
-                        "search_method": "clickhouse_progressive_17_step"
+                        "search_method": SEARCH_METHODS.get(search_result.get('engine'), DEFAULT_SEARCH_METHOD),
+                        "engine": search_result.get('engine'),
+                        "pruned_steps": medical_search_service.pruned_steps(structured_data, request.max_results),
+                        "partial": search_result.get('partial', False),
+                        "last_completed_step": search_result.get('last_completed_step')
                     }
                 }
             }
@@ -326,6 +369,113 @@ class MedicalSearchController:
                 }
             }
 
+    async def step_stats(self, limit: int = 50):
+        """Per request shape hit rates of the progressive search steps"""
+        try:
+            from app.services.StepStatsService import step_stats_service
+            response_data = {
+                'metrics': step_stats_service.metrics(),
+                'shapes': await step_stats_service.snapshot(limit)
+            }
+            return response_success(response_data, msg="Step statistics retrieved successfully")
+        except Exception as e:
+            logger.error(f"Step statistics lookup failed: {e}")
+            return response_error(str(e), msg="Failed to retrieve step statistics")
+
+    async def _unified_search_columnar(self, structured_data: Dict, max_results: int):
+        """Unified search kept columnar from ClickHouse to the response body.
+
+        Search results and billing items arrive as Arrow tables, are merged
+        column-wise and serialized once, skipping the intermediate row dicts
+        and jsonable_encoder passes of the row path.
+        """
+        search_table, search_meta = await medical_search_service.search_structured_columnar(structured_data, max_results)
+        
+        from app.services.ClickHouseService import clickhouse_service
+        billing_table = await clickhouse_service.get_sales_items_columnar(
+            search_table.column('AdmissionId').to_pylist()
+        )
+        
+        results = self._unified_results_from_columns(search_table, billing_table)
+        engine = search_meta['engine']
+        response_data = {
+            'results': results,
+            'total_found': len(results),
+            'search_meta': {
+                'max_results': max_results,
+                'includes_billing': True,
+                'billing_mode': 'columnar',
+                'search_method': SEARCH_METHODS.get(engine, DEFAULT_SEARCH_METHOD),
+                'engine': engine,
+                'pruned_steps': medical_search_service.pruned_steps(structured_data, max_results),
+                'partial': search_meta['partial'],
+                'last_completed_step': search_meta['last_completed_step']
+            }
+        }
+        return response_success_json(response_data, msg="Unified search completed successfully")
+
+    def _unified_results_from_columns(self, search_table, billing_table) -> List[Dict[str, Any]]:
+        """Build unified results from the search and billing tables with Arrow compute.
+
+        Billing items are grouped per admission and matched to the search rows
+        column-wise; Python objects are created once, by the final to_pylist().
+        """
+        if not search_table.num_rows:
+            return []
+        
+        # Billing items are ordered by AdmissionId, ItemNetAmount DESC, so each
+        # admission's items are one run of the table
+        billing_table = billing_table.combine_chunks()
+        runs = pc.run_end_encode(billing_table.column('AdmissionId').combine_chunks())
+        offsets = pa.concat_arrays([pa.array([0], type=runs.run_ends.type), runs.run_ends])
+        items = pc.make_struct(
+            *(billing_table.column(name).combine_chunks()
+              for name in ('sales_item_id', 'item_type', 'item_name', 'Quantity', 'ItemNetAmount')),
+            field_names=['sales_item_id', 'item_type', 'item_name', 'quantity', 'item_net_amount']
+        )
+        item_lists = pa.ListArray.from_arrays(offsets, items)
+        
+        totals = billing_table.group_by('AdmissionId').aggregate([('ItemNetAmount', 'sum')])
+        billing_ids = runs.values
+        total_amounts = totals.column('ItemNetAmount_sum').take(pc.index_in(billing_ids, value_set=totals.column('AdmissionId')))
+        billing_data = pc.make_struct(
+            pc.list_value_length(item_lists),
+            pc.round(total_amounts, 2),
+            item_lists,
+            field_names=['total_items', 'total_amount', 'items']
+        )
+        
+        # Row of each search result's admission in the grouped billing, null without billing
+        admission_ids = search_table.column('AdmissionId')
+        billing_rows = pc.index_in(admission_ids, value_set=billing_ids.cast(admission_ids.type))
+        result_billing = billing_data.take(billing_rows)
+        
+        steps = search_table.column('result_step')
+        columns = {field: search_table.column(column) for field, column in UNIFIED_RESULT_FIELDS}
+        columns['billing_data'] = result_billing
+        columns['has_billing'] = pc.is_valid(result_billing)
+        columns['found_in_step'] = pc.if_else(pc.equal(pc.fill_null(steps, ''), ''), 'UNKNOWN', steps)
+        if 'similarity_score' in search_table.column_names:
+            columns['similarity_score'] = search_table.column('similarity_score')
+        return pa.table(columns).to_pylist()
+
+    def _billing_data_from_summary(self, billing_summary) -> Dict[str, Any]:
+        """Convert AdmissionSalesSummary to billing_data format"""
+        return {
+            "total_items": billing_summary.total_items,
+            "total_amount": billing_summary.total_amount,
+            "items": [
+                {
+                    "sales_item_id": item.sales_item_id,
+                    "item_type": item.item_type,
+                    "item_name": item.item_name,
+                    "quantity": item.quantity,
+                    "item_net_amount": item.item_net_amount
+                }
+                for item in billing_summary.items
+            ]
+        }
+
     def _extract_structured_data(self, request: UnifiedSearchRequest) -> Dict:
         """Extract non-empty structured data fields from request"""
         structured_fields = {
@@ -0,0 +1,100 @@
+import logging
+from typing import Any, Dict, Iterable, List
+
+from app.models.SalesModel import AdmissionSalesSummary
+from app.utils.CacheUtils import ByteBoundedLRU
+from config.ratelimit import redis_connection
+from config.setting import env
+
+logger = logging.getLogger(__name__)
+
+class BillingCacheService:
+    """Two-tier cache of per-admission billing summaries.
+
+    Billing rows of a discharged admission rarely change, so summaries are kept
+    in a byte-bounded in-process LRU in front of Redis. Callers only store
+    admissions that have a DischargeDate; open admissions always hit ClickHouse.
+
+    sales_item_filtered is loaded outside this service, so nothing here learns
+    of late billing corrections: entries only expire. Both tiers drop a summary
+    billing_cache_ttl seconds after storing it (the local tier counts from when
+    it read the summary from Redis), so a correction can take up to twice that
+    to show.
+    """
+
+    KEY_PREFIX = "billing:admission:v1"
+
+    def __init__(self):
+        self.redis = redis_connection
+        self.local = ByteBoundedLRU(env.billing_cache_memory_bytes, env.billing_cache_ttl)
+        self._metrics = {
+            'local_hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'errors': 0
+        }
+
+    def _key(self, admission_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{admission_id}"
+
+    async def get_many(self, admission_ids: Iterable[int]) -> Dict[int, AdmissionSalesSummary]:
+        """Return cached summaries; admissions not in either tier are absent"""
+        if not env.billing_cache_enabled:
+            return {}
+
+        found = {}
+        remote_ids = []
+        for admission_id in admission_ids:
+            raw = self.local.get(admission_id)
+            if raw is None:
+                remote_ids.append(admission_id)
+            else:
+                found[admission_id] = AdmissionSalesSummary.model_validate_json(raw)
+                self._metrics['local_hits'] += 1
+
+        if remote_ids:
+            try:
+                remote_values = await self.redis.mget([self._key(admission_id) for admission_id in remote_ids])
+            except Exception as e:
+                self._metrics['errors'] += 1
+                logger.warning(f"Billing cache read failed: {e}")
+                remote_values = [None] * len(remote_ids)
+
+            for admission_id, raw in zip(remote_ids, remote_values):
+                if raw is None:
+                    self._metrics['misses'] += 1
+                    continue
+                self.local.set(admission_id, raw)
+                found[admission_id] = AdmissionSalesSummary.model_validate_json(raw)
+                self._metrics['redis_hits'] += 1
+
+        return found
+
+    async def set_many(self, summaries: List[AdmissionSalesSummary]):
+        if not env.billing_cache_enabled or not summaries:
+            return
+
+        try:
+            pipe = self.redis.pipeline()
+            for summary in summaries:
+                raw = summary.model_dump_json()
+                self.local.set(summary.admission_id, raw)
+                pipe.set(self._key(summary.admission_id), raw, ex=env.billing_cache_ttl)
+            await pipe.execute()
+            self._metrics['stores'] += len(summaries)
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Billing cache write failed: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'enabled': env.billing_cache_enabled,
+            **self._metrics,
+            'local_entries': len(self.local),
+            'local_bytes': self.local.current_bytes,
+            'local_max_bytes': self.local.max_bytes,
+            'local_evictions': self.local.evictions
+        }
+
+billing_cache_service = BillingCacheService()
@@ -2,15 +2,21 @@ from typing import List
 import json
 from app.services.GeminiService import gemini_service
 from app.prompts.summary_prompt import billing_summary
+from app.utils.SingleFlight import SingleFlight
 
 class BillingService:
     def __init__(self):
-        pass
+        self._summary_flight = SingleFlight("generate_billing_summary")
     
     async def generate_billing_summary(self, item_types: List[str]) -> List[str]:
         """
         Generate AI summary for billing item types using Gemini
+        
+        Concurrent requests for the same item types share one Gemini call.
         """
+        return await self._summary_flight.do(tuple(item_types), lambda: self._generate_billing_summary(item_types))
+    
+    async def _generate_billing_summary(self, item_types: List[str]) -> List[str]:
         try:
             if not item_types:
                 return []
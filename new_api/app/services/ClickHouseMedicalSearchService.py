@@ -1,35 +1,132 @@
-import clickhouse_connect
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from config.setting import env
+from config.clickhouseDb import clickhouse_db
+from app.utils.CacheUtils import canonical_key
+from app.utils.SingleFlight import SingleFlight
+from app.services.SearchPlan import (
+    BLANK_MATCHING_COLUMNS, PLAN_KEYS, SCORE_FALLOFF, load_score_weights, load_search_plan
+)
+from app.services.StepStatsService import step_stats_service
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
+from app.services.HotReplicaService import hot_replica_service
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import math
+import pyarrow as pa
+import time
+import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Every progressive step query is capped at this many rows
+STEP_RESULT_LIMIT = 50
+
+# Compiled plans kept per request shape before the memo is reset
+COMPILED_PLAN_CACHE_SIZE = 512
+
+# Admission columns returned to API clients; step queries select only these
+# plus the computed columns below, and rows are decoded by column name
+RESULT_COLUMNS = [
+    'AdmissionId', 'AdmissionTypeId', 'AdmissionTypeName', 'OrganizationCode',
+    'OrganizationId', 'AdmissionDate', 'DischargeDate', 'PatientId', 'BirthDate',
+    'Sex', 'PatientType', 'PatientTypeId', 'PrimaryDoctor', 'PrimaryDoctorUserId',
+    'Specialty', 'SpecialtyGroup', 'Region', 'Archetype', 'DiseaseClassification',
+    'ProcedureClassification', 'InvoiceClass', 'InvoiceClassId', 'PayerName',
+    'PayerId', 'PayerType', 'InvoiceNetAmount', 'Age', 'LengthOfStay',
+    'AnesthesiaDoctor', 'AnesthesiaType'
+]
+RESULT_PROJECTION = ", ".join(RESULT_COLUMNS)
+DOCUMENT_COLUMNS = RESULT_COLUMNS + ['age_diff', 'date_diff', 'result_step']
+
+# result_step of every row found by the "scored" engine
+SCORED_STEP = 'SCORED'
+
+# Request fields bound as {name:String} query parameters
+SEARCH_STRING_PARAMETERS = [
+    'hospital_code', 'payer_name', 'payer_type', 'primary_doctor', 'doctor_specialty',
+    'admission_type', 'gender', 'anesthesia_doctor', 'anesthesia_type', 'archetype',
+    'hospital_region', 'calculated_los', 'formatted_birth_date', 'formatted_admission_date'
+]
+
+# Arrow carries DateTime as raw epoch seconds, so the columnar path renders
+# temporal columns server-side in the form the JSON encoder would produce
+COLUMNAR_PROJECTION = ", ".join(
+    f"formatDateTime({name}, '%Y-%m-%dT%H:%i:%S') AS {name}" if name in ('AdmissionDate', 'DischargeDate')
+    else f"toString({name}) AS {name}" if name == 'BirthDate'
+    else name
+    for name in DOCUMENT_COLUMNS
+)
+
+# Billing aggregate of the fused search's matched admissions (CTE "matched"),
+# items grouped server-side
+FUSED_BILLING_AGGREGATE = """
+SELECT
+    AdmissionId,
+    count() AS total_items,
+    round(sum(toFloat64(ItemNetAmount)), 2) AS total_amount,
+    groupUniqArray(item_type) AS item_types,
+    arrayReverseSort(
+        item -> item.6,
+        groupArray((AdmissionId, sales_item_id, item_type, item_name, Quantity, toFloat64(ItemNetAmount)))
+    ) AS items
+FROM sales_item_filtered
+WHERE AdmissionId IN (SELECT AdmissionId FROM matched)
+GROUP BY AdmissionId
+"""
+
+class SearchContext:
+    """Per-request progressive search state (exclusion set, collected rows, step outcomes, deadline)"""
+
+    def __init__(self, max_results: int = 50, query_id: Optional[str] = None, deadline: Optional[float] = None):
+        self.max_results = max_results
+        self.query_id = query_id
+        self.started = False
+        self.found_admission_ids = set()
+        self.results = []
+        # Step name -> whether it contributed rows, for every step evaluated
+        self.step_outcomes = {}
+        # time.monotonic() by which the search must answer; None means no budget
+        self.deadline = deadline
+        self.partial = False
+        self.last_completed_step = None
+        # Engine that answered: search_engine, unless the request fell back to the step loop
+        self.engine = None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, None without one"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def add_results(self, step_results: List[Dict[str, Any]]):
+        self.results.extend(step_results)
+        for result in step_results:
+            self.found_admission_ids.add(result['AdmissionId'])
+
 class ClickHouseMedicalSearchService:
     """Medical search service using direct ClickHouse queries with 17-step progressive matching"""
     
     def __init__(self):
-        self.client = None
-        self.thread_pool = None
-        self.found_admission_ids = set()
-        self.results = []
+        self.db = clickhouse_db
+        self._search_flight = SingleFlight("search_similar_admissions")
+        self._plan = None
+        self._plan_digest = None
+        self._score_weights = None
+        self._compiled_plans = {}
         
     async def initialize(self):
         """Initialize ClickHouse connection"""
-        self.thread_pool = ThreadPoolExecutor(max_workers=4)
-        
         try:
-            # Initialize ClickHouse client using existing service settings
-            self.client = clickhouse_connect.get_client(
-                host=env.clickhouse_host,
-                port=env.clickhouse_port,
-                username=env.clickhouse_username,
-                password=env.clickhouse_password,
-                database=env.clickhouse_database
-            )
+            # Shared pool is created once and reused by every ClickHouse service
+            await self.db.initialize()
+            
+            # Fail at startup rather than on the first search if the plan is invalid
+            self._search_plan()
+            if env.search_engine == "scored":
+                self._scoring_weights()
+            
+            await hot_replica_service.initialize(RESULT_COLUMNS)
             
             # Test connection
             await self.health_check()
@@ -40,65 +137,83 @@ class ClickHouseMedicalSearchService:
             raise
 
     async def shutdown(self):
-        """Cleanup resources"""
-        if self.thread_pool:
-            self.thread_pool.shutdown(wait=True)
+        """Cleanup resources (the shared pool is closed by the application lifespan)"""
+        await hot_replica_service.shutdown()
 
     async def health_check(self) -> Dict[str, Any]:
         """Check ClickHouse connection health"""
-        try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                self.thread_pool,
-                lambda: self.client.query("SELECT 1").result_rows
-            )
-            return {
-                'status': 'healthy',
-                'clickhouse': 'connected'
-            }
-        except Exception as e:
-            return {
-                'status': 'error',
-                'error': str(e)
-            }
+        return await self.db.health_check()
 
     def _calculate_icd_scores(self, input_data: Dict, step_type: str = "exact") -> tuple:
-        """Calculate ICD match scores - exact matching uses = operator, partial uses LIKE"""
+        """Calculate ICD match scores - exact matching uses = operator, partial uses substring search
+        
+        With icd_match_mode "array", partial matching compares whole codes against the
+        tokenized DiseaseCodes/ProcedureCodes columns so the bloom-filter indexes apply.
+        With icd_exact_match_mode "hash", exact matching compares code-set fingerprints.
+        """
         icd10_codes = input_data.get('icd10', [])
         icd9_codes = input_data.get('icd9', [])
+        use_arrays = clickhouse_schema_service.mode('icd_match_mode') == "array"
+        code_arrays = {'DiseaseClassification': 'DiseaseCodes', 'ProcedureClassification': 'ProcedureCodes'}
+        code_hashes = {'DiseaseClassification': 'DiseaseCodesHash', 'ProcedureClassification': 'ProcedureCodesHash'}
+        
+        # Request codes are bound as Array(String) parameters
+        code_params = {'DiseaseClassification': '{icd10:Array(String)}', 'ProcedureClassification': '{icd9:Array(String)}'}
+        
+        def build_codes_array(field_name):
+            """Normalized request codes, matching the materialized column tokens"""
+            return f"arrayMap(code -> upper(trimBoth(code)), {code_params[field_name]})"
+        
+        def build_partial_filter(codes, field_name):
+            """Row matches at least one of the codes"""
+            if use_arrays:
+                return f"hasAny({code_arrays[field_name]}, {build_codes_array(field_name)})"
+            # Substring search for any code, as LIKE '%code%' OR ...
+            return f"multiSearchAny({field_name}, {code_params[field_name]})"
         
         def build_enhanced_score(codes, field_name):
             """Helper function to build score with penalty (for partial matching steps only)"""
             if not codes:
                 return "0"
             
+            codes_param = code_params[field_name]
+            if use_arrays:
+                array_column = code_arrays[field_name]
+                base_score = f"arrayCount(code -> has({array_column}, code), {build_codes_array(field_name)})"
+                code_count_penalty = f"if(length({array_column}) > length({codes_param}), -0.1, 0)"
+                return f"({base_score}) + ({code_count_penalty})"
+            
             # Base score (match counting)
-            base_score = " + ".join([f"CASE WHEN {field_name} LIKE '%{code}%' THEN 1 ELSE 0 END" for code in codes])
+            base_score = f"arrayCount(code -> position({field_name}, code) > 0, {codes_param})"
             
             # Code count penalty
-            input_code_count = len(codes)
-            code_count_penalty = f"CASE WHEN length({field_name}) - length(replace({field_name}, ';', '')) + 1 > {input_code_count} THEN -0.1 ELSE 0 END"
+            code_count_penalty = f"CASE WHEN length({field_name}) - length(replace({field_name}, ';', '')) + 1 > length({codes_param}) THEN -0.1 ELSE 0 END"
             
             return f"({base_score}) + ({code_count_penalty})"
         
-        def build_exact_codes_string(codes):
-            """Build exact match string for multiple codes"""
-            if not codes:
-                return ""
+        def build_exact_filter(codes, field_name):
+            """Row holds exactly these codes; the hash mode ignores order, case and spacing"""
+            if clickhouse_schema_service.mode('icd_exact_match_mode') == "hash":
+                code_set = f"arrayFilter(code -> code != '', {build_codes_array(field_name)})"
+                return f"{code_hashes[field_name]} = cityHash64(arraySort(arrayDistinct({code_set})))"
             # Keep original order to match database storage
-            return "; ".join(codes) #ini kalau buat prod, kalau pre-prod hapus " "
+            exact_text = f"arrayStringConcat({code_params[field_name]}, '; ')" #ini kalau buat prod, kalau pre-prod hapus " "
+            if clickhouse_schema_service.has('step_projections'):
+                # Implied by the text equality (the hash column's own expression over the
+                # same text) and lets the step projections' hash sort key prune granules
+                code_set = f"arrayFilter(code -> code != '', arrayMap(code -> upper(trimBoth(code)), splitByChar(';', {exact_text})))"
+                return f"{field_name} = {exact_text} AND {code_hashes[field_name]} = cityHash64(arraySort(arrayDistinct({code_set})))"
+            return f"{field_name} = {exact_text}"
         
         if step_type == "exact":
             # Steps 1-13: TRUE EXACT MATCHING - use = operator
             if icd10_codes:
-                exact_icd10_string = build_exact_codes_string(icd10_codes)
-                icd10_filter = f"DiseaseClassification = '{exact_icd10_string}'"
+                icd10_filter = build_exact_filter(icd10_codes, "DiseaseClassification")
             else:
                 icd10_filter = "1=1"
                 
             if icd9_codes:
-                exact_icd9_string = build_exact_codes_string(icd9_codes)
-                icd9_filter = f"ProcedureClassification = '{exact_icd9_string}'"
+                icd9_filter = build_exact_filter(icd9_codes, "ProcedureClassification")
             else:
                 icd9_filter = "1=1"
             
@@ -109,14 +224,12 @@ class ClickHouseMedicalSearchService:
         elif step_type == "partial":
             # Step 14: Use LIKE for partial matching
             if icd10_codes:
-                icd10_conditions = [f"DiseaseClassification LIKE '%{code}%'" for code in icd10_codes]
-                icd10_filter = "(" + " OR ".join(icd10_conditions) + ")"
+                icd10_filter = build_partial_filter(icd10_codes, "DiseaseClassification")
             else:
                 icd10_filter = "1=1"
                 
             if icd9_codes:
-                icd9_conditions = [f"ProcedureClassification LIKE '%{code}%'" for code in icd9_codes]
-                icd9_filter = "(" + " OR ".join(icd9_conditions) + ")"
+                icd9_filter = build_partial_filter(icd9_codes, "ProcedureClassification")
             else:
                 icd9_filter = "1=1"
             
@@ -127,14 +240,12 @@ class ClickHouseMedicalSearchService:
         elif step_type == "mixed":
             # Step 15: Exact ICD9 + Partial ICD10
             if icd10_codes:
-                icd10_conditions = [f"DiseaseClassification LIKE '%{code}%'" for code in icd10_codes]
-                icd10_filter = "(" + " OR ".join(icd10_conditions) + ")"  # OR for partial
+                icd10_filter = build_partial_filter(icd10_codes, "DiseaseClassification")  # OR for partial
             else:
                 icd10_filter = "1=1"
                 
             if icd9_codes:
-                exact_icd9_string = build_exact_codes_string(icd9_codes)
-                icd9_filter = f"ProcedureClassification = '{exact_icd9_string}'"  # = for exact
+                icd9_filter = build_exact_filter(icd9_codes, "ProcedureClassification")  # = for exact
             else:
                 icd9_filter = "1=1"
             
@@ -148,8 +259,7 @@ class ClickHouseMedicalSearchService:
             icd10_score = "0"     # No ICD10 scoring
                 
             if icd9_codes:
-                exact_icd9_string = build_exact_codes_string(icd9_codes)
-                icd9_filter = f"ProcedureClassification = '{exact_icd9_string}'"
+                icd9_filter = build_exact_filter(icd9_codes, "ProcedureClassification")
             else:
                 icd9_filter = "1=1"
             
@@ -162,8 +272,7 @@ class ClickHouseMedicalSearchService:
             icd10_score = "0"     # No ICD10 scoring
                 
             if icd9_codes:
-                icd9_conditions = [f"ProcedureClassification LIKE '%{code}%'" for code in icd9_codes]
-                icd9_filter = "(" + " OR ".join(icd9_conditions) + ")"
+                icd9_filter = build_partial_filter(icd9_codes, "ProcedureClassification")
             else:
                 icd9_filter = "1=1"
             
@@ -220,48 +329,73 @@ class ClickHouseMedicalSearchService:
 
         return processed_data
 
-    def _get_los_diff_calculation(self, input_data: Dict) -> str:
-        """Generate LOS difference calculation, handling empty calculated_los"""
+    def _get_los_diff_expression(self, input_data: Dict) -> str:
+        """LOS difference expression without alias"""
         calculated_los = input_data.get('calculated_los', '')
-        
+
         if calculated_los == '' or calculated_los is None:
             # If input has no LOS, just return 0 (no difference penalty)
-            return "0 as los_diff"
+            return "0"
+        elif clickhouse_schema_service.mode('search_ranking_mode') == "integer":
+            # Materialized toInt32OrZero(LengthOfStay) (migration 003)
+            return "abs(LengthOfStayDays - {los_days:Int32})"
         else:
             # Normal LOS difference calculation
-            return f"abs(toInt32OrZero(LengthOfStay) - {calculated_los}) as los_diff"
+            return "abs(toInt32OrZero(LengthOfStay) - {los_days:Int32})"
+
+    def _get_age_diff_expression(self, input_data: Dict) -> str:
+        # dateDiff counts year boundaries, i.e. the difference of calendar years,
+        # so the materialized BirthYear gives the same value (migration 003)
+        if clickhouse_schema_service.mode('search_ranking_mode') == "integer":
+            return "abs(BirthYear - toYear(toDate({formatted_birth_date:String})))"
+        return "abs(dateDiff('year', BirthDate, toDate({formatted_birth_date:String})))"
 
-    def _get_exclusion_clause(self) -> str:
-        """Generate exclusion clause for previous admission IDs"""
-        if not self.found_admission_ids:
+    def _get_date_diff_expression(self, input_data: Dict) -> str:
+        if clickhouse_schema_service.mode('search_ranking_mode') == "integer":
+            return "abs(AdmissionDayNum - toRelativeDayNum(parseDateTime({formatted_admission_date:String})))"
+        return "abs(dateDiff('day', AdmissionDate, parseDateTime({formatted_admission_date:String})))"
+
+    def _build_priority(self, field_name: str, key: str) -> str:
+        """0 when the field equals the input value of key, 1 otherwise (sorted ascending)"""
+        return f"CASE WHEN {field_name} = {{{key}:String}} THEN 0 ELSE 1 END"
+
+    def _get_exclusion_clause(self, ctx: SearchContext) -> str:
+        """Generate exclusion clause for admission IDs already found in this search"""
+        if not ctx.found_admission_ids:
             return ""
-        ids_str = ",".join(map(str, self.found_admission_ids))
-        return f"AND AdmissionId NOT IN ({ids_str})"
+        return "AND NOT has({excluded_ids:Array(Int64)}, AdmissionId)"
 
-    def _build_condition(self, field_name: str, value: str) -> str:
-        """Build WHERE condition, skip if value is empty"""
-        if not value or value.strip() == "":
+    def _build_condition(self, field_name: str, input_data: Dict, key: str) -> str:
+        """Build WHERE condition on the bound input value, skip if value is empty"""
+        value = str(input_data.get(key, '') or '')
+        if not value.strip():
             return ""
-        return f"{field_name} = '{value}'"
+        return f"{field_name} = {{{key}:String}}"
 
-    def _build_conditions(self, conditions: list) -> str:
-        """Combine multiple conditions, filtering out empty ones"""
-        valid_conditions = [cond.strip() for cond in conditions if cond and cond.strip()]
-        return " AND ".join(valid_conditions)
+    def _query_parameters(self, input_data: Dict, ctx: Optional[SearchContext] = None) -> Dict[str, Any]:
+        """Values bound to the {name:Type} placeholders of the search queries"""
+        parameters = {key: str(input_data.get(key, '') or '') for key in SEARCH_STRING_PARAMETERS}
+        parameters['icd10'] = list(input_data.get('icd10') or [])
+        parameters['icd9'] = list(input_data.get('icd9') or [])
+        calculated_los = input_data.get('calculated_los', '')
+        parameters['los_days'] = int(calculated_los) if calculated_los not in ('', None) else 0
+        if ctx is not None and ctx.found_admission_ids:
+            parameters['excluded_ids'] = sorted(ctx.found_admission_ids)
+        return parameters
 
-    def _build_where_clause(self, input_data: dict, base_conditions: list, extra_conditions: list = None) -> str:
+    def _build_where_clause(self, input_data: dict, ctx: SearchContext, base_conditions: list, extra_conditions: list = None) -> str:
         """Build complete WHERE clause with common fields, skipping empty ones"""
         conditions = base_conditions.copy()
         
         # Add common conditional fields
         conditions.extend([
-            self._build_condition('OrganizationCode', input_data.get('hospital_code', '')),
-            self._build_condition('PayerName', input_data.get('payer_name', '')),
-            self._build_condition('PrimaryDoctor', input_data.get('primary_doctor', '')),
-            self._build_condition('AdmissionTypeName', input_data.get('admission_type', '')),
-            self._build_condition('Sex', input_data.get('gender', '')),
-            self._build_condition('AnesthesiaDoctor', input_data.get('anesthesia_doctor', '')),
-            self._build_condition('AnesthesiaType', input_data.get('anesthesia_type', ''))
+            self._build_condition('OrganizationCode', input_data, 'hospital_code'),
+            self._build_condition('PayerName', input_data, 'payer_name'),
+            self._build_condition('PrimaryDoctor', input_data, 'primary_doctor'),
+            self._build_condition('AdmissionTypeName', input_data, 'admission_type'),
+            self._build_condition('Sex', input_data, 'gender'),
+            self._build_condition('AnesthesiaDoctor', input_data, 'anesthesia_doctor'),
+            self._build_condition('AnesthesiaType', input_data, 'anesthesia_type')
         ])
         
         # Add extra conditions if provided
@@ -272,7 +406,7 @@ class ClickHouseMedicalSearchService:
         valid_conditions = [cond.strip() for cond in conditions if cond and cond.strip()]
         
         # Add exclusion clause if it exists
-        exclusion = self._get_exclusion_clause()
+        exclusion = self._get_exclusion_clause(ctx)
         if exclusion:
             # Remove the 'AND' from exclusion since we'll add it in join
             exclusion_clean = exclusion.replace('AND ', '', 1)
@@ -284,650 +418,814 @@ class ClickHouseMedicalSearchService:
         else:
             return "WHERE " + " AND ".join(valid_conditions)
 
+    def _search_plan(self) -> List[Dict[str, Any]]:
+        """Deployment search plan (env.search_plan / env.search_plan_path), loaded once"""
+        if self._plan is None:
+            self._plan = load_search_plan(env.search_plan, env.search_plan_path)
+        return self._plan
+
+    def _scoring_weights(self) -> Dict[str, float]:
+        """Similarity score weights (env.search_score_weights over the defaults), loaded once"""
+        if self._score_weights is None:
+            self._score_weights = load_score_weights(env.search_score_weights)
+        return self._score_weights
+
+    def result_fingerprint(self) -> Dict[str, Any]:
+        """Settings that change what a search returns, for keying cached results"""
+        if self._plan_digest is None:
+            self._plan_digest = canonical_key("search_plan", self._search_plan())
+        return {
+            'engine': env.search_engine,
+            'plan': self._plan_digest,
+            'modes': clickhouse_schema_service.snapshot()['modes'],
+            'score_weights': self._scoring_weights() if env.search_engine == "scored" else None
+        }
+
+    def _plan_shape(self, input_data: Dict) -> tuple:
+        """Everything compiled step SQL depends on; the values themselves are bound parameters"""
+        calculated_los = input_data.get('calculated_los', '')
+        return (
+            clickhouse_schema_service.mode('icd_match_mode'),
+            clickhouse_schema_service.mode('icd_exact_match_mode'),
+            clickhouse_schema_service.mode('search_ranking_mode'),
+            clickhouse_schema_service.has('step_projections'),
+            bool(input_data.get('icd10')),
+            bool(input_data.get('icd9')),
+            calculated_los != '' and calculated_los is not None,
+            tuple(key for key in PLAN_KEYS if not str(input_data.get(key, '') or '').strip())
+        )
+
+    def _compiled_plan(self, input_data: Dict) -> Dict[str, Any]:
+        """Compiled steps for the request's shape, memoized"""
+        shape = self._plan_shape(input_data)
+        compiled = self._compiled_plans.get(shape)
+        if compiled is None:
+            if len(self._compiled_plans) >= COMPILED_PLAN_CACHE_SIZE:
+                self._compiled_plans.clear()
+            compiled = {
+                'steps': [self._compile_step(step, input_data) for step in self._search_plan()],
+                'pruned_plans': {},
+                'single_queries': {},
+                'scored_queries': {}
+            }
+            self._compiled_plans[shape] = compiled
+        return compiled
+
+    def _compile_step(self, step: Dict[str, Any], input_data: Dict) -> Dict[str, Any]:
+        """Turn a plan step into its WHERE conditions, ORDER BY keys and step queries"""
+        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, step['icd'])
+
+        conditions = [icd10_filter, icd9_filter]
+        blank_fields = []
+        for field_name, key in step['filters']:
+            if step['skip_empty']:
+                conditions.append(self._build_condition(field_name, input_data, key))
+            else:
+                conditions.append(f"{field_name} = {{{key}:String}}")
+                if field_name not in BLANK_MATCHING_COLUMNS and not str(input_data.get(key, '') or '').strip():
+                    blank_fields.append(key)
+        conditions = [cond.strip() for cond in conditions if cond and cond.strip() and cond.strip() != "1=1"]
+
+        sort_expressions = {
+            'age_diff': (self._get_age_diff_expression(input_data), "ASC"),
+            'date_diff': (self._get_date_diff_expression(input_data), "ASC"),
+            'los_diff': (self._get_los_diff_expression(input_data), "ASC"),
+            'icd10_score': (icd10_score, "DESC"),
+            'icd9_score': (icd9_score, "DESC")
+        }
+        order_by = [
+            sort_expressions[sort_key] if isinstance(sort_key, str)
+            else (self._build_priority(sort_key[1], sort_key[2]), "ASC")
+            for sort_key in step['order_by']
+        ]
+        # Constant keys (e.g. no LOS or no codes) don't affect the order, and a
+        # bare number in ORDER BY would be read as a column position
+        order_by = [(expr, direction) for expr, direction in order_by if not expr.strip().isdigit()]
+
+        def render(exclusion: str, limit: str = str(STEP_RESULT_LIMIT)) -> str:
+            where_clause = " AND ".join(conditions + [exclusion] if exclusion else conditions) or "1=1"
+            # AdmissionId last, so rows tied at the LIMIT are picked the same way every run
+            order_clause = ",\n            ".join([f"{expr} {direction}" for expr, direction in order_by] + ["AdmissionId ASC"])
+            return f"""
+        SELECT
+            {RESULT_PROJECTION},
+            {self._get_age_diff_expression(input_data)} as age_diff,
+            {self._get_date_diff_expression(input_data)} as date_diff,
+            '{step['name']}' as result_step
+        FROM {env.clickhouse_table_name}
+        WHERE {where_clause}
+        ORDER BY
+            {order_clause}
+        LIMIT {limit}
+        """
+
+        return {
+            'name': step['name'],
+            'plan_step': step,
+            'conditions': conditions,
+            'blank_fields': blank_fields,
+            'order_by': order_by,
+            'query': render(""),
+            'query_excluding': render("NOT has({excluded_ids:Array(Int64)}, AdmissionId)"),
+            'query_overfetch': render("", "{step_limit:UInt32}")
+        }
+
+    def _plan_steps(self, input_data: Dict, max_results: int) -> tuple:
+        """Compiled steps worth running for this request, and the ones pruned.
+
+        A step comparing a column against a blank request value is pruned: an
+        empty field is never a real match (except BLANK_MATCHING_COLUMNS). A
+        step whose conditions include all of an earlier kept step's is pruned
+        too: it only matches rows that step already returned, as long as no
+        step can be cut off by STEP_RESULT_LIMIT before max_results is reached.
+        """
+        compiled = self._compiled_plan(input_data)
+        prune_redundant = max_results <= STEP_RESULT_LIMIT
+        planned = compiled['pruned_plans'].get(prune_redundant)
+        if planned is not None:
+            return planned
+
+        active_steps, pruned_steps = [], []
+        for step in compiled['steps']:
+            if step['blank_fields']:
+                pruned_steps.append({'step': step['name'], 'reason': 'blank_input', 'fields': step['blank_fields']})
+                continue
+
+            covering_step = None
+            if prune_redundant:
+                conditions = set(step['conditions'])
+                covering_step = next(
+                    (kept for kept in active_steps if conditions.issuperset(kept['conditions'])), None
+                )
+            if covering_step:
+                pruned_steps.append({'step': step['name'], 'reason': 'redundant', 'covered_by': covering_step['name']})
+                continue
+
+            active_steps.append(step)
+
+        planned = compiled['pruned_plans'][prune_redundant] = (active_steps, pruned_steps)
+        return planned
+
+    def pruned_steps(self, input_data: Dict[str, Any], max_results: int = 50) -> List[Dict[str, Any]]:
+        """Plan steps skipped for this request, with the reason, for search metadata"""
+        if env.search_engine == "scored":
+            # The scored engine runs no plan steps
+            return []
+        processed_data = self._calculate_age_and_los(input_data)
+        return self._plan_steps(processed_data, max_results)[1]
+
     async def search_similar_admissions(self, input_data: Dict[str, Any], max_results: int = 50) -> List[Dict]:
         """Execute progressive search until we have enough results"""
-        # Reset for new search
-        self.found_admission_ids = set()
-        self.results = []
+        results, _ = await self.search_similar_admissions_with_meta(input_data, max_results)
+        return results
+
+    async def search_similar_admissions_with_meta(self, input_data: Dict[str, Any], max_results: int = 50) -> tuple:
+        """Progressive search returning (results, meta).
+
+        meta['partial'] is True when env.search_timeout ran out before the
+        search finished; the results are then those gathered up to
+        meta['last_completed_step']. Identical concurrent searches share one
+        execution.
+        """
+        key = canonical_key("search", {'input': input_data, 'max_results': max_results})
+        return await self._search_flight.do(
+            key, lambda: self._search_similar_admissions(input_data, max_results)
+        )
+
+    def _search_deadline(self) -> Optional[float]:
+        """Deadline for a search starting now, from env.search_timeout (seconds, 0 disables)"""
+        if env.search_timeout and env.search_timeout > 0:
+            return time.monotonic() + env.search_timeout
+        return None
+    
+    async def _search_similar_admissions(self, input_data: Dict[str, Any], max_results: int) -> tuple:
+        # State lives in a per-request context so concurrent searches don't share it
+        ctx = SearchContext(max_results, deadline=self._search_deadline())
         
         processed_data = self._calculate_age_and_los(input_data)
         
         logger.info(f"Calculated age at admission: {processed_data['calculated_age']} years")
         logger.info(f"Calculated length of stay: {processed_data['calculated_los']} days")
 
-        steps = [
-            self._step_1, self._step_2, self._step_3, self._step_4, self._step_5,
-            self._step_6, self._step_7, self._step_8, self._step_9, self._step_10,
-            self._step_11, self._step_12, self._step_13, self._step_14, self._step_15,
-            self._step_16, self._step_17
-        ]
+        steps, pruned_steps = self._plan_steps(processed_data, max_results)
+        if pruned_steps:
+            logger.info(f"Pruned steps: {', '.join(pruned['step'] for pruned in pruned_steps)}")
+
+        # The scored engine ranks candidates by similarity instead of by step
+        if env.search_engine == "scored":
+            ctx.engine = "scored"
+            results = await self._search_scored(processed_data, max_results, ctx)
+            return results, self._search_meta(ctx)
+
+        # The single query reproduces the step loop only while every step's
+        # LIMIT covers max_results, so larger requests stay on the loop
+        if env.search_engine == "single_query" and max_results <= STEP_RESULT_LIMIT:
+            ctx.engine = "single_query"
+            results = await self._search_single_query(processed_data, max_results, ctx, steps)
+            return results, self._search_meta(ctx)
+
+        # Skipping rests on the same first-matching-step semantics as the single query
+        adaptive = env.step_stats_enabled and max_results <= STEP_RESULT_LIMIT
+        if adaptive:
+            shape = step_stats_service.describe_shape(input_data)
+            stats = await step_stats_service.get_step_stats(shape)
+            steps, skipped_steps = await self._skip_cold_steps(processed_data, steps, stats, ctx)
+            # A probe-confirmed empty step counts as a run without rows
+            ctx.step_outcomes.update({step['name']: False for step in skipped_steps})
+
+        if env.search_engine == "parallel" and max_results <= STEP_RESULT_LIMIT:
+            ctx.engine = "parallel"
+            await self._run_steps_parallel(processed_data, steps, ctx)
+        else:
+            ctx.engine = "progressive"
+            await self._run_steps_serial(processed_data, steps, ctx)
+
+        if adaptive:
+            step_stats_service.record(shape, ctx.step_outcomes)
+
+        # Sort final results by found_in_step (ascending - earlier steps first)
+        final_results = ctx.results[:max_results]
+
+        # Position of each step in the plan, unknown labels last
+        step_positions = {step['name']: position for position, step in enumerate(self._search_plan())}
 
-        for i, step_func in enumerate(steps, 1):
-            if len(self.results) >= max_results:
+        def get_step_position(result):
+            step_name = result.get('result_step', '') if result else ''
+            return step_positions.get(step_name, len(step_positions))
+
+        final_results.sort(key=get_step_position)
+        if ctx.partial:
+            logger.warning(
+                f"Search deadline of {env.search_timeout}s reached after {ctx.last_completed_step or 'no step'}, "
+                f"returning {len(final_results)} partial results"
+            )
+        return final_results, self._search_meta(ctx)
+
+    def _search_meta(self, ctx: SearchContext) -> Dict[str, Any]:
+        return {'partial': ctx.partial, 'last_completed_step': ctx.last_completed_step, 'engine': ctx.engine}
+
+    async def _run_step(self, step: Dict[str, Any], input_data: Dict, ctx: SearchContext) -> List[Dict]:
+        """Execute one compiled plan step, excluding admissions found so far in ctx.
+
+        With search_exclusion_mode "client" the exclusion set never reaches
+        ClickHouse: the step over-fetches by the number of admissions already
+        found, which can displace at most that many of its first
+        STEP_RESULT_LIMIT new rows, and drops them locally.
+
+        Steps the hot replica covers are answered in process.
+        """
+        if env.hot_replica_enabled:
+            parameters = self._query_parameters(input_data)
+            if hot_replica_service.covers(step['plan_step'], parameters):
+                step_results = hot_replica_service.run_step(
+                    step['plan_step'], input_data, parameters, ctx.found_admission_ids, STEP_RESULT_LIMIT
+                )
+                if step_results is not None:
+                    return step_results
+
+        if not ctx.found_admission_ids:
+            return await self._execute_query(step['query'], ctx, self._query_parameters(input_data))
+
+        if env.search_exclusion_mode == "client":
+            parameters = self._query_parameters(input_data)
+            parameters['step_limit'] = STEP_RESULT_LIMIT + len(ctx.found_admission_ids)
+            step_results = await self._execute_query(step['query_overfetch'], ctx, parameters)
+            return [
+                result for result in step_results
+                if result['AdmissionId'] not in ctx.found_admission_ids
+            ][:STEP_RESULT_LIMIT]
+
+        return await self._execute_query(step['query_excluding'], ctx, self._query_parameters(input_data, ctx))
+
+    async def _run_steps_serial(self, input_data: Dict, steps: list, ctx: SearchContext):
+        """Run steps one after another, each excluding admissions found so far.
+
+        A step still running at the deadline is cancelled (and its query
+        killed); the search stops there and is marked partial.
+        """
+        search_id = uuid.uuid4().hex
+        for step in steps:
+            if len(ctx.results) >= ctx.max_results:
+                break
+
+            remaining = ctx.remaining()
+            if remaining is not None and remaining <= 0:
+                ctx.partial = True
                 break
 
-            logger.info(f"Executing Step {i}...")
+            logger.info(f"Executing {step['name']}...")
+            ctx.query_id = f"{search_id}-{step['name']}"
             try:
-                step_results = await step_func(processed_data)
+                step_results = await asyncio.wait_for(self._run_step(step, input_data, ctx), remaining)
 
+                ctx.step_outcomes[step['name']] = bool(step_results)
+                ctx.last_completed_step = step['name']
                 if step_results:
-                    logger.info(f"Step {i} found {len(step_results)} results")
-                    self.results.extend(step_results)
-                    for result in step_results:
-                        self.found_admission_ids.add(result[0])  # AdmissionId is first column
+                    logger.info(f"{step['name']} found {len(step_results)} results")
+                    ctx.add_results(step_results)
                 else:
-                    logger.info(f"Step {i} found no results")
+                    logger.info(f"{step['name']} found no results")
+            except asyncio.TimeoutError:
+                logger.warning(f"{step['name']} cancelled at the search deadline")
+                ctx.partial = True
+                await self._kill_queries([ctx.query_id])
+                break
             except Exception as e:
-                logger.error(f"Error in Step {i}: {str(e)}")
+                logger.error(f"Error in {step['name']}: {str(e)}")
                 continue
 
-        # Sort final results by found_in_step (ascending - earlier steps first)
-        final_results = self.results[:max_results]
-        
-        # Extract step numbers for sorting
-        def get_step_number(result):
-            step_str = result[-1] if result else ''
-            if isinstance(step_str, str) and step_str.startswith('STEP_'):
-                try:
-                    return int(step_str.split('_')[1])
-                except (IndexError, ValueError):
-                    return 999
-            return 999
-        
-        final_results.sort(key=get_step_number)
-        return final_results
-
-    # Progressive search step implementations
-    async def _step_1(self, input_data: Dict) -> List[Dict]:
-        """STEP 1: All exact matches with ICD prioritization"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-
-        conditions = [
-            icd10_filter,
-            icd9_filter,
-            self._build_condition('OrganizationCode', input_data.get('hospital_code', '')),
-            self._build_condition('PayerName', input_data.get('payer_name', '')),
-            self._build_condition('PrimaryDoctor', input_data.get('primary_doctor', '')),
-            self._build_condition('LengthOfStay', str(input_data.get('calculated_los', ''))),
-            self._build_condition('AdmissionTypeName', input_data.get('admission_type', '')),
-            self._build_condition('Sex', input_data.get('gender', '')),
-            self._build_condition('AnesthesiaDoctor', input_data.get('anesthesia_doctor', '')),
-            self._build_condition('AnesthesiaType', input_data.get('anesthesia_type', ''))
+    async def _run_steps_parallel(self, input_data: Dict, steps: list, ctx: SearchContext):
+        """Run steps concurrently and merge them in step order.
+
+        Step queries run without the exclusion clause, at most
+        env.search_parallel_fanout at a time. Rows already found by an earlier
+        step are dropped client-side: earlier steps contribute fewer than
+        max_results rows whenever a later step is still needed, so a step's
+        STEP_RESULT_LIMIT rows always cover what the serial loop would take from
+        it. Once max_results is reached, or the deadline passes, the remaining
+        steps are cancelled and their ClickHouse queries killed.
+        """
+        fanout = asyncio.Semaphore(max(1, env.search_parallel_fanout))
+        search_id = uuid.uuid4().hex
+        step_contexts = [
+            SearchContext(ctx.max_results, query_id=f"{search_id}-step-{i}", deadline=ctx.deadline)
+            for i in range(1, len(steps) + 1)
         ]
-        
-        where_clause = self._build_conditions(conditions)
-        if not where_clause.strip():
-            where_clause = "WHERE 1=1"
-        elif not where_clause.startswith('WHERE'):
-            where_clause = "WHERE " + where_clause
 
-        icd10_count = len(input_data.get('icd10', []))
-        icd9_count = len(input_data.get('icd9', []))
+        async def run_step(step, step_ctx):
+            async with fanout:
+                step_ctx.started = True
+                return await self._run_step(step, input_data, step_ctx)
 
-        query = f"""
-        SELECT 
-            *,
-            {icd10_count} as icd10_match_count,
-            {icd9_count} as icd9_match_count,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            'STEP_1' as result_step
-        FROM {env.clickhouse_table_name}
-        {where_clause}
-        ORDER BY 
-            age_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
+        tasks = [
+            asyncio.create_task(run_step(step, step_ctx))
+            for step, step_ctx in zip(steps, step_contexts)
+        ]
+
+        try:
+            for step, task in zip(steps, tasks):
+                if len(ctx.results) >= ctx.max_results:
+                    break
 
-        return await self._execute_query(query)
+                try:
+                    # Shielded so a deadline timeout leaves cancellation to the cleanup below
+                    step_results = await asyncio.wait_for(asyncio.shield(task), ctx.remaining())
+                except asyncio.TimeoutError:
+                    logger.warning(f"{step['name']} cancelled at the search deadline")
+                    ctx.partial = True
+                    break
+                except Exception as e:
+                    logger.error(f"Error in {step['name']}: {str(e)}")
+                    continue
 
-    async def _step_2(self, input_data: Dict) -> List[Dict]:
-        """STEP 2: Remove Anesthesia Doctor"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+                new_results = [
+                    result for result in step_results
+                    if result['AdmissionId'] not in ctx.found_admission_ids
+                ][:STEP_RESULT_LIMIT]
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            'STEP_2' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            AND PrimaryDoctor = '{input_data.get('primary_doctor', '')}'
-            AND LengthOfStay = '{input_data.get('calculated_los', '')}'
-            AND AdmissionTypeName = '{input_data.get('admission_type', '')}'
-            AND Sex = '{input_data.get('gender', '')}'
-            AND AnesthesiaType = '{input_data.get('anesthesia_type', '')}'
-            {exclusion}
-        ORDER BY 
-            age_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        
-        return await self._execute_query(query)
+                ctx.step_outcomes[step['name']] = bool(new_results)
+                ctx.last_completed_step = step['name']
+                if new_results:
+                    logger.info(f"{step['name']} found {len(new_results)} results")
+                    ctx.add_results(new_results)
+                else:
+                    logger.info(f"{step['name']} found no results")
+        finally:
+            pending = [(task, step_ctx) for task, step_ctx in zip(tasks, step_contexts) if not task.done()]
+            for task, _ in pending:
+                task.cancel()
 
-    async def _step_3(self, input_data: Dict) -> List[Dict]:
-        """STEP 3: Remove Anesthesia Type"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+            running_query_ids = [step_ctx.query_id for _, step_ctx in pending if step_ctx.started]
+            if pending:
+                logger.info(f"Cancelled {len(pending)} outstanding steps")
+            if running_query_ids:
+                await self._kill_queries(running_query_ids)
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            'STEP_3' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            AND PrimaryDoctor = '{input_data.get('primary_doctor', '')}'
-            AND LengthOfStay = '{input_data.get('calculated_los', '')}'
-            AND AdmissionTypeName = '{input_data.get('admission_type', '')}'
-            AND Sex = '{input_data.get('gender', '')}'
-            {exclusion}
-        ORDER BY 
-            age_diff ASC,
-            date_diff ASC
-        LIMIT 50
+    async def _skip_cold_steps(self, input_data: Dict, steps: List[Dict[str, Any]],
+                               stats: Dict[str, Dict[str, int]], ctx: SearchContext) -> tuple:
+        """Drop steps that rarely yield rows for this request shape, if a probe shows they are empty.
+
+        With max_results <= STEP_RESULT_LIMIT, the rows a step contributes are
+        exactly the rows whose first matching step it is. One probe query
+        computes that first step for every row that matches some cold step.
+        Cold steps that come back are kept. The others contribute nothing and
+        can be skipped without changing the results. If the probe fails, every
+        step runs.
         """
-        return await self._execute_query(query)
+        cold = set(step_stats_service.cold_steps(stats, [step['name'] for step in steps]))
+        if len(cold) < max(1, env.step_stats_min_skip):
+            return steps, []
+
+        try:
+            result = await self.db.query(
+                self._build_probe_query(steps, cold),
+                parameters=self._query_parameters(input_data),
+                settings=self._query_settings(ctx)
+            )
+        except Exception as e:
+            step_stats_service.record_probe(skipped=0, fallback=True)
+            logger.warning(f"Step probe failed, running every step: {e}")
+            return steps, []
 
-    async def _step_4(self, input_data: Dict) -> List[Dict]:
-        """STEP 4: Remove Gender"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+        productive_tiers = {row[0] for row in result.result_rows}
+        skipped_steps = [
+            step for tier, step in enumerate(steps, 1)
+            if step['name'] in cold and tier not in productive_tiers
+        ]
+        step_stats_service.record_probe(skipped=len(skipped_steps), fallback=len(skipped_steps) < len(cold))
+        if skipped_steps:
+            logger.info(f"Skipping cold steps: {', '.join(step['name'] for step in skipped_steps)}")
+        return [step for step in steps if step not in skipped_steps], skipped_steps
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            'STEP_4' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            AND PrimaryDoctor = '{input_data.get('primary_doctor', '')}'
-            AND LengthOfStay = '{input_data.get('calculated_los', '')}'
-            AND AdmissionTypeName = '{input_data.get('admission_type', '')}'
-            {exclusion}
-        ORDER BY 
-            age_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+    def _build_probe_query(self, steps: List[Dict[str, Any]], cold: set) -> str:
+        """First matching step of every row that matches at least one cold step"""
+        def predicate(step):
+            return "(" + " AND ".join(step['conditions'] or ["1=1"]) + ")"
 
-    async def _step_5(self, input_data: Dict) -> List[Dict]:
-        """STEP 5: Remove Admission Type, prioritize same gender"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+        # Steps after the last cold one can't change any cold step's tier
+        last_cold = max(tier for tier, step in enumerate(steps, 1) if step['name'] in cold)
+        tier_cases = ", ".join(f"{predicate(step)}, {tier}" for tier, step in enumerate(steps[:last_cold], 1))
+        cold_predicates = " OR ".join(predicate(step) for step in steps if step['name'] in cold)
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_5' as result_step
+        return f"""
+        SELECT DISTINCT multiIf({tier_cases}, 0) AS result_tier
         FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            AND PrimaryDoctor = '{input_data.get('primary_doctor', '')}'
-            {exclusion}
-        ORDER BY 
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+        WHERE {cold_predicates}
         """
-        return await self._execute_query(query)
 
-    async def _step_6(self, input_data: Dict) -> List[Dict]:
-        """STEP 6: Remove Length of Stay, add length of stay difference"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+    async def _kill_queries(self, query_ids: List[str]):
+        """Ask ClickHouse to stop queries whose results are no longer needed"""
+        try:
+            await self.db.kill_queries(query_ids)
+        except Exception as e:
+            logger.warning(f"Failed to kill queries {query_ids}: {e}")
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_6' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            AND PrimaryDoctor = '{input_data.get('primary_doctor', '')}'
-            {exclusion}
-        ORDER BY 
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+    async def _search_single_query(self, input_data: Dict, max_results: int, ctx: SearchContext,
+                                   steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Evaluate every plan step in one query; nothing is gathered if it hits the deadline"""
+        ctx.query_id = uuid.uuid4().hex
+        try:
+            results = await asyncio.wait_for(
+                self._execute_query(
+                    self._build_single_query(input_data, max_results), ctx, self._query_parameters(input_data)
+                ),
+                ctx.remaining()
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Single-query search cancelled at the search deadline")
+            ctx.partial = True
+            await self._kill_queries([ctx.query_id])
+            return []
 
-    async def _step_7(self, input_data: Dict) -> List[Dict]:
-        """STEP 7: Use Doctor Specialty instead of Doctor Name"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+        if steps:
+            ctx.last_completed_step = steps[-1]['name']
+        logger.info(f"Single-query search found {len(results)} results")
+        return results
 
-        doctor_specialty = input_data.get('doctor_specialty', '')
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_7' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            AND Specialty = '{input_data.get('doctor_specialty', '')}'
-            {exclusion}
-        ORDER BY 
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+    def _build_single_query(self, input_data: Dict, max_results: int) -> str:
+        """SQL evaluating all plan steps at once.
+
+        Each row is assigned the first step whose WHERE conditions it satisfies
+        (result_tier), then rows are ordered by tier and by that tier's own sort
+        keys. Because the step loop stops once max_results rows are found and
+        every step returns up to STEP_RESULT_LIMIT rows, this yields the same
+        rows and result_step labels as the loop for max_results <= STEP_RESULT_LIMIT.
         """
-        return await self._execute_query(query)
+        compiled = self._compiled_plan(input_data)
+        query = compiled['single_queries'].get(max_results)
+        if query is None:
+            steps, _ = self._plan_steps(input_data, max_results)
+            query = self._compile_single_query(steps, input_data, max_results)
+            compiled['single_queries'][max_results] = query
+        return query
 
-    async def _step_8(self, input_data: Dict) -> List[Dict]:
-        """STEP 8: Remove Doctor Name/Specialty"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+    def _compile_single_query(self, steps: List[Dict[str, Any]], input_data: Dict, max_results: int) -> str:
+        def predicate(step):
+            return "(" + " AND ".join(step['conditions'] or ["1=1"]) + ")"
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_8' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerName = '{input_data.get('payer_name', '')}'
-            {exclusion}
-        ORDER BY 
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+        # With every step pruned no row gets a tier and the query returns nothing
+        tier_cases = ", ".join(f"{predicate(step)}, {tier}" for tier, step in enumerate(steps, 1))
+        tier_expr = f"multiIf({tier_cases}, 0)" if steps else "0"
+        step_labels = ", ".join(f"'{step['name']}'" for step in steps) or "''"
 
-    async def _step_9(self, input_data: Dict) -> List[Dict]:
-        """STEP 9: Use Payer Type instead of Payer Name"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+        # Sort key N of the row's own tier; DESC keys are negated so every key sorts ASC
+        sort_keys = []
+        for position in range(max((len(step['order_by']) for step in steps), default=0)):
+            cases = []
+            for tier, step in enumerate(steps, 1):
+                if position < len(step['order_by']):
+                    expr, direction = step['order_by'][position]
+                    value = f"toFloat64({expr})"
+                    cases.append(f"result_tier = {tier}, {'-' if direction == 'DESC' else ''}{value}")
+            if cases:
+                sort_keys.append(f"multiIf({', '.join(cases)}, 0) ASC")
+
+        order_by = ",\n            ".join(["result_tier ASC"] + sort_keys + ["AdmissionId ASC"])
 
         query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN PrimaryDoctor = '{input_data.get('primary_doctor', '')}' THEN 0 ELSE 1 END as doctor_priority,
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_9' as result_step
+        SELECT
+            {RESULT_PROJECTION},
+            {tier_expr} as result_tier,
+            {self._get_age_diff_expression(input_data)} as age_diff,
+            {self._get_date_diff_expression(input_data)} as date_diff,
+            arrayElement([{step_labels}], result_tier) as result_step
         FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            AND PayerType = '{input_data.get('payer_type', '')}'
-            {exclusion}
-        ORDER BY 
-            doctor_priority ASC,
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+        WHERE result_tier > 0
+        ORDER BY
+            {order_by}
+        LIMIT 1 BY AdmissionId
+        LIMIT {int(max_results)}
         """
-        return await self._execute_query(query)
+        return query
 
-    async def _step_10(self, input_data: Dict) -> List[Dict]:
-        """STEP 10: Remove Payer Type, keep Hospital Name"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+    async def _search_scored(self, input_data: Dict, max_results: int, ctx: SearchContext) -> List[Dict[str, Any]]:
+        """Top max_results candidates by similarity score; nothing is gathered if it hits the deadline"""
+        ctx.query_id = uuid.uuid4().hex
+        try:
+            results = await asyncio.wait_for(
+                self._execute_query(
+                    self._build_scored_query(input_data, max_results), ctx, self._query_parameters(input_data)
+                ),
+                ctx.remaining()
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Scored search cancelled at the search deadline")
+            ctx.partial = True
+            await self._kill_queries([ctx.query_id])
+            return []
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN PrimaryDoctor = '{input_data.get('primary_doctor', '')}' THEN 0 ELSE 1 END as doctor_priority,
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_10' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND OrganizationCode = '{input_data.get('hospital_code', '')}'
-            {exclusion}
-        ORDER BY 
-            doctor_priority ASC,
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+        ctx.last_completed_step = SCORED_STEP
+        logger.info(f"Scored search found {len(results)} results")
+        return results
 
-    async def _step_11(self, input_data: Dict) -> List[Dict]:
-        """STEP 11: Use Hospital Archetype instead of Hospital Name"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+    def _build_scored_query(self, input_data: Dict, max_results: int) -> str:
+        """SQL ranking every ICD-matching admission by a weighted similarity score.
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN PayerName = '{input_data.get('payer_name', '')}' THEN 0 ELSE 1 END as payer_name_priority,
-            CASE WHEN PayerType = '{input_data.get('payer_type', '')}' THEN 0 ELSE 1 END as payer_type_priority,
-            CASE WHEN PrimaryDoctor = '{input_data.get('primary_doctor', '')}' THEN 0 ELSE 1 END as doctor_priority,
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_11' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND Archetype = '{input_data.get('archetype', '')}'
-            {exclusion}
-        ORDER BY 
-            payer_name_priority ASC,
-            payer_type_priority ASC,
-            doctor_priority ASC,
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+        Candidates share at least one code with the request (any row when it
+        has none). similarity_score is the points earned over the points
+        available for the request's non-blank criteria, from 0 to 100; ties
+        go to the closer age, then the closer admission date.
         """
-        return await self._execute_query(query)
+        compiled = self._compiled_plan(input_data)
+        query = compiled['scored_queries'].get(max_results)
+        if query is None:
+            query = compiled['scored_queries'][max_results] = self._compile_scored_query(input_data, max_results)
+        return query
 
-    async def _step_12(self, input_data: Dict) -> List[Dict]:
-        """STEP 12: Same as Step 11 but different sorting"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+    def _compile_scored_query(self, input_data: Dict, max_results: int) -> str:
+        weights = self._scoring_weights()
+        exact10, exact9, _, _ = self._calculate_icd_scores(input_data, "exact")
+        partial10, partial9, overlap10, overlap9 = self._calculate_icd_scores(input_data, "partial")
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN PrimaryDoctor = '{input_data.get('primary_doctor', '')}' THEN 0 ELSE 1 END as doctor_priority,
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_12' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND Archetype = '{input_data.get('archetype', '')}'
-            {exclusion}
-        ORDER BY 
-            doctor_priority ASC,
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+        def present(key):
+            return bool(str(input_data.get(key, '') or '').strip())
 
-    async def _step_13(self, input_data: Dict) -> List[Dict]:
-        """STEP 13: Use Hospital Region instead of Archetype"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+        # Each term is (points expression, points available)
+        terms = []
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN PrimaryDoctor = '{input_data.get('primary_doctor', '')}' THEN 0 ELSE 1 END as doctor_priority,
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_13' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            AND Region = '{input_data.get('hospital_region', '')}'
-            {exclusion}
-        ORDER BY 
-            doctor_priority ASC,
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+        def add_levels(levels):
+            """Points of the best matching level of a hierarchy"""
+            levels = [(column, key, weights[name]) for column, key, name in levels if present(key) and weights[name]]
+            if levels:
+                cases = ", ".join(f"{column} = {{{key}:String}}, {weight}" for column, key, weight in levels)
+                terms.append((f"multiIf({cases}, 0)", max(weight for _, _, weight in levels)))
 
-    async def _step_14(self, input_data: Dict) -> List[Dict]:
-        """STEP 14: Only exact ICD codes (no other constraints)"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "exact")
-        exclusion = self._get_exclusion_clause()
+        def add(expr, weight):
+            if weight:
+                terms.append((f"{weight} * ({expr})", weight))
 
-        query = f"""
-        SELECT 
-            *,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            CASE WHEN OrganizationCode = '{input_data.get('hospital_code', '')}' THEN 0 ELSE 1 END as hospital_priority,
-            CASE WHEN Region = '{input_data.get('hospital_region', '')}' THEN 0 ELSE 1 END as region_priority,
-            CASE WHEN Archetype = '{input_data.get('archetype', '')}' THEN 0 ELSE 1 END as archetype_priority,
-            CASE WHEN PrimaryDoctor = '{input_data.get('primary_doctor', '')}' THEN 0 ELSE 1 END as doctor_priority,
-            CASE WHEN AdmissionTypeName = '{input_data.get('admission_type', '')}' THEN 0 ELSE 1 END as admission_type_priority,
-            CASE WHEN Sex = '{input_data.get('gender', '')}' THEN 0 ELSE 1 END as gender_priority,
-            'STEP_14' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            {exclusion}
-        ORDER BY 
-            hospital_priority ASC,
-            region_priority ASC,
-            archetype_priority ASC,
-            doctor_priority ASC,
-            admission_type_priority ASC,
-            gender_priority ASC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
-        """
-        return await self._execute_query(query)
+        candidates = []
+        for codes, exact, partial, overlap, param in (
+            ('icd10', exact10, partial10, overlap10, '{icd10:Array(String)}'),
+            ('icd9', exact9, partial9, overlap9, '{icd9:Array(String)}')
+        ):
+            if input_data.get(codes):
+                add(f"toFloat64({exact})", weights[f'{codes}_exact'])
+                # Share of the request codes the row holds (the partial steps' score, penalty clipped)
+                add(f"least(1, greatest(0, {overlap}) / length({param}))", weights[f'{codes}_overlap'])
+                candidates.append(partial)
+
+        add_levels([('OrganizationCode', 'hospital_code', 'hospital'), ('Archetype', 'archetype', 'archetype'),
+                    ('Region', 'hospital_region', 'region')])
+        add_levels([('PayerName', 'payer_name', 'payer_name'), ('PayerType', 'payer_type', 'payer_type')])
+        add_levels([('PrimaryDoctor', 'primary_doctor', 'doctor'), ('Specialty', 'doctor_specialty', 'specialty')])
+        add_levels([('AdmissionTypeName', 'admission_type', 'admission_type')])
+        add_levels([('Sex', 'gender', 'gender')])
+        add(f"greatest(0, 1 - age_diff / {SCORE_FALLOFF['age']})", weights['age'])
+        if input_data.get('calculated_los') not in ('', None):
+            add(f"greatest(0, 1 - {self._get_los_diff_expression(input_data)} / {SCORE_FALLOFF['los']})", weights['los'])
 
-    async def _step_15(self, input_data: Dict) -> List[Dict]:
-        """STEP 15: Exact ICD9 + Partial ICD10 (no other constraints)"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "mixed")
-        exclusion = self._get_exclusion_clause()
+        points = " + ".join(expr for expr, _ in terms) or "0"
+        score = f"round(100 * ({points}) / {sum(weight for _, weight in terms) or 1}, 2)"
+        where_clause = " OR ".join(f"({candidate})" for candidate in candidates) or "1=1"
 
         query = f"""
-        SELECT 
-            *,
-            ({icd10_score}) as icd10_match_count,
-            ({icd9_score}) as icd9_match_count,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            'STEP_15' as result_step
+        SELECT
+            {RESULT_PROJECTION},
+            {self._get_age_diff_expression(input_data)} as age_diff,
+            {self._get_date_diff_expression(input_data)} as date_diff,
+            '{SCORED_STEP}' as result_step,
+            {score} as similarity_score
         FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd10_filter}
-            AND {icd9_filter}
-            {exclusion}
-        ORDER BY 
-            icd9_match_count DESC,   -- Exact ICD9 matches first
-            icd10_match_count DESC,  -- Then partial ICD10 matches
+        WHERE {where_clause}
+        ORDER BY
+            similarity_score DESC,
             age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+            date_diff ASC,
+            AdmissionId ASC
+        LIMIT {int(max_results)}
         """
-        return await self._execute_query(query)
+        return query
+
+    def one_query_engine(self) -> str:
+        """Engine answering the fused and columnar paths: scored when configured, else the single query"""
+        return "scored" if env.search_engine == "scored" else "single_query"
+
+    def _build_one_query(self, input_data: Dict, max_results: int) -> str:
+        """Ranked search SQL of one_query_engine() for the fused and columnar paths"""
+        if self.one_query_engine() == "scored":
+            return self._build_scored_query(input_data, max_results)
+        return self._build_single_query(input_data, min(max_results, STEP_RESULT_LIMIT))
 
-    async def _step_16(self, input_data: Dict) -> List[Dict]:
-        """STEP 16: Only exact ICD9 (ignore ICD10 completely)"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "icd9_only_exact")
-        exclusion = self._get_exclusion_clause()
+    def _one_query_context(self, max_results: int) -> SearchContext:
+        """Deadline-bound context of a fused or columnar search"""
+        ctx = SearchContext(max_results, deadline=self._search_deadline())
+        ctx.engine = self.one_query_engine()
+        return ctx
+
+    def _one_query_completed(self, ctx: SearchContext, input_data: Dict):
+        """Record the ranked query as finished: it has evaluated every plan step (or scored every candidate)"""
+        if ctx.engine == "scored":
+            ctx.last_completed_step = SCORED_STEP
+            return
+        steps, _ = self._plan_steps(input_data, min(ctx.max_results, STEP_RESULT_LIMIT))
+        if steps:
+            ctx.last_completed_step = steps[-1]['name']
+
+    def _deadline_reached(self, ctx: SearchContext) -> bool:
+        remaining = ctx.remaining()
+        return remaining is not None and remaining <= 0
+
+    async def search_similar_admissions_with_billing(self, input_data: Dict[str, Any], max_results: int = 50) -> Dict[str, Any]:
+        """One-query search (scored or tiered) joined with each admission's aggregated billing.
+
+        Matched admissions and their sales_item_filtered rows come back from one
+        ClickHouse query; items are grouped into arrays server-side, so no
+        second billing round trip is needed. The ranked query is a CTE read by
+        both the join and the billing filter; its AdmissionId tiebreaker makes
+        both evaluations pick the same rows. Results are formatted like
+        format_results_for_api, with a billing_data entry per result and the
+        partial / last_completed_step / engine metadata of the progressive
+        path: a search cut off at the deadline returns no rows, marked partial.
+        """
+        processed_data = self._calculate_age_and_los(input_data)
+        matched_query = self._build_one_query(processed_data, max_results)
 
         query = f"""
-        SELECT 
-            *,
-            ({icd9_score}) as icd9_match_count,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            'STEP_16' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd9_filter}
-            {exclusion}
-        ORDER BY 
-            icd9_match_count DESC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+        WITH matched AS (
+            {matched_query}
+        )
+        SELECT
+            ranked.*,
+            billing.total_items AS billing_total_items,
+            billing.total_amount AS billing_total_amount,
+            billing.item_types AS billing_item_types,
+            billing.items AS billing_items
+        FROM (SELECT *, rowNumberInAllBlocks() AS result_rank FROM matched) AS ranked
+        LEFT JOIN ({FUSED_BILLING_AGGREGATE}) AS billing ON ranked.AdmissionId = billing.AdmissionId
+        ORDER BY ranked.result_rank
         """
-        return await self._execute_query(query)
 
-    async def _step_17(self, input_data: Dict) -> List[Dict]:
-        """STEP 17: Only partial ICD9 (ignore ICD10 completely)"""
-        icd10_filter, icd9_filter, icd10_score, icd9_score = self._calculate_icd_scores(input_data, "icd9_only_partial")
-        exclusion = self._get_exclusion_clause()
+        # Bounded by the search timeout like the progressive steps
+        ctx = self._one_query_context(max_results)
+        try:
+            result = await self.db.query(
+                query, parameters=self._query_parameters(processed_data), settings=self._query_settings(ctx)
+            )
+        except Exception as e:
+            if self._deadline_reached(ctx):
+                logger.warning("Fused search cut off at the search deadline")
+                ctx.partial = True
+            else:
+                logger.error(f"Fused search query failed: {e}")
+            return {**self.format_results_for_api([]), **self._search_meta(ctx)}
+        self._one_query_completed(ctx, processed_data)
+
+        rows = [dict(zip(result.column_names, row)) for row in result.result_rows]
+        formatted_results = []
+        for values in rows:
+            document = self._document_from_row(values)
+
+            billing_data = None
+            if values.get('billing_total_items'):
+                billing_data = {
+                    "total_items": values['billing_total_items'],
+                    "total_amount": values['billing_total_amount'],
+                    "item_types": list(values['billing_item_types']),
+                    "items": [
+                        {
+                            "sales_item_id": str(item[1]) if item[1] else '',
+                            "item_type": item[2] or '',
+                            "item_name": item[3] or '',
+                            "quantity": item[4] or 0,
+                            "item_net_amount": float(item[5] or 0)
+                        }
+                        for item in values['billing_items']
+                    ]
+                }
+
+            formatted_results.append({
+                'document': document,
+                'highlights': {},
+                'text_match': values.get('similarity_score', 100),
+                'billing_data': billing_data
+            })
+
+        logger.info(f"Fused search found {len(formatted_results)} results")
+        return {
+            'found': len(formatted_results),
+            'results': formatted_results,
+            'search_time_ms': 0,
+            'page': 1,
+            **self._search_meta(ctx)
+        }
+
+    async def search_similar_admissions_columnar(self, input_data: Dict[str, Any], max_results: int = 50) -> pa.Table:
+        """One-query search fetched as a pyarrow.Table of DOCUMENT_COLUMNS (plus similarity_score when scored) in rank order"""
+        table, _ = await self.search_similar_admissions_columnar_with_meta(input_data, max_results)
+        return table
+
+    async def search_similar_admissions_columnar_with_meta(self, input_data: Dict[str, Any], max_results: int = 50) -> tuple:
+        """Columnar search returning (table, meta); a search cut off at the deadline is an empty, partial table"""
+        processed_data = self._calculate_age_and_los(input_data)
+        matched_query = self._build_one_query(processed_data, max_results)
+        scored = self.one_query_engine() == "scored"
 
         query = f"""
-        SELECT 
-            *,
-            ({icd9_score}) as icd9_match_count,
-            abs(dateDiff('year', BirthDate, toDate('{input_data['formatted_birth_date']}'))) as age_diff,
-            abs(dateDiff('day', AdmissionDate, parseDateTime('{input_data['formatted_admission_date']}'))) as date_diff,
-            {self._get_los_diff_calculation(input_data)},
-            'STEP_17' as result_step
-        FROM {env.clickhouse_table_name}
-        WHERE 
-            {icd9_filter}
-            {exclusion}
-        ORDER BY 
-            icd9_match_count DESC,
-            age_diff ASC,
-            los_diff ASC,
-            date_diff ASC
-        LIMIT 50
+        SELECT {COLUMNAR_PROJECTION}{", similarity_score" if scored else ""}
+        FROM (SELECT *, rowNumberInAllBlocks() AS result_rank FROM ({matched_query}))
+        ORDER BY result_rank
         """
-        return await self._execute_query(query)
-    
-    async def _execute_query(self, query: str) -> List[tuple]:
-        """Execute ClickHouse query asynchronously"""
+
+        # Bounded by the search timeout like the progressive steps
+        ctx = self._one_query_context(max_results)
         try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                self.thread_pool,
-                lambda: self.client.query(query)
+            table = await self.db.query_arrow(
+                query, parameters=self._query_parameters(processed_data), settings=self._query_settings(ctx)
             )
-            return result.result_rows
         except Exception as e:
+            if self._deadline_reached(ctx):
+                logger.warning("Columnar search cut off at the search deadline")
+                ctx.partial = True
+            else:
+                logger.error(f"Columnar search query failed: {e}")
+            empty = pa.table({name: [] for name in DOCUMENT_COLUMNS + (['similarity_score'] if scored else [])})
+            return empty, self._search_meta(ctx)
+
+        self._one_query_completed(ctx, processed_data)
+        logger.info(f"Columnar search found {table.num_rows} results")
+        return table, self._search_meta(ctx)
+
+    def _query_settings(self, ctx: Optional[SearchContext] = None) -> Optional[Dict[str, Any]]:
+        """Per-query settings: opt-in ClickHouse query cache, the step's query_id and
+        max_execution_time from what is left of the search deadline"""
+        settings = {}
+        if env.clickhouse_use_query_cache:
+            settings['use_query_cache'] = 1
+            settings['query_cache_ttl'] = env.clickhouse_query_cache_ttl
+        if ctx and ctx.query_id:
+            settings['query_id'] = ctx.query_id
+        remaining = ctx.remaining() if ctx else None
+        if remaining is not None:
+            settings['max_execution_time'] = max(1, math.ceil(remaining))
+        return settings or None
+
+    async def _execute_query(self, query: str, ctx: Optional[SearchContext] = None,
+                             parameters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Execute ClickHouse query asynchronously, returning rows keyed by column name"""
+        try:
+            result = await self.db.query(query, parameters=parameters, settings=self._query_settings(ctx))
+            column_names = result.column_names
+            return [dict(zip(column_names, row)) for row in result.result_rows]
+        except Exception as e:
+            # A query cut off by max_execution_time is a timeout, not an empty step
+            remaining = ctx.remaining() if ctx else None
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError() from e
             logger.error(f"Query execution failed: {e}")
             return []
 
-    def format_results_for_api(self, raw_results: List[tuple]) -> Dict[str, Any]:
+    def format_results_for_api(self, raw_results: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Format raw ClickHouse results for API response"""
-        formatted_results = []
-        
-        # Column mapping for admission data
-        column_mapping = [
-            'AdmissionId', 'AdmissionTypeId', 'AdmissionTypeName', 'OrganizationCode',
-            'OrganizationId', 'AdmissionDate', 'DischargeDate', 'PatientId', 'BirthDate',
-            'Sex', 'PatientType', 'PatientTypeId', 'PrimaryDoctor', 'PrimaryDoctorUserId',
-            'Specialty', 'SpecialtyGroup', 'Region', 'Archetype', 'DiseaseClassification',
-            'ProcedureClassification', 'InvoiceClass', 'InvoiceClassId', 'PayerName',
-            'PayerId', 'PayerType', 'InvoiceNetAmount', 'Age', 'LengthOfStay',
-            'AnesthesiaDoctor', 'AnesthesiaType'
-        ]
-        
-        for result_row in raw_results:
-            result_dict = {}
-            
-            # Map base columns
-            for i, col_name in enumerate(column_mapping):
-                if i < len(result_row):
-                    result_dict[col_name] = result_row[i]
-            
-            # Add calculated fields from the end of the result
-            if len(result_row) > len(column_mapping):
-                remaining_fields = result_row[len(column_mapping):]
-                if len(remaining_fields) >= 3:
-                    result_dict['age_diff'] = remaining_fields[-3]
-                    result_dict['date_diff'] = remaining_fields[-2]
-                    result_dict['result_step'] = remaining_fields[-1]
-            
-            formatted_results.append({
-                'document': result_dict,
+        formatted_results = [
+            {
+                'document': self._document_from_row(result_row),
                 'highlights': {},
-                'text_match': 100
-            })
+                # The scored engine's similarity, 100 for the plan steps' matches
+                'text_match': result_row.get('similarity_score', 100)
+            }
+            for result_row in raw_results
+        ]
         
         return {
             'found': len(formatted_results),
@@ -936,5 +1234,9 @@ class ClickHouseMedicalSearchService:
             'page': 1
         }
 
+    def _document_from_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """API document fields of a decoded row (plus similarity_score when scored); helper sort columns are dropped"""
+        return {name: row[name] for name in DOCUMENT_COLUMNS + ['similarity_score'] if name in row}
+
 # Global service instance
 clickhouse_medical_search_service = ClickHouseMedicalSearchService()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import logging
+from typing import Any, Dict
+
+from config.clickhouseDb import clickhouse_db
+from config.setting import env
+
+logger = logging.getLogger(__name__)
+
+SALES_ITEM_TABLE = "sales_item_filtered"
+UOM_DICTIONARY = "sales_item_uom"
+
+# Storage features shipped in migrations/clickhouse and what reveals each one
+FEATURE_COLUMNS = {
+    'icd_code_arrays': ('DiseaseCodes', 'ProcedureCodes'),                   # 001
+    'icd_code_set_hashes': ('DiseaseCodesHash', 'ProcedureCodesHash'),       # 002
+    'ranking_columns': ('BirthYear', 'AdmissionDayNum', 'LengthOfStayDays')  # 003
+}
+FEATURE_PROJECTIONS = {
+    'step_projections': ('p_step_organization', 'p_step_region'),           # 004
+    'sales_item_projection': ('p_admission',)                               # 005
+}
+
+# Modes that need a feature, and the mode used when it is missing
+MODE_REQUIREMENTS = {
+    'icd_match_mode': ('array', 'icd_code_arrays', 'string'),
+    'icd_exact_match_mode': ('hash', 'icd_code_set_hashes', 'string'),
+    'search_ranking_mode': ('integer', 'ranking_columns', 'expression')
+}
+
+class ClickHouseSchemaService:
+    """Which of the shipped migrations the connected database has.
+
+    Detected once at startup from the system tables. Search modes whose
+    columns are missing fall back to the plain-column queries instead of
+    failing every search, and the search and UOM queries use the step
+    projections and the UOM dictionary only when they exist. The type of
+    sales_item_id lets the UOM lookup bind ids in the column's own type.
+    """
+
+    def __init__(self):
+        self.db = clickhouse_db
+        self.features = {}
+        # ClickHouse type of sales_item_filtered.sales_item_id, None until detected
+        self.sales_item_id_type = None
+        self._modes = {}
+
+    async def detect(self) -> Dict[str, bool]:
+        """Read columns, materialized projections and dictionaries; any failure leaves everything off"""
+        features = {}
+        try:
+            columns = await self.db.query(
+                "SELECT name FROM system.columns WHERE database = currentDatabase() AND table = {table:String}",
+                parameters={'table': env.clickhouse_table_name}
+            )
+            column_names = {row[0] for row in columns.result_rows}
+
+            projections = await self.db.query(
+                """
+                SELECT DISTINCT table, name FROM system.projection_parts
+                WHERE database = currentDatabase() AND active AND table IN {tables:Array(String)}
+                """,
+                parameters={'tables': [env.clickhouse_table_name, SALES_ITEM_TABLE]}
+            )
+            projection_names = {row[1] for row in projections.result_rows}
+
+            dictionaries = await self.db.query(
+                "SELECT name FROM system.dictionaries WHERE database = currentDatabase() AND name = {name:String}",
+                parameters={'name': UOM_DICTIONARY}
+            )
+
+            for feature, required in FEATURE_COLUMNS.items():
+                features[feature] = all(name in column_names for name in required)
+            for feature, required in FEATURE_PROJECTIONS.items():
+                features[feature] = all(name in projection_names for name in required)
+            features['uom_dictionary'] = bool(dictionaries.result_rows)
+
+            sales_item_id = await self.db.query(
+                """
+                SELECT type FROM system.columns
+                WHERE database = currentDatabase() AND table = {table:String} AND name = 'sales_item_id'
+                """,
+                parameters={'table': SALES_ITEM_TABLE}
+            )
+            self.sales_item_id_type = sales_item_id.result_rows[0][0] if sales_item_id.result_rows else None
+        except Exception as e:
+            logger.warning(f"ClickHouse schema detection failed, using plain-column queries: {e}")
+            features = {feature: False for feature in [*FEATURE_COLUMNS, *FEATURE_PROJECTIONS, 'uom_dictionary']}
+            self.sales_item_id_type = None
+
+        self.features = features
+        self._modes = {}
+        for setting, (mode, feature, fallback) in MODE_REQUIREMENTS.items():
+            if env[setting] == mode and not features[feature]:
+                logger.warning(f"⚠️ {setting}={mode} needs {feature} (see migrations/clickhouse); using {fallback}")
+                self._modes[setting] = fallback
+
+        present = [feature for feature, enabled in features.items() if enabled]
+        logger.info(f"✅ ClickHouse schema features: {', '.join(present) or 'none'}")
+        return features
+
+    def has(self, feature: str) -> bool:
+        return self.features.get(feature, False)
+
+    def mode(self, setting: str) -> str:
+        """Effective value of a search mode setting (the configured one unless it had to fall back)"""
+        return self._modes.get(setting, env[setting])
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'features': self.features,
+            'sales_item_id_type': self.sales_item_id_type,
+            'modes': {setting: self.mode(setting) for setting in MODE_REQUIREMENTS}
+        }
+
+clickhouse_schema_service = ClickHouseSchemaService()
@@ -1,59 +1,32 @@
-import clickhouse_connect
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Any, Optional
-from config.setting import env
+from typing import Dict, List, Any
+from config.clickhouseDb import clickhouse_db
+from app.utils.SingleFlight import SingleFlight
+from app.services.ClickHouseSchemaService import UOM_DICTIONARY, clickhouse_schema_service
 import logging
+import pyarrow as pa
 
 logger = logging.getLogger(__name__)
 
 class ClickHouseService:
     def __init__(self):
-        self.clickhouse_client = None
-        self.thread_pool = None
+        self.db = clickhouse_db
+        self._uom_flight = SingleFlight("get_uom_id_for_sales_items")
         
     async def initialize(self):
         """Initialize ClickHouse client"""
-        self.thread_pool = ThreadPoolExecutor(max_workers=4)
-        
         try:
-            await self._initialize_clickhouse()
+            await self.db.initialize()
+            await self._test_clickhouse_connection()
             logger.info("✅ ClickHouse client initialized successfully")
         except Exception as e:
             logger.error(f"❌ ClickHouse initialization failed: {e}")
             raise
     
     
-    async def _initialize_clickhouse(self):
-        """Initialize ClickHouse client"""
-        loop = asyncio.get_event_loop()
-        
-        def _create_clickhouse_client():
-            return clickhouse_connect.get_client(
-                host=env.clickhouse_host,
-                port=env.clickhouse_port,
-                database=env.clickhouse_database,
-                username=env.clickhouse_username,
-                password=env.clickhouse_password
-            )
-        
-        self.clickhouse_client = await loop.run_in_executor(
-            self.thread_pool, _create_clickhouse_client
-        )
-        
-        # Test connection
-        await self._test_clickhouse_connection()
-    
-    
     async def _test_clickhouse_connection(self):
         """Test ClickHouse connection"""
-        loop = asyncio.get_event_loop()
-        
-        def _test_query():
-            return self.clickhouse_client.query("SELECT 1 as test").result_rows
-        
-        result = await loop.run_in_executor(self.thread_pool, _test_query)
-        logger.info(f"ClickHouse test successful: {result}")
+        result = await self.db.query("SELECT 1 as test")
+        logger.info(f"ClickHouse test successful: {result.result_rows}")
     
     async def get_sales_items_for_admission(self, admission_id: int, limit: int = None) -> List[Dict[str, Any]]:
         """Get sales items for a specific admission ID from ClickHouse"""
@@ -62,49 +35,98 @@ class ClickHouseService:
     
     async def _get_sales_items_clickhouse(self, admission_id: int, limit: int = None) -> List[Dict[str, Any]]:
         """Get sales items from ClickHouse"""
-        loop = asyncio.get_event_loop()
+        query = f"""
+        SELECT 
+            AdmissionId,
+            sales_item_id,
+            item_type,
+            item_name,
+            Quantity,
+            ItemNetAmount
+        FROM sales_item_filtered
+        WHERE AdmissionId = {{admission_id:Int64}}
+        ORDER BY ItemNetAmount DESC
+        {"LIMIT {limit:Int32}" if limit else ""}
+        """
         
-        def _execute_query():
-            query = f"""
-            SELECT 
-                AdmissionId,
-                sales_item_id,
-                item_type,
-                item_name,
-                Quantity,
-                ItemNetAmount
-            FROM sales_item_filtered
-            WHERE AdmissionId = {{admission_id:Int64}}
-            ORDER BY ItemNetAmount DESC
-            {"LIMIT {limit:Int32}" if limit else ""}
-            """
-            
-            parameters = {'admission_id': admission_id}
-            if limit:
-                parameters['limit'] = limit
-            
-            result = self.clickhouse_client.query(query, parameters=parameters)
-            
-            results = []
-            for row in result.result_rows:
-                results.append({
-                    'AdmissionId': row[0],
-                    'SalesItemId': str(row[1]) if row[1] else '',
-                    'ItemType': row[2] or '',
-                    'ItemName': row[3] or '',
-                    'Quantity': row[4] or 0,
-                    'ItemNetAmount': float(row[5] or 0),
-                    'PatientId': '',  # Not available in this table
-                    'OrganizationCode': ''  # Not available in this table
-                })
-            
-            return results
+        parameters = {'admission_id': admission_id}
+        if limit:
+            parameters['limit'] = limit
         
         try:
-            return await loop.run_in_executor(self.thread_pool, _execute_query)
+            result = await self.db.query(query, parameters=parameters)
         except Exception as e:
             logger.error(f"Error querying ClickHouse for admission {admission_id}: {e}")
             return []
+        
+        return [self._sales_item_from_row(row) for row in result.result_rows]
+    
+    async def get_sales_items_for_admissions(self, admission_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Get sales items for many admissions in one query, grouped by AdmissionId"""
+        if not admission_ids:
+            return {}
+        
+        query = """
+        SELECT 
+            AdmissionId,
+            sales_item_id,
+            item_type,
+            item_name,
+            Quantity,
+            ItemNetAmount
+        FROM sales_item_filtered
+        WHERE AdmissionId IN {admission_ids:Array(Int64)}
+        ORDER BY AdmissionId, ItemNetAmount DESC
+        """
+        
+        try:
+            result = await self.db.query(query, parameters={'admission_ids': list(admission_ids)})
+        except Exception as e:
+            logger.error(f"Error querying ClickHouse for admissions {admission_ids}: {e}")
+            return {}
+        
+        grouped = {}
+        for row in result.result_rows:
+            grouped.setdefault(row[0], []).append(self._sales_item_from_row(row))
+        
+        return grouped
+    
+    async def get_sales_items_columnar(self, admission_ids: List[int]) -> pa.Table:
+        """Sales items for many admissions as a pyarrow.Table, normalized like _sales_item_from_row"""
+        columns = ['AdmissionId', 'sales_item_id', 'item_type', 'item_name', 'Quantity', 'ItemNetAmount']
+        if not admission_ids:
+            return pa.table({name: [] for name in columns})
+        
+        query = """
+        SELECT 
+            AdmissionId,
+            ifNull(toString(sales_item_id), '') AS sales_item_id,
+            ifNull(item_type, '') AS item_type,
+            ifNull(item_name, '') AS item_name,
+            ifNull(Quantity, 0) AS Quantity,
+            toFloat64(ifNull(ItemNetAmount, 0)) AS ItemNetAmount
+        FROM sales_item_filtered
+        WHERE AdmissionId IN {admission_ids:Array(Int64)}
+        ORDER BY AdmissionId, ItemNetAmount DESC
+        """
+        
+        try:
+            return await self.db.query_arrow(query, parameters={'admission_ids': list(admission_ids)})
+        except Exception as e:
+            logger.error(f"Error querying ClickHouse for admissions {admission_ids}: {e}")
+            return pa.table({name: [] for name in columns})
+    
+    def _sales_item_from_row(self, row: tuple) -> Dict[str, Any]:
+        return {
+            'AdmissionId': row[0],
+            'SalesItemId': str(row[1]) if row[1] else '',
+            'ItemType': row[2] or '',
+            'ItemName': row[3] or '',
+            'Quantity': row[4] or 0,
+            'ItemNetAmount': float(row[5] or 0),
+            'PatientId': '',  # Not available in this table
+            'OrganizationCode': ''  # Not available in this table
+        }
     
     
     
@@ -114,60 +136,84 @@ class ClickHouseService:
         if not sales_item_ids:
             return {}
         
-        return await self._get_uom_id_clickhouse(sales_item_ids)
+        key = tuple(sorted(set(sales_item_ids)))
+        return await self._uom_flight.do(key, lambda: self._get_uom_id_clickhouse(sales_item_ids))
     
     async def _get_uom_id_clickhouse(self, sales_item_ids: List[str]) -> Dict[str, str]:
-        """Get UOM ID mapping from ClickHouse sales_item_filtered table"""
-        loop = asyncio.get_event_loop()
+        """Get UOM ID mapping from ClickHouse sales_item_filtered table
         
-        def _execute_query():
-            # Create a comma-separated string of sales item IDs with quotes
-            sales_item_ids_str = ','.join([f"'{item_id}'" for item_id in sales_item_ids])
-            
+        With the sales_item_uom dictionary (migration 006) the lookup is an
+        in-memory dictGet per requested id instead of a scan of sales_item_filtered.
+        Without it, ids are bound in sales_item_id's detected type so the IN
+        filter can use the table's indexes; toString matching is only the
+        fallback when detection failed.
+        """
+        parameters = {'sales_item_ids': [str(item_id) for item_id in sales_item_ids]}
+        if clickhouse_schema_service.has('uom_dictionary'):
+            query = f"""
+        SELECT
+            sales_item_id,
+            dictGet('{UOM_DICTIONARY}', 'uom_id', tuple(sales_item_id)) AS uom_id
+        FROM (SELECT arrayJoin({{sales_item_ids:Array(String)}}) AS sales_item_id)
+        WHERE dictHas('{UOM_DICTIONARY}', tuple(sales_item_id))
+        """
+        else:
+            id_type = clickhouse_schema_service.sales_item_id_type
+            if id_type:
+                # Ids bound in the column's own type keep primary-key and skip-index pruning
+                filter_clause = f"sales_item_id IN {{sales_item_ids:Array({id_type})}}"
+                parameters = {'sales_item_ids': self._typed_sales_item_ids(sales_item_ids, id_type)}
+            else:
+                filter_clause = "has({sales_item_ids:Array(String)}, toString(sales_item_id))"
             query = f"""
-            SELECT DISTINCT
-                sales_item_id,
-                uom_id
-            FROM sales_item_filtered
-            WHERE sales_item_id IN ({sales_item_ids_str})
-            AND uom_id IS NOT NULL
-            AND uom_id > 0
-            """
-            
-            print(f"🔍 UOM Query: {query}")
-            print(f"🔍 Looking for sales_item_ids: {sales_item_ids[:5]}...")  # Show first 5
-            
-            result = self.clickhouse_client.query(query)
-            
-            print(f"🔍 UOM Query returned {len(result.result_rows)} rows")
-            
-            # Create mapping dictionary
-            uom_mapping = {}
-            for row in result.result_rows:
-                sales_item_id = str(row[0]) if row[0] else ''
-                uom_id = str(row[1]) if row[1] else ''
-                if sales_item_id and uom_id:
-                    uom_mapping[sales_item_id] = uom_id
-                print(f"🔍 UOM mapping: {sales_item_id} -> {uom_id}")
-            
-            print(f"🔍 Final UOM mapping: {len(uom_mapping)} items mapped")
-            return uom_mapping
+        SELECT DISTINCT
+            sales_item_id,
+            uom_id
+        FROM sales_item_filtered
+        WHERE {filter_clause}
+        AND uom_id IS NOT NULL
+        AND uom_id > 0
+        """
+        
+        print(f"🔍 UOM Query: {query}")
+        print(f"🔍 Looking for sales_item_ids: {sales_item_ids[:5]}...")  # Show first 5
         
         try:
-            return await loop.run_in_executor(self.thread_pool, _execute_query)
+            result = await self.db.query(query, parameters=parameters)
         except Exception as e:
             logger.error(f"Error querying ClickHouse for UOM IDs: {e}")
             return {}
+        
+        print(f"🔍 UOM Query returned {len(result.result_rows)} rows")
+        
+        # Create mapping dictionary
+        uom_mapping = {}
+        for row in result.result_rows:
+            sales_item_id = str(row[0]) if row[0] else ''
+            uom_id = str(row[1]) if row[1] else ''
+            if sales_item_id and uom_id:
+                uom_mapping[sales_item_id] = uom_id
+            print(f"🔍 UOM mapping: {sales_item_id} -> {uom_id}")
+        
+        print(f"🔍 Final UOM mapping: {len(uom_mapping)} items mapped")
+        return uom_mapping
+
+    @staticmethod
+    def _typed_sales_item_ids(sales_item_ids: List[str], id_type: str) -> List[Any]:
+        """Requested ids as values of the sales_item_id column type; ids an integer column can't hold are dropped"""
+        if 'Int' not in id_type:
+            return [str(item_id) for item_id in sales_item_ids]
+        typed_ids = []
+        for item_id in sales_item_ids:
+            try:
+                typed_ids.append(int(str(item_id)))
+            except ValueError:
+                continue
+        return typed_ids
     
 
     async def shutdown(self):
-        """Shutdown the service"""
-        if self.thread_pool:
-            self.thread_pool.shutdown(wait=True)
-        
-        if self.clickhouse_client:
-            self.clickhouse_client.close()
-        
+        """Shutdown the service (the shared pool is closed by the application lifespan)"""
         logger.info("ClickHouse service shutdown complete")
 
 # Global service instance
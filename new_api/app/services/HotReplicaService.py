@@ -0,0 +1,362 @@
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
+from app.utils.AdmissionSnapshot import AdmissionSegment, open_snapshot
+from config.clickhouseDb import clickhouse_db
+from config.setting import env
+
+logger = logging.getLogger(__name__)
+
+# Ranking inputs computed by ClickHouse at load time, so they follow its timezone and parsing
+RANKING_COLUMNS = {
+    'replica_birth_year': "toYear(BirthDate)",
+    'replica_admission_day': "toRelativeDayNum(AdmissionDate)",
+    'replica_los_days': "toInt32OrZero(LengthOfStay)"
+}
+
+# (ICD10, ICD9) matching per plan icd mode, mirroring _calculate_icd_scores
+ICD_MATCHING = {
+    'exact': ('exact', 'exact'),
+    'partial': ('partial', 'partial'),
+    'mixed': ('partial', 'exact'),
+    'icd9_only_exact': (None, 'exact'),
+    'icd9_only_partial': (None, 'partial')
+}
+SCORED_ICD_MODES = ('partial', 'mixed', 'icd9_only_partial')
+
+EPOCH = date(1970, 1, 1)
+
+def _normalize_code(code: str) -> str:
+    """upper(trimBoth(code)) as ClickHouse computes it"""
+    return code.strip(' ').upper()
+
+def _code_tokens(text: str) -> List[str]:
+    """The DiseaseCodes/ProcedureCodes tokenization of migration 001"""
+    return [token for token in (_normalize_code(code) for code in text.split(';')) if token]
+
+def split_partitions(value: Optional[str]) -> frozenset:
+    """Comma-separated hot_replica_hospitals / hot_replica_regions"""
+    return frozenset(item.strip() for item in (value or '').split(',') if item.strip())
+
+class ReplicaSnapshot:
+    """A base segment (a mapped snapshot or a full ClickHouse load) and the rows re-read since its watermark"""
+
+    def __init__(self, base: AdmissionSegment, delta: AdmissionSegment, watermark: Optional[datetime],
+                 hospitals: frozenset, regions: frozenset, source: str):
+        self.base = base
+        self.delta = delta
+        self.watermark = watermark
+        self.hospitals = hospitals
+        self.regions = regions
+        self.source = source
+        self.loaded_at = time.monotonic()
+        # Base rows re-read into the delta are superseded by their new copy
+        self.segments = [
+            (base, ~np.isin(base.admission_ids(), delta.admission_ids())),
+            (delta, np.ones(delta.rows, dtype=bool))
+        ]
+
+    @property
+    def live_rows(self) -> int:
+        return sum(int(live.sum()) for _, live in self.segments)
+
+class HotReplicaService:
+    """In-process columnar copy of the busiest hospitals' admissions.
+
+    Rows of env.hot_replica_hospitals / env.hot_replica_regions are held as
+    AdmissionSegment columns (string columns dictionary-encoded). The base
+    segment is the snapshot at env.hot_replica_snapshot_path, memory-mapped and
+    shared by every worker (built by scripts.build_admission_snapshot), or else
+    a full ClickHouse load. Every hot_replica_refresh_interval seconds the rows
+    admitted since the base's AdmissionDate watermark minus
+    hot_replica_lookback_days are re-read into a delta segment that supersedes
+    their base copies (discharges update recent rows); every
+    hot_replica_full_reload_interval seconds the base itself is reloaded, which
+    picks up older edits and deletes.
+
+    A plan step runs here only when its filters pin it to a loaded hospital or
+    region, i.e. every row it can match is in the replica. Masks, ICD matching
+    and sort keys reproduce the step's ClickHouse query; other steps, and every
+    step once the replica is older than hot_replica_max_lag, go to ClickHouse.
+    """
+
+    def __init__(self):
+        self.db = clickhouse_db
+        self.result_columns = []
+        self._snapshot = None
+        self._refresh_task = None
+        self._metrics = {
+            'served_steps': 0,
+            'fallback_steps': 0,
+            'refreshes': 0,
+            'full_reloads': 0,
+            'errors': 0
+        }
+
+    async def initialize(self, result_columns: List[str]):
+        """Initial load and background refresh; a failed load leaves every step on ClickHouse"""
+        self.result_columns = list(result_columns)
+        if not env.hot_replica_enabled or self._refresh_task:
+            return
+        try:
+            await self.reload()
+            logger.info(f"✅ Hot replica loaded {self._snapshot.live_rows} admissions from {self._snapshot.source}")
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.error(f"❌ Hot replica load failed, searching ClickHouse only: {e}")
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def shutdown(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        self._snapshot = None
+
+    def _partitions(self) -> tuple:
+        return split_partitions(env.hot_replica_hospitals), split_partitions(env.hot_replica_regions)
+
+    async def fetch_segment(self, hospitals: frozenset, regions: frozenset,
+                            since: Optional[datetime] = None) -> AdmissionSegment:
+        """Admissions of the partitions (admitted since `since`) with the ranking columns"""
+        ranking = ", ".join(f"{expr} AS {name}" for name, expr in RANKING_COLUMNS.items())
+        query = f"""
+        SELECT {", ".join(self.result_columns)}, {ranking}
+        FROM {env.clickhouse_table_name}
+        WHERE (OrganizationCode IN {{hospitals:Array(String)}} OR Region IN {{regions:Array(String)}})
+        {"AND AdmissionDate >= {since:DateTime}" if since else ""}
+        """
+        parameters = {'hospitals': sorted(hospitals), 'regions': sorted(regions)}
+        if since:
+            parameters['since'] = since
+        result = await self.db.query(query, parameters=parameters)
+        if since is None and len(result.result_rows) > env.hot_replica_max_rows:
+            raise ValueError(f"{len(result.result_rows)} rows exceed hot_replica_max_rows ({env.hot_replica_max_rows})")
+        return AdmissionSegment.from_rows(result.column_names, result.result_rows)
+
+    @staticmethod
+    def watermark(segment: AdmissionSegment) -> Optional[datetime]:
+        """Latest AdmissionDate of the segment"""
+        if not segment.rows:
+            return None
+        admission_dates = segment.columns['AdmissionDate']
+        return admission_dates.value(int(np.argmax(admission_dates.data)))
+
+    async def reload(self):
+        """Reopen the snapshot file, or load the partitions from ClickHouse, then catch up"""
+        hospitals, regions = self._partitions()
+        base = None
+        if env.hot_replica_snapshot_path:
+            opened = open_snapshot(env.hot_replica_snapshot_path)
+            if opened is None:
+                logger.warning(f"No admission snapshot at {env.hot_replica_snapshot_path}, loading from ClickHouse")
+            elif (frozenset(opened[1]['hospitals']), frozenset(opened[1]['regions'])) != (hospitals, regions):
+                logger.warning("Admission snapshot holds other partitions than hot_replica_*, loading from ClickHouse")
+            else:
+                base, manifest = opened
+                watermark = datetime.fromisoformat(manifest['watermark']) if manifest.get('watermark') else None
+                source = f"snapshot {manifest['version']}"
+
+        if base is None:
+            base = await self.fetch_segment(hospitals, regions)
+            watermark = self.watermark(base)
+            source = "ClickHouse"
+
+        empty = AdmissionSegment.from_rows(list(base.columns), [])
+        self._snapshot = ReplicaSnapshot(base, empty, watermark, hospitals, regions, source)
+        self._metrics['full_reloads'] += 1
+        if source != "ClickHouse":
+            await self.refresh()
+
+    async def refresh(self):
+        """Re-read the rows admitted since the base watermark, minus the lookback"""
+        snapshot = self._snapshot
+        if snapshot is None or self._partitions() != (snapshot.hospitals, snapshot.regions):
+            return await self.reload()
+        since = snapshot.watermark - timedelta(days=env.hot_replica_lookback_days) if snapshot.watermark else None
+        delta = await self.fetch_segment(snapshot.hospitals, snapshot.regions, since)
+        self._snapshot = ReplicaSnapshot(
+            snapshot.base, delta, snapshot.watermark, snapshot.hospitals, snapshot.regions, snapshot.source
+        )
+        self._metrics['refreshes'] += 1
+
+    async def _refresh_loop(self):
+        last_full_reload = time.monotonic()
+        while True:
+            await asyncio.sleep(env.hot_replica_refresh_interval)
+            try:
+                if time.monotonic() - last_full_reload >= env.hot_replica_full_reload_interval:
+                    await self.reload()
+                    last_full_reload = time.monotonic()
+                else:
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._metrics['errors'] += 1
+                logger.warning(f"Hot replica refresh failed: {e}")
+
+    def _active_snapshot(self) -> Optional[ReplicaSnapshot]:
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > env.hot_replica_max_lag:
+            return None
+        return snapshot
+
+    def covers(self, plan_step: Dict[str, Any], parameters: Dict[str, Any]) -> bool:
+        """Whether every row the step can match is in the replica"""
+        snapshot = self._active_snapshot()
+        if snapshot is None:
+            return False
+        for column, key in plan_step['filters']:
+            value = parameters.get(key, '')
+            if plan_step['skip_empty'] and not value.strip():
+                continue
+            if (column == 'OrganizationCode' and value in snapshot.hospitals) or \
+                    (column == 'Region' and value in snapshot.regions):
+                return True
+        return False
+
+    def run_step(self, plan_step: Dict[str, Any], input_data: Dict[str, Any], parameters: Dict[str, Any],
+                 excluded_ids: set, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Rows of the step as its ClickHouse query returns them; None hands the step back to ClickHouse"""
+        snapshot = self._active_snapshot()
+        try:
+            birth_year = datetime.strptime(parameters['formatted_birth_date'], '%Y-%m-%d').year
+            admission_day = (datetime.strptime(parameters['formatted_admission_date'], '%Y-%m-%d %H:%M:%S').date() - EPOCH).days
+        except ValueError:
+            snapshot = None
+        if snapshot is None:
+            self._metrics['fallback_steps'] += 1
+            return None
+
+        icd10_kind, icd9_kind = ICD_MATCHING[plan_step['icd']]
+        icd_fields = [
+            (kind, field, codes, score_key) for kind, field, codes, score_key in (
+                (icd10_kind, 'DiseaseClassification', parameters['icd10'], 'icd10_score'),
+                (icd9_kind, 'ProcedureClassification', parameters['icd9'], 'icd9_score')
+            ) if kind and codes
+        ]
+        scored = plan_step['icd'] in SCORED_ICD_MODES
+        calculated_los = input_data.get('calculated_los', '')
+        excluded = np.fromiter(excluded_ids, dtype=np.int64, count=len(excluded_ids)) if excluded_ids else None
+
+        # Candidate rows of each segment and their sort keys, merged below
+        matches, key_parts, age_parts, date_parts = [], [], [], []
+        for segment_index, (segment, live) in enumerate(snapshot.segments):
+            if not segment.rows:
+                continue
+            columns = segment.columns
+
+            mask = live.copy()
+            for column, key in plan_step['filters']:
+                value = parameters.get(key, '')
+                if plan_step['skip_empty'] and not value.strip():
+                    continue
+                mask &= columns[column].equals(value)
+
+            scores = {}
+            for kind, field, codes, score_key in icd_fields:
+                mask &= columns[field].map_values(self._icd_matcher(kind, codes), bool)
+                if scored:
+                    scores[score_key] = columns[field].map_values(self._icd_scorer(codes), np.float64)
+
+            if excluded is not None:
+                mask &= ~np.isin(segment.admission_ids(), excluded)
+
+            rows = np.flatnonzero(mask)
+            age_diff = np.abs(columns['replica_birth_year'].data[rows] - birth_year)
+            date_diff = np.abs(columns['replica_admission_day'].data[rows] - admission_day)
+            sort_values = {
+                'age_diff': age_diff,
+                'date_diff': date_diff,
+                'los_diff': np.abs(columns['replica_los_days'].data[rows] - parameters['los_days'])
+                if calculated_los not in ('', None) else None
+            }
+            for score_key, score in scores.items():
+                sort_values[score_key] = -score[rows]
+
+            keys = []
+            for sort_key in plan_step['order_by']:
+                if isinstance(sort_key, str):
+                    values = sort_values.get(sort_key)
+                else:
+                    _, column, key = sort_key
+                    values = ~columns[column].equals(parameters.get(key, ''))[rows]
+                if values is not None:
+                    keys.append(values)
+            # AdmissionId breaks ties like the step queries
+            keys.append(segment.admission_ids()[rows])
+
+            matches.extend((segment_index, row) for row in rows)
+            key_parts.append(keys)
+            age_parts.append(age_diff)
+            date_parts.append(date_diff)
+
+        self._metrics['served_steps'] += 1
+        if not matches:
+            return []
+
+        keys = [np.concatenate(parts) for parts in zip(*key_parts)]
+        age_diff = np.concatenate(age_parts)
+        date_diff = np.concatenate(date_parts)
+        # np.lexsort sorts by its last key first
+        order = np.lexsort(keys[::-1])[:limit]
+
+        results = []
+        for position in order:
+            segment_index, row = matches[position]
+            document = snapshot.segments[segment_index][0].row(row, self.result_columns)
+            document['age_diff'] = int(age_diff[position])
+            document['date_diff'] = int(date_diff[position])
+            document['result_step'] = plan_step['name']
+            results.append(document)
+        return results
+
+    def _icd_matcher(self, kind: str, codes: List[str]):
+        """Per-value ICD filter of the configured matching modes"""
+        if kind == 'exact':
+            if clickhouse_schema_service.mode('icd_exact_match_mode') == "hash":
+                code_set = {_normalize_code(code) for code in codes} - {''}
+                return lambda text: text is not None and set(_code_tokens(text)) == code_set
+            joined = "; ".join(codes)
+            return lambda text: text == joined
+        if clickhouse_schema_service.mode('icd_match_mode') == "array":
+            wanted = {_normalize_code(code) for code in codes}
+            return lambda text: text is not None and not wanted.isdisjoint(_code_tokens(text))
+        return lambda text: text is not None and any(code in text for code in codes)
+
+    def _icd_scorer(self, codes: List[str]):
+        """Per-value match count with the extra-codes penalty, as build_enhanced_score"""
+        if clickhouse_schema_service.mode('icd_match_mode') == "array":
+            normalized = [_normalize_code(code) for code in codes]
+
+            def score(text):
+                tokens = _code_tokens(text or '')
+                return sum(code in tokens for code in normalized) + (-0.1 if len(tokens) > len(codes) else 0)
+            return score
+
+        def score(text):
+            text = text or ''
+            return sum(code in text for code in codes) + (-0.1 if text.count(';') + 1 > len(codes) else 0)
+        return score
+
+    def metrics(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            'enabled': env.hot_replica_enabled,
+            'source': snapshot.source if snapshot else None,
+            'rows': snapshot.live_rows if snapshot else 0,
+            'delta_rows': snapshot.delta.rows if snapshot else 0,
+            'hospitals': sorted(snapshot.hospitals) if snapshot else [],
+            'regions': sorted(snapshot.regions) if snapshot else [],
+            'watermark': snapshot.watermark.isoformat() if snapshot and snapshot.watermark else None,
+            'age_s': round(time.monotonic() - snapshot.loaded_at, 1) if snapshot else None,
+            **self._metrics
+        }
+
+hot_replica_service = HotReplicaService()
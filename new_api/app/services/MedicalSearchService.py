@@ -1,4 +1,5 @@
 from app.services.ClickHouseMedicalSearchService import clickhouse_medical_search_service
+from app.services.SearchCacheService import search_cache_service
 from typing import Dict, Any, List
 import logging
 
@@ -30,10 +31,19 @@ class MedicalSearchService:
         }
     
     async def search_structured(self, structured_data: Dict, target_results: int = 10) -> Dict[str, Any]:
-        """Structured medical search using ClickHouse progressive search"""
+        """Structured medical search using ClickHouse progressive search, served through the result cache"""
+        return await search_cache_service.get_or_compute(
+            structured_data,
+            target_results,
+            lambda: self._search_structured_uncached(structured_data, target_results)
+        )
+    
+    async def _search_structured_uncached(self, structured_data: Dict, target_results: int) -> Dict[str, Any]:
         try:
-            raw_results = await self.searcher.search_similar_admissions(structured_data, target_results)
+            raw_results, search_meta = await self.searcher.search_similar_admissions_with_meta(structured_data, target_results)
             formatted_results = self.searcher.format_results_for_api(raw_results)
+            # Deadline-cut searches report how far they got
+            formatted_results.update(search_meta)
             return formatted_results
         except Exception as e:
             logger.error(f"Structured search failed: {e}")
@@ -45,6 +55,28 @@ class MedicalSearchService:
                 'error': str(e)
             }
     
+    async def search_structured_with_billing(self, structured_data: Dict, target_results: int = 10) -> Dict[str, Any]:
+        """Structured search with billing aggregated in the same ClickHouse query"""
+        try:
+            return await self.searcher.search_similar_admissions_with_billing(structured_data, target_results)
+        except Exception as e:
+            logger.error(f"Structured search with billing failed: {e}")
+            return {
+                'found': 0,
+                'results': [],
+                'search_time_ms': 0,
+                'page': 1,
+                'error': str(e)
+            }
+    
+    async def search_structured_columnar(self, structured_data: Dict, target_results: int = 10) -> tuple:
+        """Structured search returned as (pyarrow.Table, search meta) for direct serialization"""
+        return await self.searcher.search_similar_admissions_columnar_with_meta(structured_data, target_results)
+    
+    def pruned_steps(self, structured_data: Dict, target_results: int = 10) -> List[Dict[str, Any]]:
+        """Progressive search steps skipped for this request (see search_meta.pruned_steps)"""
+        return self.searcher.pruned_steps(structured_data, target_results)
+    
     async def search_with_filter(self, query: str, max_results: int = 10, filter_by: str = None, 
                                query_by: str = None, query_by_weights: str = None) -> Dict[str, Any]:
         """Filtered search - not implemented for ClickHouse"""
@@ -1,7 +1,9 @@
+from app.services.BillingCacheService import billing_cache_service
 from app.services.ClickHouseService import clickhouse_service
 from app.models.SalesModel import SalesItem, AdmissionSalesSummary
 from config.setting import env
-from typing import Dict, Any, List, Optional
+from app.utils.SingleFlight import SingleFlight
+from typing import Dict, Any, Iterable, List, Optional
 import asyncio
 import logging
 
@@ -10,6 +12,7 @@ logger = logging.getLogger(__name__)
 class SalesService:
     def __init__(self):
         self.clickhouse = clickhouse_service
+        self._admission_flight = SingleFlight("get_sales_for_admission")
     
     async def initialize(self):
         """Initialize sales service with ClickHouse"""
@@ -21,18 +24,35 @@ class SalesService:
             raise
     
     
-    async def get_sales_for_admission(self, admission_id: int) -> Optional[AdmissionSalesSummary]:
-        """Get all sales items for a specific admission from ClickHouse"""
+    async def get_sales_for_admission(self, admission_id: int, discharged: bool = False) -> Optional[AdmissionSalesSummary]:
+        """Get all sales items for a specific admission from ClickHouse
+        
+        Summaries of discharged admissions are immutable and served from the billing cache.
+        """
         try:
             if not admission_id or admission_id == 0:
                 logger.warning(f"Invalid admission_id: {admission_id}")
                 return None
             
-            return await self._get_sales_for_admission_clickhouse(admission_id)
+            if discharged:
+                cached = await billing_cache_service.get_many([admission_id])
+                if admission_id in cached:
+                    return cached[admission_id]
+            
+            return await self._admission_flight.do(
+                (admission_id, discharged),
+                lambda: self._load_sales_for_admission(admission_id, discharged)
+            )
         except Exception as e:
             logger.error(f"Error getting sales for admission {admission_id}: {e}")
             return None
     
+    async def _load_sales_for_admission(self, admission_id: int, discharged: bool) -> Optional[AdmissionSalesSummary]:
+        summary = await self._get_sales_for_admission_clickhouse(admission_id)
+        if summary and discharged:
+            await billing_cache_service.set_many([summary])
+        return summary
+    
     async def _get_sales_for_admission_clickhouse(self, admission_id: int) -> Optional[AdmissionSalesSummary]:
         """Get sales items for admission using ClickHouse/BigQuery"""
         try:
@@ -41,42 +61,79 @@ class SalesService:
             if not sales_data:
                 return None
             
-            # Process results
-            sales_items = []
-            total_amount = 0.0
-            item_types = set()
-            
-            for doc in sales_data:
-                try:
-                    item_net_amount = float(doc.get('ItemNetAmount', 0))
-                    
-                    sales_item = SalesItem(
-                        admission_id=doc['AdmissionId'],
-                        sales_item_id=doc['SalesItemId'],
-                        item_type=doc['ItemType'],
-                        item_name=doc['ItemName'],
-                        quantity=doc.get('Quantity', 0),
-                        item_net_amount=item_net_amount
-                    )
-                    
-                    sales_items.append(sales_item)
-                    total_amount += item_net_amount
-                    item_types.add(doc['ItemType'])
-                except (KeyError, ValueError, TypeError) as e:
-                    logger.warning(f"Error processing ClickHouse sales item for admission {admission_id}: {e}")
-                    continue
-            
-            return AdmissionSalesSummary(
-                admission_id=admission_id,
-                total_items=len(sales_items),
-                total_amount=round(total_amount, 2),
-                item_types=list(item_types),
-                items=sales_items
-            )
+            return self._build_sales_summary(admission_id, sales_data)
         except Exception as e:
             logger.error(f"Error getting ClickHouse sales for admission {admission_id}: {e}")
             return None
     
+    async def get_sales_for_admissions(self, admission_ids: List[int],
+                                       discharged_ids: Iterable[int] = ()) -> Dict[int, AdmissionSalesSummary]:
+        """Get sales summaries for many admissions with a single ClickHouse query.
+        
+        Admissions listed in discharged_ids are served from and stored in the billing
+        cache; the rest are always read from ClickHouse. Admissions without sales
+        items are absent from the result.
+        """
+        valid_ids = list(dict.fromkeys(admission_id for admission_id in admission_ids if admission_id))
+        if not valid_ids:
+            return {}
+        
+        try:
+            discharged_ids = set(discharged_ids)
+            summaries = await billing_cache_service.get_many(
+                [admission_id for admission_id in valid_ids if admission_id in discharged_ids]
+            )
+            missing_ids = [admission_id for admission_id in valid_ids if admission_id not in summaries]
+            if missing_ids:
+                grouped_sales = await self.clickhouse.get_sales_items_for_admissions(missing_ids)
+                fetched = {
+                    admission_id: self._build_sales_summary(admission_id, sales_data)
+                    for admission_id, sales_data in grouped_sales.items()
+                    if sales_data
+                }
+                await billing_cache_service.set_many(
+                    [summary for admission_id, summary in fetched.items() if admission_id in discharged_ids]
+                )
+                summaries.update(fetched)
+            return {admission_id: summaries[admission_id] for admission_id in valid_ids if admission_id in summaries}
+        except Exception as e:
+            logger.error(f"Error getting ClickHouse sales for admissions {valid_ids}: {e}")
+            return {}
+    
+    def _build_sales_summary(self, admission_id: int, sales_data: List[Dict[str, Any]]) -> AdmissionSalesSummary:
+        """Build AdmissionSalesSummary from sales item rows"""
+        sales_items = []
+        total_amount = 0.0
+        item_types = set()
+        
+        for doc in sales_data:
+            try:
+                item_net_amount = float(doc.get('ItemNetAmount', 0))
+                
+                sales_item = SalesItem(
+                    admission_id=doc['AdmissionId'],
+                    sales_item_id=doc['SalesItemId'],
+                    item_type=doc['ItemType'],
+                    item_name=doc['ItemName'],
+                    quantity=doc.get('Quantity', 0),
+                    item_net_amount=item_net_amount
+                )
+                
+                sales_items.append(sales_item)
+                total_amount += item_net_amount
+                item_types.add(doc['ItemType'])
+            except (KeyError, ValueError, TypeError) as e:
+                logger.warning(f"Error processing ClickHouse sales item for admission {admission_id}: {e}")
+                continue
+        
+        return AdmissionSalesSummary(
+            admission_id=admission_id,
+            total_items=len(sales_items),
+            total_amount=round(total_amount, 2),
+            item_types=list(item_types),
+            items=sales_items
+        )
+    
     
     
     
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from app.services.ClickHouseMedicalSearchService import clickhouse_medical_search_service
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
+from app.utils.CacheUtils import cache_dumps, cache_loads, canonical_key
+from config.ratelimit import redis_connection
+from config.setting import env
+
+logger = logging.getLogger(__name__)
+
+class SearchCacheService:
+    """Redis cache for structured search results with stale-while-revalidate.
+
+    Entries are fresh for search_cache_ttl seconds and then served stale for up
+    to search_cache_stale_ttl more while one background refresh recomputes them.
+    The number of entries is capped through a sorted-set index of keys.
+    """
+
+    KEY_PREFIX = "search:structured:v1"
+    INDEX_KEY = f"{KEY_PREFIX}:index"
+    LOCK_SECONDS = 30
+
+    def __init__(self):
+        self.redis = redis_connection
+        self._refresh_tasks = set()
+        self._metrics = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'stores': 0,
+            'skipped_too_large': 0,
+            'evictions': 0,
+            'errors': 0
+        }
+
+    def build_key(self, structured_data: Dict, target_results: int) -> str:
+        """Canonical key: empty fields dropped, field order irrelevant, and the
+        search settings that change results (engine, plan, effective modes)"""
+        normalized = {
+            field: value for field, value in structured_data.items()
+            if value is not None and value != "" and value != []
+        }
+        # Code-set hashing makes ICD order irrelevant to the results, so it
+        # must not split the cache either
+        if clickhouse_schema_service.mode('icd_exact_match_mode') == "hash":
+            for field in ('icd10', 'icd9'):
+                if field in normalized:
+                    normalized[field] = sorted(code.strip().upper() for code in normalized[field])
+        return canonical_key(self.KEY_PREFIX, {
+            'request': normalized,
+            'max_results': target_results,
+            'search': clickhouse_medical_search_service.result_fingerprint()
+        })
+
+    async def get_or_compute(self, structured_data: Dict, target_results: int,
+                             compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        if not env.search_cache_enabled:
+            return await compute()
+
+        key = self.build_key(structured_data, target_results)
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Search cache read failed: {e}")
+            return await compute()
+
+        if raw:
+            entry = cache_loads(raw)
+            if time.time() - entry['stored_at'] <= env.search_cache_ttl:
+                self._metrics['hits'] += 1
+            else:
+                self._metrics['stale_hits'] += 1
+                self._schedule_refresh(key, compute)
+            return entry['value']
+
+        self._metrics['misses'] += 1
+        value = await compute()
+        await self._store(key, value)
+        return value
+
+    def _schedule_refresh(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]):
+        task = asyncio.create_task(self._refresh(key, compute))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _refresh(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]):
+        try:
+            # Only one worker refreshes a given stale entry
+            if not await self.redis.set(f"{key}:refresh", "1", nx=True, ex=self.LOCK_SECONDS):
+                return
+            self._metrics['refreshes'] += 1
+            await self._store(key, await compute())
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Search cache refresh failed: {e}")
+
+    async def _store(self, key: str, value: Dict[str, Any]):
+        # Failed and deadline-cut (partial) searches are not cached
+        if value.get('error') or value.get('partial'):
+            return
+
+        stored_at = time.time()
+        raw = cache_dumps({'stored_at': stored_at, 'value': value})
+        if len(raw) > env.search_cache_max_entry_bytes:
+            self._metrics['skipped_too_large'] += 1
+            return
+
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(key, raw, ex=env.search_cache_ttl + env.search_cache_stale_ttl)
+            pipe.zadd(self.INDEX_KEY, {key: stored_at})
+            pipe.zcard(self.INDEX_KEY)
+            *_, entry_count = await pipe.execute()
+            self._metrics['stores'] += 1
+
+            overflow = entry_count - env.search_cache_max_entries
+            if overflow > 0:
+                evicted = [member for member, _ in await self.redis.zpopmin(self.INDEX_KEY, overflow)]
+                if evicted:
+                    await self.redis.delete(*evicted)
+                    self._metrics['evictions'] += len(evicted)
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Search cache write failed: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self._metrics['hits'] + self._metrics['stale_hits'] + self._metrics['misses']
+        served = self._metrics['hits'] + self._metrics['stale_hits']
+        return {
+            'enabled': env.search_cache_enabled,
+            **self._metrics,
+            'hit_ratio': round(served / lookups, 3) if lookups else 0
+        }
+
+search_cache_service = SearchCacheService()
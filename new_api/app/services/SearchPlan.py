@@ -0,0 +1,217 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ICD matching per step, as understood by _calculate_icd_scores
+ICD_MODES = ('exact', 'partial', 'mixed', 'icd9_only_exact', 'icd9_only_partial')
+
+# Sort keys a step may use besides ("priority", column, key)
+DISTANCE_KEYS = ('age_diff', 'date_diff', 'los_diff')
+SCORE_KEYS = ('icd10_score', 'icd9_score')
+
+# Admission columns a plan may filter or prioritize on
+PLAN_COLUMNS = (
+    'OrganizationCode', 'PayerName', 'PayerType', 'PrimaryDoctor', 'Specialty',
+    'LengthOfStay', 'AdmissionTypeName', 'Sex', 'AnesthesiaDoctor', 'AnesthesiaType',
+    'Archetype', 'Region'
+)
+
+# Columns where an empty value is a real state (LengthOfStay is blank until
+# discharge), so a strict filter on a blank request value can still match rows
+BLANK_MATCHING_COLUMNS = ('LengthOfStay',)
+
+# Request fields a plan may compare against (bound as {key:String})
+PLAN_KEYS = (
+    'hospital_code', 'payer_name', 'payer_type', 'primary_doctor', 'doctor_specialty',
+    'calculated_los', 'admission_type', 'gender', 'anesthesia_doctor', 'anesthesia_type',
+    'archetype', 'hospital_region'
+)
+
+DISTANCES = ['age_diff', 'los_diff', 'date_diff']
+GENDER = ('priority', 'Sex', 'gender')
+ADMISSION_TYPE = ('priority', 'AdmissionTypeName', 'admission_type')
+DOCTOR = ('priority', 'PrimaryDoctor', 'primary_doctor')
+
+HOSPITAL_PAYER = [('OrganizationCode', 'hospital_code'), ('PayerName', 'payer_name')]
+STRICT_MATCH = HOSPITAL_PAYER + [
+    ('PrimaryDoctor', 'primary_doctor'),
+    ('LengthOfStay', 'calculated_los'),
+    ('AdmissionTypeName', 'admission_type')
+]
+
+# The 17-step progressive search. Each step keeps `filters` (column = request
+# value), matches ICD codes per `icd` and sorts by `order_by`. Steps with
+# skip_empty drop filters whose request value is blank; the others compare
+# against it as given.
+DEFAULT_SEARCH_PLAN: List[Dict[str, Any]] = [
+    {'name': 'STEP_1', 'description': 'All exact matches', 'icd': 'exact', 'skip_empty': True,
+     'filters': STRICT_MATCH + [('Sex', 'gender'), ('AnesthesiaDoctor', 'anesthesia_doctor'),
+                                ('AnesthesiaType', 'anesthesia_type')],
+     'order_by': ['age_diff', 'date_diff']},
+    {'name': 'STEP_2', 'description': 'Remove Anesthesia Doctor', 'icd': 'exact',
+     'filters': STRICT_MATCH + [('Sex', 'gender'), ('AnesthesiaType', 'anesthesia_type')],
+     'order_by': ['age_diff', 'date_diff']},
+    {'name': 'STEP_3', 'description': 'Remove Anesthesia Type', 'icd': 'exact',
+     'filters': STRICT_MATCH + [('Sex', 'gender')],
+     'order_by': ['age_diff', 'date_diff']},
+    {'name': 'STEP_4', 'description': 'Remove Gender', 'icd': 'exact',
+     'filters': STRICT_MATCH,
+     'order_by': ['age_diff', 'date_diff']},
+    {'name': 'STEP_5', 'description': 'Remove Admission Type, prioritize same gender', 'icd': 'exact',
+     'filters': HOSPITAL_PAYER + [('PrimaryDoctor', 'primary_doctor')],
+     'order_by': [GENDER] + DISTANCES},
+    {'name': 'STEP_6', 'description': 'Remove Length of Stay, add length of stay difference', 'icd': 'exact',
+     'filters': HOSPITAL_PAYER + [('PrimaryDoctor', 'primary_doctor')],
+     'order_by': [ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_7', 'description': 'Use Doctor Specialty instead of Doctor Name', 'icd': 'exact',
+     'filters': HOSPITAL_PAYER + [('Specialty', 'doctor_specialty')],
+     'order_by': [ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_8', 'description': 'Remove Doctor Name/Specialty', 'icd': 'exact',
+     'filters': HOSPITAL_PAYER,
+     'order_by': [ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_9', 'description': 'Use Payer Type instead of Payer Name', 'icd': 'exact',
+     'filters': [('OrganizationCode', 'hospital_code'), ('PayerType', 'payer_type')],
+     'order_by': [DOCTOR, ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_10', 'description': 'Remove Payer Type, keep Hospital Name', 'icd': 'exact',
+     'filters': [('OrganizationCode', 'hospital_code')],
+     'order_by': [DOCTOR, ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_11', 'description': 'Use Hospital Archetype instead of Hospital Name', 'icd': 'exact',
+     'filters': [('Archetype', 'archetype')],
+     'order_by': [('priority', 'PayerName', 'payer_name'), ('priority', 'PayerType', 'payer_type'),
+                  DOCTOR, ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_12', 'description': 'Same as Step 11 but different sorting', 'icd': 'exact',
+     'filters': [('Archetype', 'archetype')],
+     'order_by': [DOCTOR, ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_13', 'description': 'Use Hospital Region instead of Archetype', 'icd': 'exact',
+     'filters': [('Region', 'hospital_region')],
+     'order_by': [DOCTOR, ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_14', 'description': 'Only exact ICD codes (no other constraints)', 'icd': 'exact',
+     'filters': [],
+     'order_by': [('priority', 'OrganizationCode', 'hospital_code'), ('priority', 'Region', 'hospital_region'),
+                  ('priority', 'Archetype', 'archetype'), DOCTOR, ADMISSION_TYPE, GENDER] + DISTANCES},
+    {'name': 'STEP_15', 'description': 'Exact ICD9 + Partial ICD10 (no other constraints)', 'icd': 'mixed',
+     'filters': [],
+     'order_by': ['icd9_score', 'icd10_score'] + DISTANCES},
+    {'name': 'STEP_16', 'description': 'Only exact ICD9 (ignore ICD10 completely)', 'icd': 'icd9_only_exact',
+     'filters': [],
+     'order_by': ['icd9_score'] + DISTANCES},
+    {'name': 'STEP_17', 'description': 'Only partial ICD9 (ignore ICD10 completely)', 'icd': 'icd9_only_partial',
+     'filters': [],
+     'order_by': ['icd9_score'] + DISTANCES},
+]
+
+SEARCH_PLANS: Dict[str, List[Dict[str, Any]]] = {
+    'default': DEFAULT_SEARCH_PLAN
+}
+
+# Points each criterion adds to the "scored" engine's similarity score when
+# the candidate matches (criteria with a blank request value are left out).
+# Within a hierarchy (hospital > archetype > region, payer name > type, doctor
+# > specialty) only the best matching level counts. Age and LOS points fall
+# off linearly to zero at SCORE_FALLOFF years / days of difference.
+DEFAULT_SCORE_WEIGHTS: Dict[str, float] = {
+    'icd10_exact': 20, 'icd9_exact': 20,
+    'icd10_overlap': 15, 'icd9_overlap': 15,
+    'hospital': 10, 'archetype': 6, 'region': 3,
+    'payer_name': 5, 'payer_type': 3,
+    'doctor': 5, 'specialty': 3,
+    'admission_type': 3, 'gender': 2,
+    'age': 4, 'los': 4
+}
+SCORE_FALLOFF = {'age': 20, 'los': 10}
+
+STEP_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_]{1,64}$')
+
+def _normalize_step(step: Any, defaults: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate one plan step; a bare name refers to a step of the default plan"""
+    if isinstance(step, str):
+        if step not in defaults:
+            raise ValueError(f"Unknown search step '{step}'")
+        step = defaults[step]
+    if not isinstance(step, dict):
+        raise ValueError(f"Search step must be a name or an object, got {step!r}")
+
+    name = step.get('name')
+    if not isinstance(name, str) or not STEP_NAME_PATTERN.match(name):
+        raise ValueError(f"Invalid search step name {name!r}")
+
+    icd = step.get('icd', 'exact')
+    if icd not in ICD_MODES:
+        raise ValueError(f"{name}: unknown icd mode '{icd}'")
+
+    filters = []
+    for column, key in step.get('filters', []):
+        if column not in PLAN_COLUMNS or key not in PLAN_KEYS:
+            raise ValueError(f"{name}: unsupported filter {column} = {key}")
+        filters.append((column, key))
+
+    order_by = []
+    for sort_key in step.get('order_by', []):
+        if isinstance(sort_key, str):
+            if sort_key not in DISTANCE_KEYS + SCORE_KEYS:
+                raise ValueError(f"{name}: unknown sort key '{sort_key}'")
+            order_by.append(sort_key)
+        else:
+            kind, column, key = sort_key
+            if kind != 'priority' or column not in PLAN_COLUMNS or key not in PLAN_KEYS:
+                raise ValueError(f"{name}: unsupported sort key {sort_key!r}")
+            order_by.append(('priority', column, key))
+
+    return {
+        'name': name,
+        'description': step.get('description', ''),
+        'icd': icd,
+        'skip_empty': bool(step.get('skip_empty', False)),
+        'filters': filters,
+        'order_by': order_by
+    }
+
+def load_search_plan(name: str = 'default', path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Resolve the deployment's search plan.
+
+    A JSON file at `path` takes precedence over the built-in plan `name`. The
+    file holds a list of steps, each either the name of a default step (to drop
+    or reorder steps) or a full step object in the DEFAULT_SEARCH_PLAN format.
+    """
+    defaults = {step['name']: step for step in DEFAULT_SEARCH_PLAN}
+
+    if path:
+        with open(path) as plan_file:
+            steps = json.load(plan_file)
+        source = path
+    elif name in SEARCH_PLANS:
+        steps = SEARCH_PLANS[name]
+        source = name
+    else:
+        raise ValueError(f"Unknown search plan '{name}'")
+
+    if not isinstance(steps, list) or not steps:
+        raise ValueError(f"Search plan {source} must be a non-empty list of steps")
+
+    plan = [_normalize_step(step, defaults) for step in steps]
+    names = [step['name'] for step in plan]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Search plan {source} repeats step names")
+
+    logger.info(f"Search plan {source}: {len(plan)} steps ({', '.join(names)})")
+    return plan
+
+def load_score_weights(overrides: Optional[str] = None) -> Dict[str, float]:
+    """DEFAULT_SCORE_WEIGHTS updated with a JSON object of overrides"""
+    weights = dict(DEFAULT_SCORE_WEIGHTS)
+    if overrides:
+        changes = json.loads(overrides)
+        if not isinstance(changes, dict):
+            raise ValueError("Score weights must be a JSON object")
+        for name, weight in changes.items():
+            if name not in DEFAULT_SCORE_WEIGHTS:
+                raise ValueError(f"Unknown score weight '{name}'")
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0:
+                raise ValueError(f"Score weight '{name}' must be a non-negative number")
+            weights[name] = float(weight)
+    if not any(weights.values()):
+        raise ValueError("At least one score weight must be positive")
+    return weights
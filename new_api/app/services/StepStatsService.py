@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List
+
+from app.utils.CacheUtils import canonical_key
+from config.ratelimit import redis_connection
+from config.setting import env
+
+logger = logging.getLogger(__name__)
+
+class StepStatsService:
+    """Per-request-shape record of which progressive search steps return rows.
+
+    A shape is the set of request fields present, the ICD10/ICD9 code counts
+    and the hospital. Each shape has a Redis hash holding, per step, how often
+    the step was evaluated (`<step>:runs`) and how often it produced rows
+    (`<step>:hits`). Shapes are indexed in a sorted set by last use and capped
+    at step_stats_max_shapes.
+    """
+
+    KEY_PREFIX = "search:steps:v1"
+    INDEX_KEY = f"{KEY_PREFIX}:index"
+
+    def __init__(self):
+        self.redis = redis_connection
+        self._record_tasks = set()
+        self._metrics = {
+            'lookups': 0,
+            'records': 0,
+            'probes': 0,
+            'probe_fallbacks': 0,
+            'skipped_steps': 0,
+            'errors': 0
+        }
+
+    def describe_shape(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'fields': sorted(
+                field for field, value in input_data.items()
+                if value is not None and value != "" and value != [] and field not in ('icd10', 'icd9')
+            ),
+            'icd10_count': len(input_data.get('icd10') or []),
+            'icd9_count': len(input_data.get('icd9') or []),
+            'hospital_code': input_data.get('hospital_code') or ''
+        }
+
+    def shape_key(self, shape: Dict[str, Any]) -> str:
+        return canonical_key(self.KEY_PREFIX, shape)
+
+    async def get_step_stats(self, shape: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        """{step: {'runs': n, 'hits': n}} for the shape; empty if unknown or Redis is down"""
+        if not env.step_stats_enabled:
+            return {}
+
+        self._metrics['lookups'] += 1
+        try:
+            raw = await self.redis.hgetall(self.shape_key(shape))
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Step stats read failed: {e}")
+            return {}
+        return self._parse_stats(raw)
+
+    def _parse_stats(self, raw: Dict[str, str]) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        for field, value in raw.items():
+            step, _, counter = field.rpartition(':')
+            if counter in ('runs', 'hits'):
+                stats.setdefault(step, {'runs': 0, 'hits': 0})[counter] = int(value)
+        return stats
+
+    def record(self, shape: Dict[str, Any], outcomes: Dict[str, bool]):
+        """Count each evaluated step as a run and, when it produced rows, a hit (in the background)"""
+        if not env.step_stats_enabled or not outcomes:
+            return
+        task = asyncio.create_task(self._record(shape, outcomes))
+        self._record_tasks.add(task)
+        task.add_done_callback(self._record_tasks.discard)
+
+    async def _record(self, shape: Dict[str, Any], outcomes: Dict[str, bool]):
+        key = self.shape_key(shape)
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(key, 'shape', json.dumps(shape, sort_keys=True))
+            for step, produced_rows in outcomes.items():
+                pipe.hincrby(key, f"{step}:runs", 1)
+                if produced_rows:
+                    pipe.hincrby(key, f"{step}:hits", 1)
+            pipe.expire(key, env.step_stats_ttl)
+            pipe.zadd(self.INDEX_KEY, {key: time.time()})
+            pipe.zcard(self.INDEX_KEY)
+            *_, shape_count = await pipe.execute()
+            self._metrics['records'] += 1
+
+            overflow = shape_count - env.step_stats_max_shapes
+            if overflow > 0:
+                evicted = [member for member, _ in await self.redis.zpopmin(self.INDEX_KEY, overflow)]
+                if evicted:
+                    await self.redis.delete(*evicted)
+        except Exception as e:
+            self._metrics['errors'] += 1
+            logger.warning(f"Step stats write failed: {e}")
+
+    def cold_steps(self, stats: Dict[str, Dict[str, int]], step_names: List[str]) -> List[str]:
+        """Steps that almost never produced rows for the shape"""
+        cold = []
+        for step in step_names:
+            step_stats = stats.get(step)
+            if not step_stats or step_stats['runs'] < env.step_stats_min_samples:
+                continue
+            if step_stats['hits'] / step_stats['runs'] <= env.step_stats_skip_threshold:
+                cold.append(step)
+        return cold
+
+    def record_probe(self, skipped: int, fallback: bool):
+        """Count a probe, the steps it let the search skip, and whether any cold step had rows"""
+        self._metrics['probes'] += 1
+        self._metrics['skipped_steps'] += skipped
+        if fallback:
+            self._metrics['probe_fallbacks'] += 1
+
+    async def snapshot(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently used shapes with per-step hit rates, for the stats endpoint"""
+        keys = await self.redis.zrevrange(self.INDEX_KEY, 0, max(0, limit - 1))
+        if not keys:
+            return []
+
+        pipe = self.redis.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        rows = await pipe.execute()
+
+        shapes = []
+        for raw in rows:
+            if not raw:
+                continue
+            steps = {
+                step: {**counts, 'hit_rate': round(counts['hits'] / counts['runs'], 3) if counts['runs'] else 0}
+                for step, counts in self._parse_stats(raw).items()
+            }
+            shapes.append({'shape': json.loads(raw.get('shape', '{}')), 'steps': steps})
+        return shapes
+
+    def metrics(self) -> Dict[str, Any]:
+        return {'enabled': env.step_stats_enabled, **self._metrics}
+
+step_stats_service = StepStatsService()
@@ -0,0 +1,282 @@
+"""Columnar admission segments and their on-disk snapshot format.
+
+A segment holds one NumPy array per column: fixed-width numbers, dates as
+day numbers and datetimes as epoch seconds (each with an optional null mask),
+and every other value, including the ICD code-set texts, dictionary-encoded
+as int32 codes. A snapshot writes a segment under <root>/<version>/ as raw
+.bin files plus JSON dictionaries and a manifest, and <root>/CURRENT names
+the live version. Opening maps the files read-only with np.memmap, so every
+worker reading the same snapshot shares its pages through the OS cache.
+"""
+import json
+import os
+import shutil
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 1
+KEEP_VERSIONS = 2
+
+EPOCH_DATE = date(1970, 1, 1)
+EPOCH_DATETIME = datetime(1970, 1, 1)
+
+class EncodedColumn:
+    """Values as int32 codes into a list of distinct values"""
+
+    kind = 'encoded'
+
+    def __init__(self, values: List[Any], codes: np.ndarray):
+        self.values = values
+        self.codes = codes
+        self._index = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @classmethod
+    def from_values(cls, column: List[Any]) -> 'EncodedColumn':
+        values, index = [], {}
+        codes = np.empty(len(column), dtype=np.int32)
+        for position, value in enumerate(column):
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(values)
+                values.append(value)
+            codes[position] = code
+        return cls(values, codes)
+
+    @property
+    def index(self) -> Dict[Any, int]:
+        if self._index is None:
+            self._index = {value: code for code, value in enumerate(self.values)}
+        return self._index
+
+    def equals(self, value: Any) -> np.ndarray:
+        return self.codes == self.index.get(value, -1)
+
+    def map_values(self, fn, dtype) -> np.ndarray:
+        """fn evaluated once per distinct value, gathered back to rows"""
+        per_value = np.fromiter((fn(value) for value in self.values), dtype=dtype, count=len(self.values))
+        return per_value[self.codes]
+
+    def value(self, row: int) -> Any:
+        return self.values[self.codes[row]]
+
+    def take(self, rows: np.ndarray) -> 'EncodedColumn':
+        return EncodedColumn(self.values, self.codes[rows])
+
+    @staticmethod
+    def concat(columns: List['EncodedColumn']) -> 'EncodedColumn':
+        values, index, parts = [], {}, []
+        for column in columns:
+            remap = np.empty(len(column.values), dtype=np.int32)
+            for position, value in enumerate(column.values):
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(values)
+                    values.append(value)
+                remap[position] = code
+            parts.append(remap[column.codes])
+        return EncodedColumn(values, np.concatenate(parts) if parts else np.empty(0, dtype=np.int32))
+
+class ValueColumn:
+    """Fixed-width numbers, dates (day numbers) or datetimes (epoch seconds) with an optional null mask"""
+
+    DTYPES = {'bool': np.uint8, 'int': np.int64, 'float': np.float64, 'date': np.int32, 'datetime': np.int64}
+
+    def __init__(self, kind: str, data: np.ndarray, nulls: Optional[np.ndarray] = None, tz: Optional[str] = None):
+        self.kind = kind
+        self.data = data
+        self.nulls = nulls
+        self.tz = tz
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @classmethod
+    def from_values(cls, kind: str, column: List[Any], tz: Optional[str] = None) -> 'ValueColumn':
+        nulls = np.fromiter((value is None for value in column), dtype=bool, count=len(column))
+        encode = {
+            'bool': int,
+            'int': int,
+            'float': float,
+            'date': lambda value: (value - EPOCH_DATE).days,
+            'datetime': (lambda value: int(value.timestamp())) if tz else
+                        (lambda value: int((value - EPOCH_DATETIME).total_seconds()))
+        }[kind]
+        data = np.fromiter((0 if value is None else encode(value) for value in column),
+                           dtype=cls.DTYPES[kind], count=len(column))
+        return cls(kind, data, nulls if nulls.any() else None, tz)
+
+    def value(self, row: int) -> Any:
+        if self.nulls is not None and self.nulls[row]:
+            return None
+        raw = self.data[row]
+        if self.kind == 'bool':
+            return bool(raw)
+        if self.kind == 'int':
+            return int(raw)
+        if self.kind == 'float':
+            return float(raw)
+        if self.kind == 'date':
+            return EPOCH_DATE + timedelta(days=int(raw))
+        if self.tz:
+            return datetime.fromtimestamp(int(raw), ZoneInfo(self.tz))
+        return EPOCH_DATETIME + timedelta(seconds=int(raw))
+
+    def take(self, rows: np.ndarray) -> 'ValueColumn':
+        return ValueColumn(self.kind, self.data[rows], self.nulls[rows] if self.nulls is not None else None, self.tz)
+
+    @staticmethod
+    def concat(columns: List['ValueColumn']) -> 'ValueColumn':
+        first = columns[0]
+        nulls = None
+        if any(column.nulls is not None for column in columns):
+            nulls = np.concatenate([
+                column.nulls if column.nulls is not None else np.zeros(len(column.data), dtype=bool)
+                for column in columns
+            ])
+        return ValueColumn(first.kind, np.concatenate([column.data for column in columns]), nulls, first.tz)
+
+def _column_from_values(column: List[Any]):
+    sample = next((value for value in column if value is not None), None)
+    if isinstance(sample, bool):
+        return ValueColumn.from_values('bool', column)
+    if isinstance(sample, int):
+        return ValueColumn.from_values('int', column)
+    if isinstance(sample, float):
+        return ValueColumn.from_values('float', column)
+    if isinstance(sample, datetime):
+        return ValueColumn.from_values('datetime', column, str(sample.tzinfo) if sample.tzinfo else None)
+    if isinstance(sample, date):
+        return ValueColumn.from_values('date', column)
+    if sample is None or isinstance(sample, (str, Decimal)):
+        return EncodedColumn.from_values(column)
+    raise ValueError(f"Unsupported snapshot value type {type(sample).__name__}")
+
+def _dump_value(value: Any) -> Any:
+    return {'decimal': str(value)} if isinstance(value, Decimal) else value
+
+def _load_value(value: Any) -> Any:
+    return Decimal(value['decimal']) if isinstance(value, dict) else value
+
+class AdmissionSegment:
+    """A batch of admissions as columns, addressed by row number"""
+
+    def __init__(self, columns: Dict[str, Any], rows: int):
+        self.columns = columns
+        self.rows = rows
+
+    @classmethod
+    def from_rows(cls, column_names: List[str], rows: List[tuple]) -> 'AdmissionSegment':
+        by_name = list(zip(*rows)) if rows else [() for _ in column_names]
+        return cls(
+            {name: _column_from_values(list(values)) for name, values in zip(column_names, by_name)},
+            len(rows)
+        )
+
+    def admission_ids(self) -> np.ndarray:
+        if not self.rows:
+            return np.empty(0, dtype=np.int64)
+        return self.columns['AdmissionId'].data
+
+    def take(self, rows: np.ndarray) -> 'AdmissionSegment':
+        return AdmissionSegment({name: column.take(rows) for name, column in self.columns.items()}, len(rows))
+
+    @staticmethod
+    def concat(segments: List['AdmissionSegment']) -> 'AdmissionSegment':
+        segments = [segment for segment in segments if segment.rows] or segments[:1]
+        columns = {}
+        for name, column in segments[0].columns.items():
+            parts = [segment.columns[name] for segment in segments]
+            if all(type(part) is type(column) and part.kind == column.kind for part in parts):
+                columns[name] = type(column).concat(parts)
+            else:
+                # e.g. a column that was all NULL in one segment: re-infer from the values
+                columns[name] = _column_from_values([part.value(row) for part in parts for row in range(len(part))])
+        return AdmissionSegment(columns, sum(segment.rows for segment in segments))
+
+    def row(self, row: int, names: List[str]) -> Dict[str, Any]:
+        return {name: self.columns[name].value(row) for name in names}
+
+    def save(self, directory: Path) -> Dict[str, Any]:
+        """Write the columns' files; returns their manifest entries"""
+        entries = {}
+        for name, column in self.columns.items():
+            if isinstance(column, EncodedColumn):
+                column.codes.astype(np.int32).tofile(directory / f"{name}.codes.bin")
+                with open(directory / f"{name}.dict.json", 'w') as dictionary_file:
+                    json.dump([_dump_value(value) for value in column.values], dictionary_file)
+                entries[name] = {'kind': 'encoded'}
+                continue
+            column.data.tofile(directory / f"{name}.bin")
+            if column.nulls is not None:
+                column.nulls.tofile(directory / f"{name}.nulls.bin")
+            entries[name] = {'kind': column.kind, 'nulls': column.nulls is not None, 'tz': column.tz}
+        return entries
+
+    @classmethod
+    def open(cls, directory: Path, rows: int, entries: Dict[str, Any]) -> 'AdmissionSegment':
+        """Map a saved segment read-only"""
+        def mapped(path, dtype):
+            # mmap can't map an empty file
+            return np.memmap(path, dtype=dtype, mode='r', shape=(rows,)) if rows else np.empty(0, dtype=dtype)
+
+        columns = {}
+        for name, entry in entries.items():
+            if entry['kind'] == 'encoded':
+                with open(directory / f"{name}.dict.json") as dictionary_file:
+                    values = [_load_value(value) for value in json.load(dictionary_file)]
+                columns[name] = EncodedColumn(values, mapped(directory / f"{name}.codes.bin", np.int32))
+                continue
+            nulls = mapped(directory / f"{name}.nulls.bin", bool) if entry['nulls'] else None
+            data = mapped(directory / f"{name}.bin", ValueColumn.DTYPES[entry['kind']])
+            columns[name] = ValueColumn(entry['kind'], data, nulls, entry.get('tz'))
+        return cls(columns, rows)
+
+def write_snapshot(root: str, segment: AdmissionSegment, meta: Dict[str, Any]) -> str:
+    """Write a new snapshot version, point CURRENT at it and drop older versions"""
+    root_path = Path(root)
+    root_path.mkdir(parents=True, exist_ok=True)
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f') + f"-{os.getpid()}"
+    directory = root_path / version
+    directory.mkdir()
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'rows': segment.rows,
+        'columns': segment.save(directory),
+        **meta
+    }
+    with open(directory / "manifest.json", 'w') as manifest_file:
+        json.dump(manifest, manifest_file, default=str)
+
+    pointer = root_path / "CURRENT.tmp"
+    pointer.write_text(version)
+    os.replace(pointer, root_path / "CURRENT")
+
+    # Workers that still map an older version keep their pages until they reopen
+    versions = sorted(path for path in root_path.iterdir() if path.is_dir())
+    for stale in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(stale, ignore_errors=True)
+    return version
+
+def open_snapshot(root: str) -> Optional[tuple]:
+    """(segment, manifest) of the current snapshot, None if there is none"""
+    root_path = Path(root)
+    try:
+        version = (root_path / "CURRENT").read_text().strip()
+    except FileNotFoundError:
+        return None
+    directory = root_path / version
+    with open(directory / "manifest.json") as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Snapshot {directory} has format {manifest.get('format')}, expected {SNAPSHOT_FORMAT}")
+    return AdmissionSegment.open(directory, manifest['rows'], manifest['columns']), manifest
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import sys
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Optional
+
+def _encode_value(value: Any):
+    # Tag types JSON can't carry so cached results round-trip unchanged
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not cacheable")
+
+def _decode_value(obj: dict):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+        if '__decimal__' in obj:
+            return Decimal(obj['__decimal__'])
+    return obj
+
+def cache_dumps(value: Any) -> str:
+    """Serialize a cache entry, preserving date, datetime and Decimal values"""
+    return json.dumps(value, default=_encode_value, separators=(',', ':'))
+
+def cache_loads(raw: str) -> Any:
+    return json.loads(raw, object_hook=_decode_value)
+
+def canonical_key(prefix: str, payload: Any) -> str:
+    """Stable cache key: same payload (whatever its dict key order) gives the same key"""
+    canonical = json.dumps(payload, sort_keys=True, default=_encode_value, separators=(',', ':'))
+    return f"{prefix}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+class ByteBoundedLRU:
+    """In-process LRU whose capacity is the memory held by its serialized values.
+
+    With a ttl (seconds), entries older than it are treated as missing.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] is not None and time.monotonic() >= entry[2]:
+            self.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key, value: str):
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self._entries[key] = (value, size, time.monotonic() + self.ttl if self.ttl else None)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key) -> Optional[str]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.current_bytes -= entry[1]
+        return entry[0]
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,4 +1,5 @@
-from fastapi.responses import JSONResponse
+import json
+from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from starlette.exceptions import HTTPException
 
@@ -28,6 +29,15 @@ def response_success(data, message_chunk = "", msg = "Success"):
         "message": msg
     }))
 
+def response_success_json(data, message_chunk = "", msg = "Success"):
+    """response_success for JSON-native data, serialized in a single json.dumps pass"""
+    body = json.dumps({
+        "status": 1,
+        "data": data,
+        "message": msg
+    }, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str)
+    return Response(content=body.encode("utf-8"), status_code=200, media_type="application/json")
+
 def response_success_sse(data, message_chunk = "", msg = "Success"):
     return {
         "status": 1,
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one in-flight execution.
+
+    The first caller for a key starts the work; callers arriving while it runs
+    await the same task and receive the same result (or exception). Results are
+    shared objects, so callers must treat them as read-only. The shared task is
+    shielded: a caller that gets cancelled does not cancel the others.
+    """
+
+    registry: Dict[str, "SingleFlight"] = {}
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        SingleFlight.registry[name] = self
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight)
+        }
+
+def single_flight_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: flight.metrics() for name, flight in SingleFlight.registry.items()}
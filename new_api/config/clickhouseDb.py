@@ -0,0 +1,461 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import aiohttp
+import clickhouse_connect
+import pyarrow.ipc as pa_ipc
+from clickhouse_connect.driver import httputil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from .setting import env
+
+logger = logging.getLogger(__name__)
+
+class PoolMetrics:
+    """Saturation counters shared by both backends"""
+
+    def __init__(self, pool_size: int = 0):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._peak_in_flight = 0
+        self._peak_queued = 0
+        self._total_queries = 0
+        self._total_errors = 0
+        self._total_wait_ms = 0.0
+        self._total_run_ms = 0.0
+
+    def submitted(self) -> float:
+        with self._lock:
+            self._queued += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+        return time.perf_counter()
+
+    def started(self, submitted_at: float) -> float:
+        started_at = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            self._total_wait_ms += (started_at - submitted_at) * 1000
+        return started_at
+
+    def abandoned(self):
+        """Caller gave up while still queued"""
+        with self._lock:
+            self._queued -= 1
+
+    def finished(self, started_at: float, failed: bool = False):
+        with self._lock:
+            self._in_flight -= 1
+            self._total_queries += 1
+            self._total_run_ms += (time.perf_counter() - started_at) * 1000
+            if failed:
+                self._total_errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self._total_queries
+            return {
+                'pool_size': self.pool_size,
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'saturation': round(self._in_flight / self.pool_size, 2) if self.pool_size else 0,
+                'peak_in_flight': self._peak_in_flight,
+                'peak_queued': self._peak_queued,
+                'total_queries': finished,
+                'total_errors': self._total_errors,
+                'avg_wait_ms': round(self._total_wait_ms / finished, 2) if finished else 0,
+                'avg_run_ms': round(self._total_run_ms / finished, 2) if finished else 0
+            }
+
+class ExecutorClickHouseBackend:
+    """clickhouse_connect clients driven from a bounded thread pool.
+
+    Every worker thread owns its own client (and so its own keep-alive HTTP
+    connection), so concurrent queries never share a client or a session.
+    """
+
+    name = "executor"
+
+    def __init__(self):
+        self.thread_pool = None
+        self._local = threading.local()
+        self._clients = []
+        self._control_client = None
+        self._lock = threading.Lock()
+        self.metrics = PoolMetrics()
+
+    async def initialize(self):
+        pool_size = max(1, env.clickhouse_pool_size)
+        self.metrics = PoolMetrics(pool_size)
+        self.thread_pool = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix="clickhouse"
+        )
+
+    async def shutdown(self):
+        if self.thread_pool:
+            self.thread_pool.shutdown(wait=True)
+            self.thread_pool = None
+
+        with self._lock:
+            clients, self._clients = self._clients, []
+        if self._control_client:
+            clients.append(self._control_client)
+            self._control_client = None
+
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"Error closing ClickHouse client: {e}")
+
+    def _create_client(self):
+        return clickhouse_connect.get_client(
+            host=env.clickhouse_host,
+            port=env.clickhouse_port,
+            database=env.clickhouse_database,
+            username=env.clickhouse_username,
+            password=env.clickhouse_password,
+            compress=env.clickhouse_compression or False,
+            autogenerate_session_id=False,
+            pool_mgr=httputil.get_pool_manager(
+                keep_idle=env.clickhouse_keep_alive_idle,
+                keep_interval=env.clickhouse_keep_alive_interval,
+                keep_count=env.clickhouse_keep_alive_count,
+                maxsize=1
+            )
+        )
+
+    def _get_client(self):
+        """Client owned by the current worker thread"""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._create_client()
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    async def run(self, fn: Callable[[Any], Any]) -> Any:
+        """Run fn(client) on a pool worker"""
+        if not self.thread_pool:
+            raise RuntimeError("ClickHouse pool is not initialized")
+
+        submitted_at = self.metrics.submitted()
+
+        def _work():
+            started_at = self.metrics.started(submitted_at)
+            failed = False
+            try:
+                return fn(self._get_client())
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self.metrics.finished(started_at, failed)
+
+        future = self.thread_pool.submit(_work)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A call cancelled while still queued never reaches _work
+            if future.cancel():
+                self.metrics.abandoned()
+            raise
+
+    async def query(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                    settings: Optional[Dict[str, Any]] = None):
+        return await self.run(lambda client: client.query(query, parameters=parameters, settings=settings))
+
+    async def query_arrow(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                          settings: Optional[Dict[str, Any]] = None):
+        return await self.run(
+            lambda client: client.query_arrow(query, parameters=parameters, settings=settings, use_strings=True)
+        )
+
+    async def command(self, cmd: str, parameters: Optional[Dict[str, Any]] = None,
+                      settings: Optional[Dict[str, Any]] = None):
+        return await self.run(lambda client: client.command(cmd, parameters=parameters, settings=settings))
+
+    async def kill_queries(self, ids_str: str):
+        """KILL QUERY outside the pool, which may be busy with the very queries being killed"""
+        def _kill():
+            if self._control_client is None:
+                self._control_client = self._create_client()
+            return self._control_client.command(f"KILL QUERY WHERE query_id IN ({ids_str}) ASYNC")
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, _kill)
+
+class ClickHouseHttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"ClickHouse HTTP {status}: {message.strip()}")
+        self.status = status
+
+class HttpQueryResult:
+    """The subset of clickhouse_connect's QueryResult the services rely on"""
+
+    def __init__(self, column_names: List[str], column_types: List[str], result_rows: List[tuple]):
+        self.column_names = tuple(column_names)
+        self.column_types = tuple(column_types)
+        self.result_rows = result_rows
+
+class HttpClickHouseBackend:
+    """Native asyncio access over ClickHouse's HTTP interface.
+
+    Queries are multiplexed on the event loop through one aiohttp session, with
+    no executor hop. Concurrency is bounded by clickhouse_http_max_connections.
+    """
+
+    name = "http"
+
+    def __init__(self):
+        self.session = None
+        self._control_session = None
+        self._semaphore = None
+        self.metrics = PoolMetrics()
+
+    async def initialize(self):
+        max_connections = max(1, env.clickhouse_http_max_connections)
+        self.metrics = PoolMetrics(max_connections)
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+        scheme = "https" if env.clickhouse_port in (443, 8443) else "http"
+        self.url = f"{scheme}://{env.clickhouse_host}:{env.clickhouse_port}/"
+        headers = {
+            'X-ClickHouse-User': env.clickhouse_username,
+            'X-ClickHouse-Key': env.clickhouse_password,
+            'X-ClickHouse-Database': env.clickhouse_database
+        }
+        if env.clickhouse_compression:
+            # HTTP content encoding; ClickHouse compresses with gzip when asked to
+            headers['Accept-Encoding'] = 'gzip'
+
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(
+                limit=max_connections,
+                keepalive_timeout=env.clickhouse_keep_alive_idle
+            )
+        )
+        self._control_session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=1)
+        )
+
+    async def shutdown(self):
+        for session in (self.session, self._control_session):
+            if session:
+                await session.close()
+        self.session = None
+        self._control_session = None
+
+    def _build_params(self, parameters: Optional[Dict[str, Any]], settings: Optional[Dict[str, Any]],
+                      default_format: Optional[str] = None) -> Dict[str, str]:
+        params = {}
+        if env.clickhouse_compression:
+            params['enable_http_compression'] = '1'
+        if default_format:
+            params['default_format'] = default_format
+            params['output_format_json_quote_64bit_integers'] = '0'
+        for key, value in (settings or {}).items():
+            params[key] = str(int(value) if isinstance(value, bool) else value)
+        for key, value in (parameters or {}).items():
+            params[f'param_{key}'] = _format_param(value)
+        return params
+
+    async def _post(self, session, query: str, params: Dict[str, str], binary: bool = False):
+        if not session:
+            raise RuntimeError("ClickHouse HTTP session is not initialized")
+
+        submitted_at = self.metrics.submitted()
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self.metrics.abandoned()
+            raise
+
+        started_at = self.metrics.started(submitted_at)
+        failed = False
+        try:
+            async with session.post(self.url, params=params, data=query.encode('utf-8')) as response:
+                if response.status != 200:
+                    raise ClickHouseHttpError(response.status, await response.text())
+                return await response.read() if binary else await response.text()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._semaphore.release()
+            self.metrics.finished(started_at, failed)
+
+    async def query(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                    settings: Optional[Dict[str, Any]] = None) -> HttpQueryResult:
+        params = self._build_params(parameters, settings, 'JSONCompactEachRowWithNamesAndTypes')
+        body = await self._post(self.session, query, params)
+
+        lines = [line for line in body.split('\n') if line]
+        if not lines:
+            return HttpQueryResult([], [], [])
+
+        column_names = json.loads(lines[0])
+        column_types = json.loads(lines[1])
+        converters = [_converter_for(column_type) for column_type in column_types]
+        result_rows = []
+        for line in lines[2:]:
+            values = json.loads(line)
+            result_rows.append(tuple(
+                convert(value) if convert and value is not None else value
+                for convert, value in zip(converters, values)
+            ))
+        return HttpQueryResult(column_names, column_types, result_rows)
+
+    async def query_arrow(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                          settings: Optional[Dict[str, Any]] = None):
+        params = self._build_params(parameters, settings, 'ArrowStream')
+        params['output_format_arrow_string_as_string'] = '1'
+        body = await self._post(self.session, query, params, binary=True)
+        return pa_ipc.open_stream(body).read_all()
+
+    async def command(self, cmd: str, parameters: Optional[Dict[str, Any]] = None,
+                      settings: Optional[Dict[str, Any]] = None) -> str:
+        body = await self._post(self.session, cmd, self._build_params(parameters, settings))
+        return body.strip()
+
+    async def kill_queries(self, ids_str: str):
+        """KILL QUERY over a separate connection, the main one may be saturated"""
+        await self._post(self._control_session, f"KILL QUERY WHERE query_id IN ({ids_str}) ASYNC", {})
+
+def _format_param(value: Any) -> str:
+    """Render a bound parameter the way ClickHouse parses param_<name> values"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (list, tuple, set)):
+        return '[' + ','.join(_format_array_element(v) for v in value) + ']'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+    return str(value)
+
+def _format_array_element(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (str, date, datetime)):
+        text = _format_param(value) if not isinstance(value, str) else value
+        return "'" + text.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    return _format_param(value)
+
+def _strip_type_wrappers(column_type: str) -> str:
+    for wrapper in ('Nullable(', 'LowCardinality('):
+        while column_type.startswith(wrapper):
+            column_type = column_type[len(wrapper):-1]
+    return column_type
+
+def _converter_for(column_type: str) -> Optional[Callable[[Any], Any]]:
+    """Convert JSON values to the Python types clickhouse_connect would return"""
+    base_type = _strip_type_wrappers(column_type)
+    if base_type in ('Date', 'Date32'):
+        return lambda value: date.fromisoformat(value)
+    if base_type.startswith('DateTime'):
+        return lambda value: datetime.fromisoformat(value)
+    return None
+
+class ClickHouseDB:
+    """Shared ClickHouse access layer used by every ClickHouse service.
+
+    env.clickhouse_backend selects the executor backend (clickhouse_connect on
+    a thread pool) or the native asyncio HTTP backend; both expose the same
+    query/command interface.
+    """
+
+    BACKENDS = {
+        ExecutorClickHouseBackend.name: ExecutorClickHouseBackend,
+        HttpClickHouseBackend.name: HttpClickHouseBackend
+    }
+
+    def __init__(self, backend: Optional[str] = None):
+        self.backend_name = backend
+        self.backend = None
+
+    async def initialize(self):
+        """Create the backend and check connectivity (idempotent)"""
+        if self.backend:
+            return
+
+        backend_name = self.backend_name or env.clickhouse_backend
+        if backend_name not in self.BACKENDS:
+            raise ValueError(f"Unknown ClickHouse backend: {backend_name}")
+
+        backend = self.BACKENDS[backend_name]()
+        await backend.initialize()
+        self.backend = backend
+        await self.query("SELECT 1")
+        logger.info(f"✅ ClickHouse {backend_name} backend initialized with {backend.metrics.pool_size} slots")
+
+    async def shutdown(self):
+        if self.backend:
+            await self.backend.shutdown()
+            self.backend = None
+
+    def _require_backend(self):
+        if not self.backend:
+            raise RuntimeError("ClickHouse pool is not initialized")
+        return self.backend
+
+    async def query(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                    settings: Optional[Dict[str, Any]] = None):
+        return await self._require_backend().query(query, parameters=parameters, settings=settings)
+
+    async def query_arrow(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                          settings: Optional[Dict[str, Any]] = None):
+        """Run a query and return its result as a pyarrow.Table"""
+        return await self._require_backend().query_arrow(query, parameters=parameters, settings=settings)
+
+    async def command(self, cmd: str, parameters: Optional[Dict[str, Any]] = None,
+                      settings: Optional[Dict[str, Any]] = None):
+        return await self._require_backend().command(cmd, parameters=parameters, settings=settings)
+
+    async def kill_queries(self, query_ids: List[str]):
+        if not query_ids:
+            return
+
+        ids_str = ",".join(f"'{query_id}'" for query_id in query_ids)
+        await self._require_backend().kill_queries(ids_str)
+
+    async def health_check(self) -> Dict[str, Any]:
+        try:
+            await self.query("SELECT 1")
+            return {
+                'status': 'healthy',
+                'clickhouse': 'connected',
+                'details': {'pool': self.metrics()}
+            }
+        except Exception as e:
+            return {
+                'status': 'error',
+                'error': str(e),
+                'details': {'pool': self.metrics()}
+            }
+
+    def metrics(self) -> Dict[str, Any]:
+        """Pool saturation counters"""
+        if not self.backend:
+            return {}
+        return {'backend': self.backend.name, **self.backend.metrics.snapshot()}
+
+clickhouse_db = ClickHouseDB()
+
+def get_clickhouse_db():
+    return clickhouse_db
@@ -1,3 +1,4 @@
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -22,6 +23,38 @@ class Settings(BaseSettings):
     default_max_results: int
     max_search_results: int
     search_timeout: int
+    # Progressive search engine: "progressive" (one query per step),
+    # "single_query" (all steps tiered server-side in one query),
+    # "parallel" (step queries run concurrently, merged in step order) or
+    # "scored" (one query ranking ICD-matched candidates by a weighted similarity score)
+    search_engine: Literal["progressive", "single_query", "parallel", "scored"] = "progressive"
+    # JSON object overriding DEFAULT_SCORE_WEIGHTS of app/services/SearchPlan.py
+    search_score_weights: Optional[str] = None
+    search_parallel_fanout: int = 4
+    # Progressive loop exclusion of admissions found by earlier steps: "server"
+    # (bound Array(Int64) parameter, NOT has(...)) or "client" (constant query,
+    # over-fetched LIMIT, de-duplicated in the service)
+    search_exclusion_mode: Literal["server", "client"] = "server"
+    # Progressive search steps: a plan name from app/services/SearchPlan.py, or a
+    # JSON plan file (step names or step objects) that takes precedence
+    search_plan: str = "default"
+    search_plan_path: Optional[str] = None
+    # Unified endpoint billing: "batched" (second bulk query), "fused" (one query:
+    # ranked search joined to its billing aggregate) or "columnar" (Arrow search +
+    # billing tables serialized straight to JSON)
+    unified_search_billing_mode: Literal["batched", "fused", "columnar"] = "batched"
+    # Partial ICD matching (steps 14-17): "string" (substring search over the
+    # classification text) or "array" (has/hasAny over DiseaseCodes/ProcedureCodes,
+    # migration 001). Switching can change results: array mode compares whole,
+    # trimmed, upper-cased codes, so a request code no longer matches a longer
+    # code containing it (K35 vs K35.8), and case differences no longer matter
+    icd_match_mode: Literal["string", "array"] = "string"
+    # Exact ICD matching (steps 1-16): "string" (classification text equality) or
+    # "hash" (order-independent code-set hash columns, migration 002)
+    icd_exact_match_mode: Literal["string", "hash"] = "string"
+    # Age / admission-date / LOS distances in the sort keys: "expression" (date
+    # math per row) or "integer" (BirthYear/AdmissionDayNum/LengthOfStayDays, migration 003)
+    search_ranking_mode: Literal["expression", "integer"] = "expression"
     
     # Sales-specific settings
     default_sales_max_results: int
@@ -38,6 +71,46 @@ class Settings(BaseSettings):
     redis_host: str
     redis_port: int
     redis_db: int
+    redis_username: Optional[str] = None
+    redis_password: Optional[str] = None
+    ratelimit_redis_db: int = 0
+    
+    # Structured search result cache (stored in the rate-limit Redis)
+    search_cache_enabled: bool = False
+    search_cache_ttl: int = 300
+    search_cache_stale_ttl: int = 600
+    search_cache_max_entries: int = 10000
+    search_cache_max_entry_bytes: int = 1048576
+    
+    # Adaptive step skipping: per request shape hit rates of each step (stored in
+    # the rate-limit Redis); steps that rarely yield rows are skipped once a
+    # single probe query confirms they are empty for the request
+    step_stats_enabled: bool = False
+    step_stats_min_samples: int = 20
+    step_stats_skip_threshold: float = 0.02
+    step_stats_min_skip: int = 2
+    step_stats_max_shapes: int = 5000
+    step_stats_ttl: int = 2592000
+    
+    # In-process hot replica: admissions of these hospitals / regions (comma
+    # separated) held as NumPy columns; steps filtered to them skip ClickHouse
+    hot_replica_enabled: bool = False
+    hot_replica_hospitals: str = ""
+    hot_replica_regions: str = ""
+    hot_replica_refresh_interval: int = 60
+    hot_replica_lookback_days: int = 30
+    hot_replica_full_reload_interval: int = 3600
+    hot_replica_max_lag: int = 600
+    hot_replica_max_rows: int = 2000000
+    # Memory-mapped snapshot shared by the workers (python -m scripts.build_admission_snapshot)
+    hot_replica_snapshot_path: Optional[str] = None
+    
+    # Per-admission billing cache (in-process LRU backed by Redis). Entries are
+    # never invalidated, only expired: billing corrections to discharged
+    # admissions can take up to 2 x billing_cache_ttl to show
+    billing_cache_enabled: bool = False
+    billing_cache_memory_bytes: int = 67108864
+    billing_cache_ttl: int = 604800
     
     # APM Settings
     apm_service_name: str
@@ -56,6 +129,18 @@ class Settings(BaseSettings):
     clickhouse_username: str
     clickhouse_password: str
     clickhouse_table_name: str
+    # "executor" (clickhouse_connect on a thread pool) or "http" (native asyncio)
+    clickhouse_backend: Literal["executor", "http"] = "executor"
+    # Shared pool: one client (and one keep-alive HTTP connection) per worker
+    clickhouse_pool_size: int = 8
+    clickhouse_http_max_connections: int = 100
+    clickhouse_compression: str = "lz4"
+    clickhouse_keep_alive_idle: int = 30
+    clickhouse_keep_alive_interval: int = 30
+    clickhouse_keep_alive_count: int = 3
+    # Opt-in ClickHouse query result cache for the search queries
+    clickhouse_use_query_cache: bool = False
+    clickhouse_query_cache_ttl: int = 300
     
     # Google BigQuery Settings (if using BigQuery instead of ClickHouse)
     bigquery_project_id: str
@@ -0,0 +1,22 @@
+-- Tokenized ICD codes for the partial-match search steps (icd_match_mode = "array").
+-- DiseaseClassification / ProcedureClassification hold codes separated by ';'
+-- (with or without a following space); each code is trimmed and upper-cased.
+-- {table} is the admissions table (CLICKHOUSE_TABLE_NAME).
+-- Array mode matches whole codes only: unlike the string mode's substring
+-- search, a request code no longer matches a longer code that contains it.
+
+ALTER TABLE {table}
+    ADD COLUMN IF NOT EXISTS DiseaseCodes Array(LowCardinality(String))
+        MATERIALIZED arrayFilter(code -> code != '', arrayMap(code -> upper(trimBoth(code)), splitByChar(';', DiseaseClassification))),
+    ADD COLUMN IF NOT EXISTS ProcedureCodes Array(LowCardinality(String))
+        MATERIALIZED arrayFilter(code -> code != '', arrayMap(code -> upper(trimBoth(code)), splitByChar(';', ProcedureClassification)));
+
+ALTER TABLE {table}
+    ADD INDEX IF NOT EXISTS idx_disease_codes DiseaseCodes TYPE bloom_filter(0.01) GRANULARITY 1,
+    ADD INDEX IF NOT EXISTS idx_procedure_codes ProcedureCodes TYPE bloom_filter(0.01) GRANULARITY 1;
+
+-- Backfill existing parts (new inserts are materialized automatically)
+ALTER TABLE {table} MATERIALIZE COLUMN DiseaseCodes;
+ALTER TABLE {table} MATERIALIZE COLUMN ProcedureCodes;
+ALTER TABLE {table} MATERIALIZE INDEX idx_disease_codes;
+ALTER TABLE {table} MATERIALIZE INDEX idx_procedure_codes;
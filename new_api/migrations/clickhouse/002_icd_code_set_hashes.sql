@@ -0,0 +1,21 @@
+-- Order-independent ICD code-set fingerprints for the exact-match search steps
+-- (icd_exact_match_mode = "hash"). Codes are split on ';', trimmed, upper-cased,
+-- de-duplicated and sorted before hashing, so 'A; B', 'B;A' and 'b; a' collide.
+-- The service hashes the request codes with the same expression.
+-- {table} is the admissions table (CLICKHOUSE_TABLE_NAME).
+
+ALTER TABLE {table}
+    ADD COLUMN IF NOT EXISTS DiseaseCodesHash UInt64
+        MATERIALIZED cityHash64(arraySort(arrayDistinct(arrayFilter(code -> code != '', arrayMap(code -> upper(trimBoth(code)), splitByChar(';', DiseaseClassification)))))),
+    ADD COLUMN IF NOT EXISTS ProcedureCodesHash UInt64
+        MATERIALIZED cityHash64(arraySort(arrayDistinct(arrayFilter(code -> code != '', arrayMap(code -> upper(trimBoth(code)), splitByChar(';', ProcedureClassification))))));
+
+ALTER TABLE {table}
+    ADD INDEX IF NOT EXISTS idx_disease_codes_hash DiseaseCodesHash TYPE bloom_filter(0.01) GRANULARITY 1,
+    ADD INDEX IF NOT EXISTS idx_procedure_codes_hash ProcedureCodesHash TYPE bloom_filter(0.01) GRANULARITY 1;
+
+-- Backfill existing parts (new inserts are materialized automatically)
+ALTER TABLE {table} MATERIALIZE COLUMN DiseaseCodesHash;
+ALTER TABLE {table} MATERIALIZE COLUMN ProcedureCodesHash;
+ALTER TABLE {table} MATERIALIZE INDEX idx_disease_codes_hash;
+ALTER TABLE {table} MATERIALIZE INDEX idx_procedure_codes_hash;
@@ -0,0 +1,15 @@
+-- Integer ranking columns for the step sort keys (search_ranking_mode = "integer").
+-- dateDiff('year'/'day', a, b) counts calendar boundaries, so the service's
+-- age and admission-date distances reduce to differences of these columns.
+-- LengthOfStayDays mirrors toInt32OrZero(LengthOfStay) (0 while undischarged).
+-- {table} is the admissions table (CLICKHOUSE_TABLE_NAME).
+
+ALTER TABLE {table}
+    ADD COLUMN IF NOT EXISTS BirthYear Int32 MATERIALIZED toYear(BirthDate),
+    ADD COLUMN IF NOT EXISTS AdmissionDayNum Int32 MATERIALIZED toRelativeDayNum(AdmissionDate),
+    ADD COLUMN IF NOT EXISTS LengthOfStayDays Int32 MATERIALIZED toInt32OrZero(LengthOfStay);
+
+-- Backfill existing parts (new inserts are materialized automatically)
+ALTER TABLE {table} MATERIALIZE COLUMN BirthYear;
+ALTER TABLE {table} MATERIALIZE COLUMN AdmissionDayNum;
+ALTER TABLE {table} MATERIALIZE COLUMN LengthOfStayDays;
@@ -0,0 +1,24 @@
+-- Projections matching the progressive steps' access paths: steps 1-10 filter
+-- on OrganizationCode plus the exact ICD code sets, steps 11-13 on Archetype or
+-- Region. Each projection is a full re-sorted copy of the table, so it roughly
+-- doubles the table's storage.
+-- Requires migrations 001-003: the materialized columns are listed explicitly
+-- (SELECT * leaves them out), otherwise queries using them skip the projection.
+-- Region is low-cardinality, so p_step_region also serves Archetype-only filters.
+-- {table} is the admissions table (CLICKHOUSE_TABLE_NAME).
+
+ALTER TABLE {table}
+    ADD PROJECTION IF NOT EXISTS p_step_organization (
+        SELECT *, DiseaseCodes, ProcedureCodes, DiseaseCodesHash, ProcedureCodesHash,
+               BirthYear, AdmissionDayNum, LengthOfStayDays
+        ORDER BY OrganizationCode, DiseaseCodesHash, ProcedureCodesHash
+    ),
+    ADD PROJECTION IF NOT EXISTS p_step_region (
+        SELECT *, DiseaseCodes, ProcedureCodes, DiseaseCodesHash, ProcedureCodesHash,
+               BirthYear, AdmissionDayNum, LengthOfStayDays
+        ORDER BY Region, Archetype, DiseaseCodesHash, ProcedureCodesHash
+    );
+
+-- Backfill existing parts (new inserts are projected automatically)
+ALTER TABLE {table} MATERIALIZE PROJECTION p_step_organization;
+ALTER TABLE {table} MATERIALIZE PROJECTION p_step_region;
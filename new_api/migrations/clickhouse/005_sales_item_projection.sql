@@ -0,0 +1,11 @@
+-- sales_item_filtered is read by AdmissionId (billing lookups, single and
+-- batched). This projection keeps a copy sorted by AdmissionId; it is
+-- redundant if the table's own ORDER BY already starts with AdmissionId.
+
+ALTER TABLE sales_item_filtered
+    ADD PROJECTION IF NOT EXISTS p_admission (
+        SELECT * ORDER BY AdmissionId, ItemNetAmount
+    );
+
+-- Backfill existing parts (new inserts are projected automatically)
+ALTER TABLE sales_item_filtered MATERIALIZE PROJECTION p_admission;
@@ -0,0 +1,19 @@
+-- In-memory sales item -> UOM lookup replacing the sales_item_filtered scan in
+-- get_uom_id_for_sales_items. Keys are the string form of sales_item_id, as the
+-- service passes them; only positive UOM ids are kept. Reloaded every 5-10 minutes.
+-- {database} is the service database (CLICKHOUSE_DATABASE). The source query
+-- runs as the default user; add USER/PASSWORD to SOURCE if it cannot read the table.
+
+CREATE DICTIONARY IF NOT EXISTS sales_item_uom (
+    sales_item_id String,
+    uom_id Int64
+)
+PRIMARY KEY sales_item_id
+SOURCE(CLICKHOUSE(QUERY '
+    SELECT toString(item.sales_item_id) AS sales_item_id, any(toInt64(item.uom_id)) AS uom_id
+    FROM {database}.sales_item_filtered AS item
+    WHERE item.uom_id > 0
+    GROUP BY item.sales_item_id
+'))
+LAYOUT(COMPLEX_KEY_HASHED())
+LIFETIME(MIN 300 MAX 600);
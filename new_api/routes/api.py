@@ -19,6 +19,10 @@ async def unified_search_get(
     payload = SearchRequest(query=q, max_results=max_results)
     return await medical_controller.unified_search_with_billing(payload)
 
+@router.get("/medical/search/step-stats")
+async def search_step_stats(limit: int = Query(default=50, ge=1, le=1000, description="Number of request shapes")):
+    return await medical_controller.step_stats(limit)
+
 @router.get("/health-check")
 async def health_check():
     return await health_controller.check_health()
@@ -0,0 +1,79 @@
+"""Apply the versioned ClickHouse migrations in migrations/clickhouse.
+
+Run from new_api/ with the usual .env in place:
+
+    python -m scripts.apply_clickhouse_migrations --list
+    python -m scripts.apply_clickhouse_migrations --wait
+
+Files run in name order, each statement separately, with {table} replaced by
+CLICKHOUSE_TABLE_NAME and {database} by CLICKHOUSE_DATABASE. Applied versions
+are recorded in the clickhouse_migrations table and skipped on later runs.
+The API detects the applied features at its next start.
+"""
+import argparse
+import asyncio
+import re
+from pathlib import Path
+
+from config.clickhouseDb import ClickHouseDB
+from config.setting import env
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations" / "clickhouse"
+HISTORY_TABLE = "clickhouse_migrations"
+
+def load_migrations():
+    return sorted(MIGRATIONS_DIR.glob("*.sql"))
+
+def migration_statements(path: Path):
+    sql = path.read_text().replace("{table}", env.clickhouse_table_name).replace("{database}", env.clickhouse_database)
+    body = "\n".join(line for line in sql.splitlines() if not line.lstrip().startswith("--"))
+    return [statement.strip() for statement in re.split(r";\s*(?:\n|$)", body) if statement.strip()]
+
+async def applied_versions(db: ClickHouseDB):
+    await db.command(
+        f"CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (version String, applied_at DateTime DEFAULT now()) "
+        "ENGINE = MergeTree ORDER BY version"
+    )
+    result = await db.query(f"SELECT DISTINCT version FROM {HISTORY_TABLE}")
+    return {row[0] for row in result.result_rows}
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--list', action='store_true', help="show each migration's status and exit")
+    parser.add_argument('--dry-run', action='store_true', help="print the pending statements without running them")
+    parser.add_argument('--through', help="stop after this version (e.g. 003_ranking_columns)")
+    parser.add_argument('--rerun', action='append', default=[], help="run this version even if recorded as applied")
+    parser.add_argument('--wait', action='store_true', help="wait for MATERIALIZE mutations to finish (mutations_sync=2)")
+    args = parser.parse_args()
+
+    db = ClickHouseDB()
+    await db.initialize()
+    try:
+        applied = await applied_versions(db)
+        settings = {'mutations_sync': 2} if args.wait else None
+
+        for path in load_migrations():
+            version = path.stem
+            pending = version not in applied or version in args.rerun
+
+            if args.list:
+                print(f"{version}: {'pending' if pending else 'applied'}")
+            elif pending:
+                statements = migration_statements(path)
+                print(f"{version}: {len(statements)} statements")
+                for statement in statements:
+                    if args.dry_run:
+                        print(f"{statement};\n")
+                    else:
+                        await db.command(statement, settings=settings)
+                if not args.dry_run:
+                    await db.command(f"INSERT INTO {HISTORY_TABLE} (version) VALUES ({{version:String}})",
+                                     parameters={'version': version})
+
+            if version == args.through:
+                break
+    finally:
+        await db.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""Compare the executor and async HTTP ClickHouse backends under concurrency.
+
+Run from new_api/ with the usual .env in place:
+
+    python -m scripts.benchmark_clickhouse_backends --requests 2000 --concurrency 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from config.clickhouseDb import ClickHouseDB
+from config.setting import env
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run_backend(backend: str, query: str, requests: int, concurrency: int):
+    db = ClickHouseDB(backend)
+    await db.initialize()
+
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await db.query(query)
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+    metrics = db.metrics()
+    await db.shutdown()
+
+    return {
+        'backend': backend,
+        'requests': requests,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'qps': round(requests / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'avg_queue_wait_ms': metrics.get('avg_wait_ms'),
+        'peak_queued': metrics.get('peak_queued')
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--query', default=f"SELECT AdmissionId FROM {env.clickhouse_table_name} LIMIT 20")
+    parser.add_argument('--backends', default="executor,http")
+    args = parser.parse_args()
+
+    for backend in args.backends.split(','):
+        result = await run_backend(backend.strip(), args.query, args.requests, args.concurrency)
+        print(" ".join(f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    asyncio.run(main())
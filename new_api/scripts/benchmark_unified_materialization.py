@@ -0,0 +1,124 @@
+"""Compare row and columnar result materialization for the unified search response.
+
+Builds synthetic ClickHouse results (by default 20 admissions with 60 billing
+items each) and times everything after the queries return: row decoding,
+billing merge, response construction and JSON serialization. No ClickHouse
+connection is needed. Run from new_api/ with the usual .env in place:
+
+    python -m scripts.benchmark_unified_materialization --results 20 --items 60
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+
+from app.controllers.MedicalSearchController import UNIFIED_RESULT_FIELDS, medical_controller
+from app.services.ClickHouseMedicalSearchService import DOCUMENT_COLUMNS, clickhouse_medical_search_service
+from app.services.SalesService import sales_service
+from app.utils.HttpResponseUtils import response_success, response_success_json
+
+BILLING_COLUMNS = ['AdmissionId', 'sales_item_id', 'item_type', 'item_name', 'Quantity', 'ItemNetAmount']
+
+def synthetic_rows(results: int, items: int, seed: int = 7):
+    rng = random.Random(seed)
+    search_rows = []
+    for i in range(results):
+        values = {
+            'AdmissionId': 1000 + i, 'AdmissionTypeId': 1, 'AdmissionTypeName': 'Inpatient',
+            'OrganizationCode': 'SHLV', 'OrganizationId': 10,
+            'AdmissionDate': datetime(2024, 3, 1, 10) + timedelta(days=i),
+            'DischargeDate': datetime(2024, 3, 4, 10) + timedelta(days=i),
+            'PatientId': 50000 + i, 'BirthDate': date(1980, 5, 5), 'Sex': 'M', 'PatientType': 'X',
+            'PatientTypeId': 1, 'PrimaryDoctor': 'dr A', 'PrimaryDoctorUserId': 7, 'Specialty': 'Surgery',
+            'SpecialtyGroup': 'G', 'Region': 'WEST', 'Archetype': 'A1', 'DiseaseClassification': 'K35.8; I10',
+            'ProcedureClassification': '47.01', 'InvoiceClass': 'VIP', 'InvoiceClassId': 1, 'PayerName': 'BPJS',
+            'PayerId': 3, 'PayerType': 'Insurance', 'InvoiceNetAmount': 1234.5, 'Age': 44, 'LengthOfStay': '3',
+            'AnesthesiaDoctor': 'dr X', 'AnesthesiaType': 'GA', 'age_diff': 1, 'date_diff': i,
+            'result_step': f"STEP_{1 + i // 5}"
+        }
+        search_rows.append(tuple(values[name] for name in DOCUMENT_COLUMNS))
+
+    billing_rows = []
+    for i in range(results):
+        amounts = sorted((round(rng.random() * 500, 2) for _ in range(items)), reverse=True)
+        for j, amount in enumerate(amounts):
+            billing_rows.append((1000 + i, str(j), rng.choice(['Drugs', 'Room', 'Lab']), f"item {j}", rng.randint(1, 4), amount))
+    return search_rows, billing_rows
+
+def to_tables(search_rows, billing_rows):
+    search_columns = {name: [row[i] for row in search_rows] for i, name in enumerate(DOCUMENT_COLUMNS)}
+    # The columnar query renders temporal columns as ISO strings server-side
+    for name in ('AdmissionDate', 'DischargeDate', 'BirthDate'):
+        search_columns[name] = [value.isoformat() for value in search_columns[name]]
+    billing_columns = {name: [row[i] for row in billing_rows] for i, name in enumerate(BILLING_COLUMNS)}
+    return pa.table(search_columns), pa.table(billing_columns)
+
+def row_path(search_rows, billing_rows):
+    """Mirror of the batched unified path after its two queries return"""
+    rows = [dict(zip(DOCUMENT_COLUMNS, row)) for row in search_rows]
+    search_result = clickhouse_medical_search_service.format_results_for_api(rows)
+
+    grouped = {}
+    for row in billing_rows:
+        grouped.setdefault(row[0], []).append({
+            'AdmissionId': row[0], 'SalesItemId': row[1], 'ItemType': row[2],
+            'ItemName': row[3], 'Quantity': row[4], 'ItemNetAmount': row[5]
+        })
+    billing_by_admission = {
+        admission_id: medical_controller._billing_data_from_summary(
+            sales_service._build_sales_summary(admission_id, sales_data)
+        )
+        for admission_id, sales_data in grouped.items()
+    }
+
+    results = []
+    for admission in search_result['results']:
+        doc = admission['document']
+        billing_data = billing_by_admission.get(doc.get('AdmissionId'))
+        result = {field: doc.get(column) for field, column in UNIFIED_RESULT_FIELDS}
+        result['billing_data'] = billing_data
+        result['has_billing'] = billing_data is not None
+        result['found_in_step'] = doc.get('result_step', 'UNKNOWN')
+        results.append(result)
+    return response_success({'results': results, 'total_found': len(results)}).body
+
+def columnar_path(search_table, billing_table):
+    results = medical_controller._unified_results_from_columns(search_table, billing_table)
+    return response_success_json({'results': results, 'total_found': len(results)}).body
+
+def measure(name, fn, args, iterations):
+    fn(*args)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        body = fn(*args)
+    per_call_ms = (time.perf_counter() - started) * 1000 / iterations
+
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'path': name, 'per_request_ms': round(per_call_ms, 3), 'peak_alloc_kb': round(peak / 1024, 1),
+            'body_bytes': len(body)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--results', type=int, default=20)
+    parser.add_argument('--items', type=int, default=60)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    search_rows, billing_rows = synthetic_rows(args.results, args.items)
+    search_table, billing_table = to_tables(search_rows, billing_rows)
+
+    for result in (
+        measure('rows', row_path, (search_rows, billing_rows), args.iterations),
+        measure('columnar', columnar_path, (search_table, billing_table), args.iterations)
+    ):
+        print(" ".join(f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    main()
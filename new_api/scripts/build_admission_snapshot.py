@@ -0,0 +1,79 @@
+"""Build or refresh the memory-mapped admission snapshot used by the hot replica.
+
+Run from new_api/ with the usual .env in place:
+
+    python -m scripts.build_admission_snapshot
+    python -m scripts.build_admission_snapshot --refresh
+
+Reads the hot_replica_hospitals / hot_replica_regions partitions of
+CLICKHOUSE_TABLE_NAME and writes a new version under HOT_REPLICA_SNAPSHOT_PATH
+(or --path). --refresh re-reads only the rows admitted since the current
+snapshot's watermark minus hot_replica_lookback_days and merges them in.
+Workers pick the new version up at their next full reload.
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from app.services.ClickHouseMedicalSearchService import RESULT_COLUMNS
+from app.services.HotReplicaService import hot_replica_service, split_partitions
+from app.utils.AdmissionSnapshot import AdmissionSegment, open_snapshot, write_snapshot
+from config.clickhouseDb import clickhouse_db
+from config.setting import env
+
+async def build(path: str, hospitals: frozenset, regions: frozenset, refresh: bool):
+    opened = open_snapshot(path) if refresh else None
+    if opened and (frozenset(opened[1]['hospitals']), frozenset(opened[1]['regions'])) != (hospitals, regions):
+        print("Snapshot holds other partitions, rebuilding it")
+        opened = None
+
+    started = time.perf_counter()
+    if opened:
+        base, manifest = opened
+        watermark = manifest.get('watermark')
+        since = None
+        if watermark:
+            since = hot_replica_service.watermark(base) - timedelta(days=env.hot_replica_lookback_days)
+        delta = await hot_replica_service.fetch_segment(hospitals, regions, since)
+        kept = np.flatnonzero(~np.isin(base.admission_ids(), delta.admission_ids()))
+        segment = AdmissionSegment.concat([base.take(kept), delta])
+        print(f"Merged {delta.rows} re-read rows into {len(kept)} kept rows")
+    else:
+        segment = await hot_replica_service.fetch_segment(hospitals, regions)
+
+    watermark = hot_replica_service.watermark(segment)
+    version = write_snapshot(path, segment, {
+        'table': env.clickhouse_table_name,
+        'hospitals': sorted(hospitals),
+        'regions': sorted(regions),
+        'watermark': watermark.isoformat() if watermark else None,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+    })
+    print(f"Wrote snapshot {version}: {segment.rows} rows in {time.perf_counter() - started:.1f}s")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default=env.hot_replica_snapshot_path)
+    parser.add_argument('--hospitals', default=env.hot_replica_hospitals, help="comma-separated OrganizationCodes")
+    parser.add_argument('--regions', default=env.hot_replica_regions, help="comma-separated Regions")
+    parser.add_argument('--refresh', action='store_true', help="merge recent rows into the current snapshot")
+    args = parser.parse_args()
+
+    if not args.path:
+        parser.error("--path or HOT_REPLICA_SNAPSHOT_PATH is required")
+    hospitals, regions = split_partitions(args.hospitals), split_partitions(args.regions)
+    if not hospitals and not regions:
+        parser.error("no hospitals or regions to snapshot")
+
+    hot_replica_service.result_columns = list(RESULT_COLUMNS)
+    await clickhouse_db.initialize()
+    try:
+        await build(args.path, hospitals, regions, args.refresh)
+    finally:
+        await clickhouse_db.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
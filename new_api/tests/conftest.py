@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Required settings without defaults; a local .env still takes precedence
+REQUIRED_SETTINGS = {
+    'APP_NAME': 'test', 'APP_VERSION': '0', 'APP_ENV': 'test',
+    'FASTAPI_HOST': 'localhost', 'FASTAPI_PORT': '8000', 'ALLOWED_ORIGINS': '*',
+    'RATE_LIMIT_ENABLED': 'false', 'RATE_LIMIT_REQUESTS': '100', 'RATE_LIMIT_WINDOW': '60',
+    'DEFAULT_MAX_RESULTS': '10', 'MAX_SEARCH_RESULTS': '100', 'SEARCH_TIMEOUT': '30',
+    'DEFAULT_SALES_MAX_RESULTS': '10', 'MAX_SALES_RESULTS': '100',
+    'MAX_JOIN_RESULTS': '100', 'JOIN_TIMEOUT': '30', 'SECRET_KEY': 'test',
+    'REDIS_HOST': 'localhost', 'REDIS_PORT': '6379', 'REDIS_DB': '0',
+    'APM_SERVICE_NAME': 'test', 'APM_SERVER_URL': 'http://localhost',
+    'GEMINI_MODEL': 'test', 'PROJECT_NAME': 'test', 'LOCATION_NAME': 'test', 'SERVICE_ACCOUNT_FILE': 'test',
+    'CLICKHOUSE_HOST': 'localhost', 'CLICKHOUSE_PORT': '8123', 'CLICKHOUSE_DATABASE': 'default',
+    'CLICKHOUSE_USERNAME': 'default', 'CLICKHOUSE_PASSWORD': '', 'CLICKHOUSE_TABLE_NAME': 'admissions',
+    'BIGQUERY_PROJECT_ID': 'test', 'BIGQUERY_DATASET_ID': 'test', 'BIGQUERY_TABLE_NAME': 'test'
+}
+for name, value in REQUIRED_SETTINGS.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,67 @@
+"""ByteBoundedLRU keeps within its byte budget and honours its ttl."""
+import sys
+
+from app.utils import CacheUtils
+from app.utils.CacheUtils import ByteBoundedLRU
+
+VALUE_SIZE = sys.getsizeof('a' * 100)
+
+def test_eviction_drops_least_recently_used_entries():
+    cache = ByteBoundedLRU(VALUE_SIZE * 2, ttl=60)
+    cache.set('first', 'a' * 100)
+    cache.set('second', 'b' * 100)
+    cache.get('first')
+    cache.set('third', 'c' * 100)
+
+    assert cache.get('second') is None
+    assert cache.get('first') == 'a' * 100
+    assert cache.get('third') == 'c' * 100
+    assert cache.evictions == 1
+    assert cache.current_bytes == VALUE_SIZE * 2
+
+def test_sets_keep_working_after_evictions():
+    cache = ByteBoundedLRU(VALUE_SIZE + 1, ttl=60)
+    for index in range(10):
+        cache.set(index, str(index) * 100)
+
+    assert len(cache) == 1
+    assert cache.get(9) == '9' * 100
+    assert cache.evictions == 9
+    assert cache.current_bytes == VALUE_SIZE
+
+def test_oversized_values_are_not_stored():
+    cache = ByteBoundedLRU(10)
+    cache.set('key', 'a' * 100)
+
+    assert cache.get('key') is None
+    assert cache.current_bytes == 0
+
+def test_replacing_a_key_does_not_double_count_its_size():
+    cache = ByteBoundedLRU(VALUE_SIZE * 2)
+    cache.set('key', 'a' * 100)
+    cache.set('key', 'b' * 100)
+
+    assert cache.get('key') == 'b' * 100
+    assert cache.current_bytes == VALUE_SIZE
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(CacheUtils.time, 'monotonic', lambda: now[0])
+    cache = ByteBoundedLRU(VALUE_SIZE * 2, ttl=30)
+    cache.set('key', 'a' * 100)
+
+    now[0] += 29
+    assert cache.get('key') == 'a' * 100
+    now[0] += 1
+    assert cache.get('key') is None
+    assert len(cache) == 0
+    assert cache.current_bytes == 0
+
+def test_entries_without_ttl_never_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(CacheUtils.time, 'monotonic', lambda: now[0])
+    cache = ByteBoundedLRU(VALUE_SIZE * 2)
+    cache.set('key', 'a' * 100)
+
+    now[0] += 10 ** 9
+    assert cache.get('key') == 'a' * 100
@@ -0,0 +1,76 @@
+"""Search cache keys depend on the request and on the settings that change results."""
+import pytest
+
+from app.services.ClickHouseMedicalSearchService import clickhouse_medical_search_service
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
+from app.services.SearchCacheService import SearchCacheService
+from config.setting import env
+
+REQUEST = {'icd10': ['K35.8', 'A01'], 'icd9': ['47.01'], 'hospital_code': 'H1', 'gender': 'M'}
+
+@pytest.fixture
+def cache(monkeypatch):
+    # Fresh plan / weights / digest and no detected modes, whatever earlier tests loaded
+    for attribute in ('_plan', '_plan_digest', '_score_weights'):
+        monkeypatch.setattr(clickhouse_medical_search_service, attribute, None)
+    monkeypatch.setattr(clickhouse_schema_service, '_modes', {})
+    return SearchCacheService()
+
+def test_field_order_and_empty_fields_do_not_change_the_key(cache):
+    reordered = {'gender': 'M', 'payer_name': '', 'archetype': None, 'anesthesia_type': [], **REQUEST}
+
+    assert cache.build_key(reordered, 10) == cache.build_key(REQUEST, 10)
+    assert cache.build_key(REQUEST, 10).startswith(SearchCacheService.KEY_PREFIX + ':')
+
+def test_request_values_and_result_count_change_the_key(cache):
+    key = cache.build_key(REQUEST, 10)
+
+    assert cache.build_key({**REQUEST, 'gender': 'F'}, 10) != key
+    assert cache.build_key(REQUEST, 11) != key
+
+def test_icd_order_matters_only_with_code_set_hashes(cache, monkeypatch):
+    reordered = {**REQUEST, 'icd10': ['a01', 'K35.8']}
+    assert cache.build_key(reordered, 10) != cache.build_key(REQUEST, 10)
+
+    monkeypatch.setattr(env, 'icd_exact_match_mode', 'hash')
+    assert cache.build_key(reordered, 10) == cache.build_key(REQUEST, 10)
+
+@pytest.mark.parametrize('setting,value', [
+    ('search_engine', 'scored'),
+    ('icd_match_mode', 'array'),
+    ('search_ranking_mode', 'integer')
+])
+def test_result_changing_settings_change_the_key(cache, monkeypatch, setting, value):
+    key = cache.build_key(REQUEST, 10)
+    monkeypatch.setattr(env, setting, value)
+
+    assert cache.build_key(REQUEST, 10) != key
+
+def test_fallback_modes_key_like_the_mode_actually_used(cache, monkeypatch):
+    key = cache.build_key(REQUEST, 10)
+    monkeypatch.setattr(env, 'icd_match_mode', 'array')
+    monkeypatch.setattr(clickhouse_schema_service, '_modes', {'icd_match_mode': 'string'})
+
+    assert cache.build_key(REQUEST, 10) == key
+
+def test_search_plan_changes_the_key(cache, monkeypatch, tmp_path):
+    key = cache.build_key(REQUEST, 10)
+    plan_path = tmp_path / "plan.json"
+    plan_path.write_text('["STEP_1", "STEP_10"]')
+    monkeypatch.setattr(env, 'search_plan_path', str(plan_path))
+    monkeypatch.setattr(clickhouse_medical_search_service, '_plan', None)
+    monkeypatch.setattr(clickhouse_medical_search_service, '_plan_digest', None)
+
+    assert cache.build_key(REQUEST, 10) != key
+
+def test_score_weights_change_the_key_only_when_scored(cache, monkeypatch):
+    key = cache.build_key(REQUEST, 10)
+    monkeypatch.setattr(env, 'search_score_weights', '{"gender": 9}')
+    assert cache.build_key(REQUEST, 10) == key
+
+    monkeypatch.setattr(env, 'search_engine', 'scored')
+    scored_key = cache.build_key(REQUEST, 10)
+    monkeypatch.setattr(clickhouse_medical_search_service, '_score_weights', None)
+    monkeypatch.setattr(env, 'search_score_weights', '{"gender": 3}')
+
+    assert cache.build_key(REQUEST, 10) != scored_key
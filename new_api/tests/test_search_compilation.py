@@ -0,0 +1,117 @@
+"""Step pruning and the SQL compiled for the single-query and scored engines."""
+import re
+
+import pytest
+
+from app.services.ClickHouseMedicalSearchService import (
+    SCORED_STEP, STEP_RESULT_LIMIT, ClickHouseMedicalSearchService
+)
+from app.services.ClickHouseSchemaService import clickhouse_schema_service
+from app.services.SearchPlan import DEFAULT_SCORE_WEIGHTS
+from config.setting import env
+
+FULL_REQUEST = {
+    'icd10': ['K35.8'], 'icd9': ['47.01'],
+    'hospital_code': 'H1', 'payer_name': 'BPJS', 'payer_type': 'Insurance',
+    'primary_doctor': 'dr A', 'doctor_specialty': 'Surgery', 'admission_type': 'Inpatient',
+    'gender': 'M', 'archetype': 'A1', 'hospital_region': 'WEST',
+    'anesthesia_doctor': 'dr Y', 'anesthesia_type': 'GA',
+    'birthdate': '1980-05-05', 'admission_date': '2024-03-03 10:00:00'
+}
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(clickhouse_schema_service, 'features', {})
+    monkeypatch.setattr(clickhouse_schema_service, '_modes', {})
+    return ClickHouseMedicalSearchService()
+
+def plan(service, request, max_results=10):
+    active, pruned = service._plan_steps(service._calculate_age_and_los(request), max_results)
+    return [step['name'] for step in active], pruned
+
+def test_steps_repeating_an_earlier_steps_conditions_are_pruned(service):
+    active, pruned = plan(service, FULL_REQUEST)
+
+    assert pruned == [
+        {'step': 'STEP_6', 'reason': 'redundant', 'covered_by': 'STEP_5'},
+        {'step': 'STEP_12', 'reason': 'redundant', 'covered_by': 'STEP_11'}
+    ]
+    assert len(active) == 15
+
+def test_redundant_steps_are_kept_when_step_limits_could_cut_results(service):
+    active, pruned = plan(service, FULL_REQUEST, STEP_RESULT_LIMIT + 1)
+
+    assert pruned == []
+    assert active == [f"STEP_{number}" for number in range(1, 18)]
+
+def test_steps_comparing_against_blank_input_are_pruned(service):
+    active, pruned = plan(service, {**FULL_REQUEST, 'payer_name': '', 'archetype': '  '})
+
+    assert active == ['STEP_1', 'STEP_9', 'STEP_10', 'STEP_13', 'STEP_14', 'STEP_15', 'STEP_16', 'STEP_17']
+    assert {entry['step']: entry['fields'] for entry in pruned} == {
+        **{f"STEP_{number}": ['payer_name'] for number in range(2, 9)},
+        'STEP_11': ['archetype'], 'STEP_12': ['archetype']
+    }
+    assert all(entry['reason'] == 'blank_input' for entry in pruned)
+
+def test_pruned_steps_are_not_reported_for_the_scored_engine(service, monkeypatch):
+    monkeypatch.setattr(env, 'search_engine', 'scored')
+
+    assert service.pruned_steps({**FULL_REQUEST, 'payer_name': ''}) == []
+
+def test_single_query_tiers_every_active_step(service):
+    request = service._calculate_age_and_los(FULL_REQUEST)
+    query = service._build_single_query(request, 10)
+    active, _ = service._plan_steps(request, 10)
+
+    labels = re.search(r"arrayElement\(\[(.*?)\], result_tier\)", query).group(1)
+    assert labels == ", ".join(f"'{step['name']}'" for step in active)
+    assert query.count("result_tier = 1,") >= 1
+    assert re.search(r"ORDER BY\s+result_tier ASC", query)
+    assert re.search(r"AdmissionId ASC\s+LIMIT 1 BY AdmissionId\s+LIMIT 10\s*$", query)
+    # Values are bound parameters, never inlined
+    assert "'H1'" not in query and "{hospital_code:String}" in query
+
+def test_single_query_is_memoized_per_request_shape(service):
+    request = service._calculate_age_and_los(FULL_REQUEST)
+    other_values = service._calculate_age_and_los({**FULL_REQUEST, 'hospital_code': 'H2', 'gender': 'F'})
+
+    assert service._build_single_query(request, 10) is service._build_single_query(other_values, 10)
+    assert service._build_single_query(request, 10) != service._build_single_query(request, 5)
+
+def test_single_query_without_active_steps_matches_nothing(service):
+    query = service._compile_single_query([], {}, 10)
+
+    assert "0 as result_tier" in query
+    assert "WHERE result_tier > 0" in query
+
+def test_scored_query_weighs_only_the_criteria_given(service):
+    request = service._calculate_age_and_los({**FULL_REQUEST, 'payer_name': '', 'payer_type': ''})
+    query = service._compile_scored_query(request, 10)
+
+    weights = DEFAULT_SCORE_WEIGHTS
+    available = (weights['icd10_exact'] + weights['icd10_overlap'] + weights['icd9_exact'] + weights['icd9_overlap']
+                 + weights['hospital'] + weights['doctor'] + weights['admission_type'] + weights['gender']
+                 + weights['age'])
+    assert f") / {available:g}, 2) as similarity_score" in query
+    assert "{payer_name:String}" not in query and "{payer_type:String}" not in query
+    # Only the best level of a hierarchy counts
+    assert "multiIf(OrganizationCode = {hospital_code:String}, 10, Archetype = {archetype:String}, 6, " \
+           "Region = {hospital_region:String}, 3, 0)" in query
+    assert f"'{SCORED_STEP}' as result_step" in query
+    assert re.search(r"ORDER BY\s+similarity_score DESC,\s+age_diff ASC,\s+date_diff ASC,\s+AdmissionId ASC\s+LIMIT 10", query)
+
+def test_scored_query_candidates_share_a_code(service):
+    request = service._calculate_age_and_los(FULL_REQUEST)
+    where_clause = re.search(r"WHERE (.*?)\n", service._compile_scored_query(request, 10)).group(1)
+    assert "{icd10:Array(String)}" in where_clause and "{icd9:Array(String)}" in where_clause and " OR " in where_clause
+
+    request = service._calculate_age_and_los({**FULL_REQUEST, 'icd10': [], 'icd9': []})
+    assert "WHERE 1=1" in service._compile_scored_query(request, 10)
+
+def test_scored_query_drops_zero_weights(service, monkeypatch):
+    monkeypatch.setattr(env, 'search_score_weights', '{"gender": 0, "age": 0}')
+    query = service._compile_scored_query(service._calculate_age_and_los(FULL_REQUEST), 10)
+
+    assert "{gender:String}" not in query
+    assert "age_diff / 20" not in query
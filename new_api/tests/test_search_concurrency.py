@@ -0,0 +1,106 @@
+"""Concurrent searches keep their exclusion sets and results to themselves.
+
+The fake ClickHouse answers each step query from the request's hospital
+code alone: every step returns a few admissions of that hospital, one of
+them already returned by the previous step, so the exclusion set decides
+what each step adds. Replies are delayed at random so the searches
+interleave.
+"""
+import asyncio
+import random
+import re
+
+import pytest
+
+from app.services.ClickHouseMedicalSearchService import (
+    RESULT_COLUMNS, STEP_RESULT_LIMIT, ClickHouseMedicalSearchService
+)
+from config.setting import env
+
+SEARCHES = 40
+ROWS_PER_STEP = 4
+COLUMN_NAMES = RESULT_COLUMNS + ['age_diff', 'date_diff', 'result_step']
+
+class FakeResult:
+    def __init__(self, column_names, result_rows):
+        self.column_names = column_names
+        self.result_rows = result_rows
+
+class FakeClickHouse:
+    def __init__(self, jitter: bool):
+        self.jitter = jitter
+        self.random = random.Random(7)
+
+    async def query(self, query, parameters=None, settings=None):
+        if self.jitter:
+            await asyncio.sleep(self.random.random() * 0.002)
+
+        hospital = int(parameters['hospital_code'][1:])
+        step_number = int(re.search(r"'STEP_(\d+)' as result_step", query).group(1))
+        limit = parameters['step_limit'] if '{step_limit' in query else int(re.search(r"LIMIT (\d+)", query).group(1))
+        excluded = set(parameters.get('excluded_ids', []))
+
+        # One admission of the previous step, then this step's own
+        admission_ids = [hospital * 100000 + (step_number - 1) * 100] + [
+            hospital * 100000 + step_number * 100 + row for row in range(1, ROWS_PER_STEP)
+        ]
+        rows = []
+        for admission_id in admission_ids:
+            if admission_id in excluded:
+                continue
+            values = {name: None for name in COLUMN_NAMES}
+            values.update({
+                'AdmissionId': admission_id,
+                'OrganizationCode': parameters['hospital_code'],
+                'age_diff': 0,
+                'date_diff': admission_id % 7,
+                'result_step': f"STEP_{step_number}"
+            })
+            rows.append(tuple(values[name] for name in COLUMN_NAMES))
+        return FakeResult(COLUMN_NAMES, rows[:limit])
+
+    async def kill_queries(self, query_ids):
+        pass
+
+def search_request(hospital: int):
+    return {
+        'icd10': ['K35.8'], 'icd9': ['47.01'],
+        'hospital_code': f"H{hospital}", 'payer_name': 'BPJS', 'payer_type': 'Insurance',
+        'primary_doctor': 'dr A', 'doctor_specialty': 'Surgery', 'admission_type': 'Inpatient',
+        'gender': 'M', 'archetype': 'A1', 'hospital_region': 'WEST',
+        'birthdate': '1980-05-05', 'admission_date': '2024-03-03 10:00:00'
+    }
+
+async def run_searches(service, requests, concurrent: bool):
+    if concurrent:
+        return await asyncio.gather(*(service.search_similar_admissions(request, max_results)
+                                      for request, max_results in requests))
+    return [await service.search_similar_admissions(request, max_results) for request, max_results in requests]
+
+@pytest.mark.parametrize('engine,exclusion_mode', [
+    ('progressive', 'server'), ('progressive', 'client'), ('parallel', 'server')
+])
+def test_concurrent_searches_match_serial_runs(monkeypatch, engine, exclusion_mode):
+    monkeypatch.setattr(env, 'search_engine', engine)
+    monkeypatch.setattr(env, 'search_exclusion_mode', exclusion_mode)
+    requests = [(search_request(hospital), 5 + hospital % STEP_RESULT_LIMIT) for hospital in range(1, SEARCHES + 1)]
+
+    service = ClickHouseMedicalSearchService()
+    service.db = FakeClickHouse(jitter=False)
+    serial = asyncio.run(run_searches(service, requests, concurrent=False))
+
+    service = ClickHouseMedicalSearchService()
+    service.db = FakeClickHouse(jitter=True)
+    concurrent = asyncio.run(run_searches(service, requests, concurrent=True))
+
+    for (request, max_results), expected, results in zip(requests, serial, concurrent):
+        hospital = int(request['hospital_code'][1:])
+        admission_ids = [result['AdmissionId'] for result in results]
+
+        assert [(result['AdmissionId'], result['result_step']) for result in results] == \
+               [(result['AdmissionId'], result['result_step']) for result in expected]
+        # Several steps contributed, so the exclusion set was exercised
+        assert len(expected) > ROWS_PER_STEP
+        # No admission of another search, and none twice
+        assert all(admission_id // 100000 == hospital for admission_id in admission_ids)
+        assert len(set(admission_ids)) == len(admission_ids)
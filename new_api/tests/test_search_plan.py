@@ -0,0 +1,81 @@
+"""Search plan and score weight validation."""
+import json
+
+import pytest
+
+from app.services.SearchPlan import (
+    DEFAULT_SCORE_WEIGHTS, DEFAULT_SEARCH_PLAN, load_score_weights, load_search_plan
+)
+
+def write_plan(tmp_path, steps):
+    path = tmp_path / "plan.json"
+    path.write_text(json.dumps(steps))
+    return str(path)
+
+def test_default_plan_has_the_seventeen_steps_in_order():
+    plan = load_search_plan()
+
+    assert [step['name'] for step in plan] == [f"STEP_{number}" for number in range(1, 18)]
+    assert plan[0]['skip_empty'] and not plan[1]['skip_empty']
+    assert plan[14]['icd'] == 'mixed'
+
+def test_unknown_plan_name_is_rejected():
+    with pytest.raises(ValueError, match="Unknown search plan"):
+        load_search_plan('missing')
+
+def test_plan_file_reorders_default_steps_and_adds_custom_ones(tmp_path):
+    path = write_plan(tmp_path, ['STEP_10', {
+        'name': 'REGION_ONLY', 'icd': 'partial',
+        'filters': [['Region', 'hospital_region']],
+        'order_by': [['priority', 'Sex', 'gender'], 'age_diff']
+    }, 'STEP_1'])
+
+    plan = load_search_plan('missing', path)
+
+    assert [step['name'] for step in plan] == ['STEP_10', 'REGION_ONLY', 'STEP_1']
+    assert plan[1] == {
+        'name': 'REGION_ONLY', 'description': '', 'icd': 'partial', 'skip_empty': False,
+        'filters': [('Region', 'hospital_region')],
+        'order_by': [('priority', 'Sex', 'gender'), 'age_diff']
+    }
+    assert plan[0]['filters'] == DEFAULT_SEARCH_PLAN[9]['filters']
+
+@pytest.mark.parametrize('steps,message', [
+    ([], "non-empty list"),
+    ({'name': 'STEP_1'}, "non-empty list"),
+    (['STEP_1', 'STEP_1'], "repeats step names"),
+    (['STEP_99'], "Unknown search step"),
+    ([42], "must be a name or an object"),
+    ([{'name': 'bad name; DROP'}], "Invalid search step name"),
+    ([{'name': 'X', 'icd': 'fuzzy'}], "unknown icd mode"),
+    ([{'name': 'X', 'filters': [['PatientId', 'hospital_code']]}], "unsupported filter"),
+    ([{'name': 'X', 'filters': [['Region', 'patient_id']]}], "unsupported filter"),
+    ([{'name': 'X', 'order_by': ['rand()']}], "unknown sort key"),
+    ([{'name': 'X', 'order_by': [['desc', 'Sex', 'gender']]}], "unsupported sort key")
+])
+def test_invalid_plan_files_are_rejected(tmp_path, steps, message):
+    with pytest.raises(ValueError, match=message):
+        load_search_plan('default', write_plan(tmp_path, steps))
+
+def test_score_weights_default_without_overrides():
+    assert load_score_weights() == DEFAULT_SCORE_WEIGHTS
+    assert load_score_weights(None) is not DEFAULT_SCORE_WEIGHTS
+
+def test_score_weight_overrides_replace_defaults():
+    weights = load_score_weights('{"hospital": 12.5, "gender": 0}')
+
+    assert weights['hospital'] == 12.5
+    assert weights['gender'] == 0
+    assert weights['icd10_exact'] == DEFAULT_SCORE_WEIGHTS['icd10_exact']
+
+@pytest.mark.parametrize('overrides,message', [
+    ('[1, 2]', "JSON object"),
+    ('{"shoe_size": 3}', "Unknown score weight"),
+    ('{"age": -1}', "non-negative number"),
+    ('{"age": "4"}', "non-negative number"),
+    ('{"age": true}', "non-negative number"),
+    (json.dumps({name: 0 for name in DEFAULT_SCORE_WEIGHTS}), "At least one score weight")
+])
+def test_invalid_score_weights_are_rejected(overrides, message):
+    with pytest.raises(ValueError, match=message):
+        load_score_weights(overrides)
@@ -0,0 +1,85 @@
+"""SingleFlight runs concurrent identical calls once and shares the outcome."""
+import asyncio
+
+import pytest
+
+from app.utils.SingleFlight import SingleFlight
+
+def fetch_value(value, delay=0.0):
+    async def fetch():
+        await asyncio.sleep(delay)
+        return value
+    return fetch
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight('test-share')
+    executions = []
+
+    async def fetch():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return {'value': 42}
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+
+    assert len(executions) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.metrics() == {'calls': 5, 'executions': 1, 'coalesced': 4, 'in_flight': 0}
+
+def test_different_keys_run_separately():
+    flight = SingleFlight('test-keys')
+
+    async def main():
+        return await asyncio.gather(flight.do('a', fetch_value('a')), flight.do('b', fetch_value('b')))
+
+    assert asyncio.run(main()) == ['a', 'b']
+    assert flight.executions == 2
+
+def test_calls_after_completion_execute_again():
+    flight = SingleFlight('test-sequential')
+
+    async def main():
+        await flight.do('key', fetch_value(1))
+        return await flight.do('key', fetch_value(2))
+
+    assert asyncio.run(main()) == 2
+    assert flight.executions == 2
+
+def test_exceptions_reach_every_waiting_caller():
+    flight = SingleFlight('test-errors')
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.executions == 1
+    assert flight.metrics()['in_flight'] == 0
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight('test-cancel')
+
+    async def main():
+        first = asyncio.ensure_future(flight.do('key', fetch_value('done', delay=0.02)))
+        second = asyncio.ensure_future(flight.do('key', fetch_value('unused')))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 'done'
+    assert flight.executions == 1
+
+def test_flights_are_registered_by_name():
+    flight = SingleFlight('test-registry')
+
+    assert SingleFlight.registry['test-registry'] is flight